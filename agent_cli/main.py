@@ -1,6 +1,8 @@
 import json
 import os
 import sys
+import time
+import uuid
 from collections import defaultdict
 from datetime import datetime, timezone
 
@@ -19,7 +21,7 @@ def _load_requests():
 def _print_help():
     print("Missing required env vars.")
     print("Required: AGENT_BASE_URL, AGENT_TOKEN, IMPORTACION_ID")
-    print("Optional: AGENT_DRY_RUN=1")
+    print("Optional: AGENT_DRY_RUN=1, AGENT_CACHE_DIR (default ~/.anexo_agent)")
     print("Example (PowerShell):")
     print('$env:AGENT_BASE_URL="http://localhost:8000"')
     print('$env:AGENT_TOKEN="TOKEN_DEL_SAAS"')
@@ -33,6 +35,9 @@ def load_env():
     importacion_id_raw = os.getenv("IMPORTACION_ID", "").strip()
     dry_run_raw = os.getenv("AGENT_DRY_RUN", "").strip().lower()
     dry_run = dry_run_raw in {"1", "true", "yes", "y"}
+    cache_dir = os.getenv("AGENT_CACHE_DIR", "").strip() or os.path.join(
+        os.path.expanduser("~"), ".anexo_agent"
+    )
 
     if not base_url or not token or not importacion_id_raw:
         _print_help()
@@ -49,21 +54,40 @@ def load_env():
         "token": token,
         "importacion_id": importacion_id,
         "dry_run": dry_run,
+        "cache_dir": cache_dir,
     }
 
 
-def _request(requests, method: str, url: str, headers: dict, payload=None):
-    try:
-        return requests.request(
-            method,
-            url,
-            headers=headers,
-            json=payload,
-            timeout=15,
-        )
-    except requests.RequestException as exc:
-        print(f"Request failed: {exc}")
-        sys.exit(1)
+def _request(
+    requests,
+    method: str,
+    url: str,
+    headers: dict,
+    payload=None,
+    attempts: int = 1,
+    timeout: int = 15,
+):
+    """Send a request, retrying errors and 5xx responses up to ``attempts`` times.
+
+    Only pass ``attempts`` > 1 for requests that are safe to repeat.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            response = requests.request(
+                method,
+                url,
+                headers=headers,
+                json=payload,
+                timeout=timeout,
+            )
+        except requests.RequestException as exc:
+            if attempt == attempts:
+                print(f"Request failed: {exc}")
+                sys.exit(1)
+        else:
+            if response.status_code < 500 or attempt == attempts:
+                return response
+        time.sleep(attempt)
 
 
 def _parse_json_or_exit(response):
@@ -89,9 +113,50 @@ def api_get_me(requests, base_url: str, headers: dict):
     return _parse_json_or_exit(response)
 
 
-def api_get_plan(requests, base_url: str, importacion_id: int, headers: dict):
+def _plan_cache_path(cache_dir: str, importacion_id: int) -> str:
+    return os.path.join(cache_dir, f"plan-{importacion_id}.json")
+
+
+def _load_cached_plan(path: str, url: str):
+    try:
+        with open(path, encoding="utf-8") as fh:
+            cached = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("url") != url:
+        return None
+    if not cached.get("etag") or not isinstance(cached.get("plan"), dict):
+        return None
+    return cached
+
+
+def _store_cached_plan(path: str, url: str, etag: str, plan) -> None:
+    tmp_path = f"{path}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump({"url": url, "etag": etag, "plan": plan}, fh, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        print(f"Could not cache plan: {exc}")
+
+
+def api_get_plan(
+    requests,
+    base_url: str,
+    importacion_id: int,
+    headers: dict,
+    cache_dir: str | None = None,
+):
     url = f"{base_url}/api/agent/importaciones/{importacion_id}/plan.json"
+    cache_path = _plan_cache_path(cache_dir, importacion_id) if cache_dir else None
+    cached = _load_cached_plan(cache_path, url) if cache_path else None
+    if cached:
+        headers = {**headers, "If-None-Match": cached["etag"]}
     response = _request(requests, "GET", url, headers=headers)
+    if response.status_code == 304 and cached:
+        print("Plan sin cambios (caché local).")
+        return cached["plan"]
     if response.status_code == 403:
         print("Token sin acceso a esta importación.")
         sys.exit(1)
@@ -102,25 +167,133 @@ def api_get_plan(requests, base_url: str, importacion_id: int, headers: dict):
         print(f"Error {response.status_code} for GET {url}")
         print(response.text)
         sys.exit(1)
-    return _parse_json_or_exit(response)
+    plan = _parse_json_or_exit(response)
+    etag = response.headers.get("ETag")
+    if cache_path and etag and isinstance(plan, dict):
+        _store_cached_plan(cache_path, url, etag, plan)
+    return plan
+
+
+def api_get_plan_page(
+    requests, base_url: str, importacion_id: int, headers: dict, cursor: str
+):
+    # Cursors are URL-safe base64, so they need no further quoting.
+    url = (
+        f"{base_url}/api/agent/importaciones/{importacion_id}/plan/acciones"
+        f"?cursor={cursor}"
+    )
+    response = _request(requests, "GET", url, headers=headers)
+    if response.status_code >= 400:
+        print(f"Error {response.status_code} for GET {url}")
+        print(response.text)
+        sys.exit(1)
+    return _parse_json_or_exit(response) or {}
 
 
-def api_post_event(
+def api_get_full_plan(
     requests,
     base_url: str,
+    importacion_id: int,
     headers: dict,
-    payload: dict,
-    dry_run: bool,
+    cache_dir: str | None = None,
 ):
-    if dry_run:
-        print(f"[dry-run] event {payload.get('step')}:{payload.get('status')}")
-        return
-    url = f"{base_url}/api/agent/events"
-    response = _request(requests, "POST", url, headers=headers, payload=payload)
+    """plan.json (ETag-cached) plus every page that follows its ``next_cursor``."""
+    plan = api_get_plan(requests, base_url, importacion_id, headers, cache_dir)
+    cursor = plan.get("next_cursor")
+    if not cursor:
+        return plan
+    acciones = list(plan.get("acciones", []))
+    while cursor:
+        page = api_get_plan_page(requests, base_url, importacion_id, headers, cursor)
+        acciones.extend(page.get("acciones", []))
+        cursor = page.get("next_cursor")
+    return {**plan, "acciones": acciones, "total_items": len(acciones)}
+
+
+EVENT_BATCH_SIZE = 500
+EVENT_BATCH_ATTEMPTS = 3
+EVENT_FLUSH_INTERVAL = 30
+
+
+def api_post_events_batch(
+    requests, base_url: str, headers: dict, importacion_id: int, events: list
+):
+    """POST one batch, retrying with the same idempotency keys on failure."""
+    url = f"{base_url}/api/agent/events/batch"
+    response = _request(
+        requests,
+        "POST",
+        url,
+        headers=headers,
+        payload={"importacion_id": importacion_id, "events": events},
+        attempts=EVENT_BATCH_ATTEMPTS,
+        timeout=30,
+    )
     if response.status_code >= 400:
         print(f"Error {response.status_code} for POST {url}")
         print(response.text)
         sys.exit(1)
+    return _parse_json_or_exit(response)
+
+
+class EventBatch:
+    """Queues events and sends them in as few requests as possible.
+
+    Each event gets its idempotency key when queued, so a retried request
+    never records an event twice. The queue is sent once it holds
+    ``EVENT_BATCH_SIZE`` events or its oldest event is ``EVENT_FLUSH_INTERVAL``
+    seconds old; callers flush the rest in a ``finally`` block.
+    """
+
+    def __init__(self, requests, config: dict, headers: dict):
+        self.requests = requests
+        self.base_url = config["base_url"]
+        self.importacion_id = config["importacion_id"]
+        self.dry_run = config["dry_run"]
+        self.headers = headers
+        self.events = []
+        self.oldest = None
+
+    def add(self, step: str, status: str, message: str, factura_id=None):
+        event = {
+            "step": step,
+            "status": status,
+            "message": message,
+            "ts": _now_iso(),
+            "idempotency_key": uuid.uuid4().hex,
+        }
+        if factura_id:
+            event["factura_id"] = factura_id
+        if not self.events:
+            self.oldest = time.monotonic()
+        self.events.append(event)
+        if (
+            len(self.events) >= EVENT_BATCH_SIZE
+            or time.monotonic() - self.oldest >= EVENT_FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def flush(self):
+        events, self.events = self.events, []
+        if self.dry_run:
+            for event in events:
+                print(f"[dry-run] event {event['step']}:{event['status']}")
+            return
+        for start in range(0, len(events), EVENT_BATCH_SIZE):
+            chunk = events[start : start + EVENT_BATCH_SIZE]
+            result = api_post_events_batch(
+                self.requests,
+                self.base_url,
+                self.headers,
+                self.importacion_id,
+                chunk,
+            )
+            for rejected in (result or {}).get("rejected", []):
+                event = chunk[rejected["index"]]
+                print(
+                    f"Evento rechazado ({event['step']}, "
+                    f"factura_id={event.get('factura_id')}): {rejected['detail']}"
+                )
 
 
 def group_by_provider(acciones):
@@ -152,23 +325,18 @@ def run_assisted_flow(config, plan, requests):
         "Authorization": f"Bearer {config['token']}",
         "Content-Type": "application/json",
     }
-    base_url = config["base_url"]
-    importacion_id = config["importacion_id"]
-    dry_run = config["dry_run"]
+    batch = EventBatch(requests, config, headers)
+    try:
+        _run_providers(acciones, total_items, batch)
+    finally:
+        # An interrupted run still sends what the operator already did.
+        batch.flush()
+    return 0
 
-    api_post_event(
-        requests,
-        base_url,
-        headers,
-        {
-            "importacion_id": importacion_id,
-            "step": "plan_fetch",
-            "status": "ok",
-            "message": f"Plan con {total_items} acciones.",
-            "ts": _now_iso(),
-        },
-        dry_run,
-    )
+
+def _run_providers(acciones, total_items, batch):
+    batch.add("plan_fetch", "ok", f"Plan con {total_items} acciones.")
+    batch.flush()
 
     grouped = group_by_provider(acciones)
     for provider_id, items in grouped.items():
@@ -197,20 +365,11 @@ def run_assisted_flow(config, plan, requests):
                     f"confianza={item.get('confianza')}"
                 )
 
-        api_post_event(
-            requests,
-            base_url,
-            headers,
-            {
-                "importacion_id": importacion_id,
-                "step": "provider_start",
-                "status": "ok",
-                "message": f"Proveedor {provider_id} ({len(items)} facturas).",
-                "ts": _now_iso(),
-            },
-            dry_run,
+        batch.add(
+            "provider_start", "ok", f"Proveedor {provider_id} ({len(items)} facturas)."
         )
 
+        applied_all = False
         if allow_apply_all:
             answer = input("Aplicar todas las facturas? [a/N]: ").strip().lower()
             if answer == "a":
@@ -218,91 +377,37 @@ def run_assisted_flow(config, plan, requests):
                     factura_id = item.get("factura_id")
                     if not factura_id:
                         continue
-                    api_post_event(
-                        requests,
-                        base_url,
-                        headers,
-                        {
-                            "importacion_id": importacion_id,
-                            "factura_id": factura_id,
-                            "step": "apply",
-                            "status": "ok",
-                            "message": "Aplicado en lote.",
-                            "ts": _now_iso(),
-                        },
-                        dry_run,
-                    )
+                    batch.add("apply", "ok", "Aplicado en lote.", factura_id=factura_id)
                 print("Aplicadas todas las facturas del proveedor.")
-                api_post_event(
-                    requests,
-                    base_url,
-                    headers,
-                    {
-                        "importacion_id": importacion_id,
-                        "step": "provider_done",
-                        "status": "ok",
-                        "message": f"Proveedor {provider_id} completado.",
-                        "ts": _now_iso(),
-                    },
-                    dry_run,
-                )
-                continue
-
-        for item in items:
-            factura_id = item.get("factura_id")
-            clave = item.get("clave_acceso")
-            categoria = item.get("categoria_nombre")
-            print(
-                f"Factura {factura_id} clave={clave} categoria={categoria} "
-                f"confianza={item.get('confianza')}"
-            )
-            answer = input("Aplicar? [y/N]: ").strip().lower()
-            if answer == "y":
-                api_post_event(
-                    requests,
-                    base_url,
-                    headers,
-                    {
-                        "importacion_id": importacion_id,
-                        "factura_id": factura_id,
-                        "step": "apply",
-                        "status": "ok",
-                        "message": f"Categoria {categoria} aplicada (simulado).",
-                        "ts": _now_iso(),
-                    },
-                    dry_run,
-                )
-            else:
-                api_post_event(
-                    requests,
-                    base_url,
-                    headers,
-                    {
-                        "importacion_id": importacion_id,
-                        "factura_id": factura_id,
-                        "step": "skip",
-                        "status": "skipped",
-                        "message": "Factura omitida por operador.",
-                        "ts": _now_iso(),
-                    },
-                    dry_run,
-                )
+                applied_all = True
 
-        api_post_event(
-            requests,
-            base_url,
-            headers,
-            {
-                "importacion_id": importacion_id,
-                "step": "provider_done",
-                "status": "ok",
-                "message": f"Proveedor {provider_id} completado.",
-                "ts": _now_iso(),
-            },
-            dry_run,
-        )
+        if not applied_all:
+            for item in items:
+                factura_id = item.get("factura_id")
+                clave = item.get("clave_acceso")
+                categoria = item.get("categoria_nombre")
+                print(
+                    f"Factura {factura_id} clave={clave} categoria={categoria} "
+                    f"confianza={item.get('confianza')}"
+                )
+                answer = input("Aplicar? [y/N]: ").strip().lower()
+                if answer == "y":
+                    batch.add(
+                        "apply",
+                        "ok",
+                        f"Categoria {categoria} aplicada (simulado).",
+                        factura_id=factura_id,
+                    )
+                else:
+                    batch.add(
+                        "skip",
+                        "skipped",
+                        "Factura omitida por operador.",
+                        factura_id=factura_id,
+                    )
 
-    return 0
+        batch.add("provider_done", "ok", f"Proveedor {provider_id} completado.")
+        batch.flush()
 
 
 def main():
@@ -317,11 +422,12 @@ def main():
     me = api_get_me(requests, config["base_url"], headers)
     print(f"Token OK. Expires: {me.get('expires_at')}")
 
-    plan = api_get_plan(
+    plan = api_get_full_plan(
         requests,
         config["base_url"],
         config["importacion_id"],
         headers,
+        cache_dir=config["cache_dir"],
     )
 
     exit_code = run_assisted_flow(config, plan, requests)
@@ -0,0 +1,35 @@
+"""Bearer-token authentication for the agent and export APIs."""
+import hashlib
+
+from django.http import JsonResponse
+from django.utils import timezone
+
+from agente.models import AgentToken
+
+
+def hash_token(raw_token: str) -> str:
+    return hashlib.sha256(raw_token.encode("utf-8")).hexdigest()
+
+
+def get_bearer_token(request):
+    header = request.META.get("HTTP_AUTHORIZATION", "")
+    if not header.startswith("Bearer "):
+        return None
+    return header.replace("Bearer ", "", 1).strip() or None
+
+
+def get_valid_token(request):
+    raw_token = get_bearer_token(request)
+    if not raw_token:
+        return None
+    token_hash = hash_token(raw_token)
+    token = AgentToken.objects.filter(token_hash=token_hash).first()
+    if not token or token.is_revoked() or token.is_expired():
+        return None
+    token.last_seen_at = timezone.now()
+    token.save(update_fields=["last_seen_at"])
+    return token
+
+
+def unauthorized(message="Token inválido"):
+    return JsonResponse({"detail": message}, status=401)
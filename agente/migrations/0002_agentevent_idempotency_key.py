@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("agente", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="agentevent",
+            name="idempotency_key",
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name="agentevent",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("idempotency_key", ""), _negated=True),
+                fields=("token", "idempotency_key"),
+                name="agent_event_idempotency_uniq",
+            ),
+        ),
+    ]
@@ -60,7 +60,17 @@ class AgentEvent(models.Model):
     status = models.CharField(max_length=80)
     message = models.TextField(blank=True)
     event_ts = models.DateTimeField(null=True, blank=True)
+    idempotency_key = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["token", "idempotency_key"],
+                condition=~models.Q(idempotency_key=""),
+                name="agent_event_idempotency_uniq",
+            )
+        ]
+
     def __str__(self) -> str:
         return f"{self.step} ({self.status})"
@@ -10,7 +10,17 @@ urlpatterns = [
         views.agent_plan_json,
         name="agente-api-plan-json",
     ),
+    path(
+        "api/agent/importaciones/<int:importacion_id>/plan/acciones",
+        views.agent_plan_acciones,
+        name="agente-api-plan-acciones",
+    ),
     path("api/agent/events", views.agent_events, name="agente-api-events"),
+    path(
+        "api/agent/events/batch",
+        views.agent_events_batch,
+        name="agente-api-events-batch",
+    ),
     path(
         "ingesta/importaciones/<int:importacion_id>/token",
         views.generate_importacion_token,
@@ -1,30 +1,22 @@
-import hashlib
 import json
 import secrets
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError, transaction
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from agente.auth import get_valid_token, hash_token, unauthorized
 from agente.models import AgentEvent, AgentToken
-from ingesta.models import Importacion
-from ingesta.services.plan import build_plan_payload
-
-
-def _hash_token(raw_token: str) -> str:
-    return hashlib.sha256(raw_token.encode("utf-8")).hexdigest()
-
-
-def _get_bearer_token(request):
-    header = request.META.get("HTTP_AUTHORIZATION", "")
-    if not header.startswith("Bearer "):
-        return None
-    return header.replace("Bearer ", "", 1).strip() or None
+from ingesta.models import Importacion, ImportacionArchivo
+from ingesta.services.plan import get_plan_snapshot, plan_page
 
 
 def _parse_json(request):
@@ -36,27 +28,10 @@ def _parse_json(request):
         return None
 
 
-def _unauthorized(message="Token inválido"):
-    return JsonResponse({"detail": message}, status=401)
-
-
-def _get_valid_token(request):
-    raw_token = _get_bearer_token(request)
-    if not raw_token:
-        return None
-    token_hash = _hash_token(raw_token)
-    token = AgentToken.objects.filter(token_hash=token_hash).first()
-    if not token or token.is_revoked() or token.is_expired():
-        return None
-    token.last_seen_at = timezone.now()
-    token.save(update_fields=["last_seen_at"])
-    return token
-
-
 def _create_token(*, user, allowed_importacion=None, name=""):
     for _ in range(5):
         raw_token = secrets.token_urlsafe(32)
-        token_hash = _hash_token(raw_token)
+        token_hash = hash_token(raw_token)
         if not AgentToken.objects.filter(token_hash=token_hash).exists():
             break
     else:
@@ -101,9 +76,9 @@ def create_token_api(request):
 
 @require_http_methods(["GET"])
 def agent_me(request):
-    token = _get_valid_token(request)
+    token = get_valid_token(request)
     if not token:
-        return _unauthorized()
+        return unauthorized()
     return JsonResponse(
         {
             "ok": True,
@@ -115,29 +90,68 @@ def agent_me(request):
 
 @require_http_methods(["GET"])
 def agent_plan_json(request, importacion_id: int):
-    token = _get_valid_token(request)
+    token = get_valid_token(request)
     if not token:
-        return _unauthorized()
+        return unauthorized()
     if not token.allows_importacion(importacion_id):
         return JsonResponse({"detail": "Token sin acceso"}, status=403)
     importacion = get_object_or_404(Importacion, id=importacion_id)
-    payload = build_plan_payload(importacion)
+    snapshot = get_plan_snapshot(importacion)
     response = HttpResponse(
-        json.dumps(payload, ensure_ascii=False),
+        bytes(snapshot.body),
         content_type="application/json; charset=utf-8",
     )
     response["Content-Disposition"] = (
         f'attachment; filename="importacion-{importacion.id}-plan.json"'
     )
-    return response
+    response["ETag"] = snapshot.etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=snapshot.etag, response=response)
+
+
+def _parse_limit(raw) -> int | None:
+    if not raw:
+        return settings.PLAN_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        return None
+    if limit <= 0:
+        return None
+    return min(limit, settings.PLAN_PAGE_MAX_SIZE)
+
+
+@require_http_methods(["GET"])
+def agent_plan_acciones(request, importacion_id: int):
+    token = get_valid_token(request)
+    if not token:
+        return unauthorized()
+    if not token.allows_importacion(importacion_id):
+        return JsonResponse({"detail": "Token sin acceso"}, status=403)
+    limit = _parse_limit(request.GET.get("limit"))
+    if limit is None:
+        return JsonResponse({"detail": "limit inválido"}, status=400)
+    importacion = get_object_or_404(Importacion, id=importacion_id)
+    try:
+        page = plan_page(importacion, limit, cursor=request.GET.get("cursor"))
+    except ValueError:
+        return JsonResponse({"detail": "Cursor inválido"}, status=400)
+    return JsonResponse(page, json_dumps_params={"ensure_ascii": False})
+
+
+def _idempotency_key(payload: dict) -> str | None:
+    key = payload.get("idempotency_key") or ""
+    if not isinstance(key, str) or len(key) > 64:
+        return None
+    return key
 
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def agent_events(request):
-    token = _get_valid_token(request)
+    token = get_valid_token(request)
     if not token:
-        return _unauthorized()
+        return unauthorized()
     payload = _parse_json(request)
     if payload is None:
         return JsonResponse({"detail": "JSON inválido"}, status=400)
@@ -146,22 +160,158 @@ def agent_events(request):
     status = (payload or {}).get("status")
     if not importacion_id or not step or not status:
         return JsonResponse({"detail": "Faltan campos requeridos"}, status=400)
+    idempotency_key = _idempotency_key(payload)
+    if idempotency_key is None:
+        return JsonResponse({"detail": "idempotency_key inválida"}, status=400)
     importacion = get_object_or_404(Importacion, id=importacion_id)
     if not token.allows_importacion(importacion.id):
         return JsonResponse({"detail": "Token sin acceso"}, status=403)
     event_ts = None
     if (payload or {}).get("ts"):
         event_ts = parse_datetime(payload["ts"])
-    AgentEvent.objects.create(
+    try:
+        with transaction.atomic():
+            AgentEvent.objects.create(
+                token=token,
+                importacion=importacion,
+                factura_id=(payload or {}).get("factura_id"),
+                step=step,
+                status=status,
+                message=(payload or {}).get("message") or "",
+                event_ts=event_ts,
+                idempotency_key=idempotency_key,
+            )
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        return JsonResponse({"ok": True, "duplicate": True})
+    return JsonResponse({"ok": True}, status=201)
+
+
+# AgentEvent.factura_id is a 32-bit IntegerField.
+FACTURA_ID_MAX = 2**31 - 1
+
+
+def _batch_event(token, importacion_id: int, item) -> AgentEvent | str:
+    """An unsaved ``AgentEvent`` for one batch item, or why it is invalid."""
+    if not isinstance(item, dict):
+        return "debe ser un objeto"
+    step = item.get("step")
+    status = item.get("status")
+    if not step or not status:
+        return "faltan step o status"
+    factura_id = item.get("factura_id")
+    if factura_id is not None and (
+        not isinstance(factura_id, int)
+        or isinstance(factura_id, bool)
+        or not 0 < factura_id <= FACTURA_ID_MAX
+    ):
+        return "factura_id inválido"
+    idempotency_key = _idempotency_key(item)
+    if idempotency_key is None:
+        return "idempotency_key inválida"
+    event_ts = None
+    if item.get("ts"):
+        try:
+            event_ts = parse_datetime(str(item["ts"]))
+        except ValueError:
+            return "ts inválido"
+    return AgentEvent(
         token=token,
-        importacion=importacion,
-        factura_id=(payload or {}).get("factura_id"),
-        step=step,
-        status=status,
-        message=(payload or {}).get("message") or "",
+        importacion_id=importacion_id,
+        factura_id=factura_id,
+        step=str(step)[:120],
+        status=str(status)[:80],
+        message=str(item.get("message") or ""),
         event_ts=event_ts,
+        idempotency_key=idempotency_key,
+    )
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def agent_events_batch(request):
+    """Up to ``AGENT_EVENTS_BATCH_MAX`` events of one import in one insert.
+
+    Events whose ``idempotency_key`` this token already sent (earlier or in
+    the same batch) are skipped, so a retried batch writes nothing twice.
+    Events naming a factura outside the import are not stored and come back
+    in ``rejected``; the rest of the batch is.
+    """
+    token = get_valid_token(request)
+    if not token:
+        return unauthorized()
+    payload = _parse_json(request)
+    if not isinstance(payload, dict):
+        return JsonResponse({"detail": "JSON inválido"}, status=400)
+    importacion_id = payload.get("importacion_id")
+    items = payload.get("events")
+    if not importacion_id or not isinstance(items, list) or not items:
+        return JsonResponse({"detail": "Faltan campos requeridos"}, status=400)
+    if len(items) > settings.AGENT_EVENTS_BATCH_MAX:
+        return JsonResponse(
+            {"detail": f"Máximo {settings.AGENT_EVENTS_BATCH_MAX} eventos por lote"},
+            status=400,
+        )
+    try:
+        importacion_id = int(importacion_id)
+    except (TypeError, ValueError):
+        return JsonResponse({"detail": "importacion_id inválido"}, status=400)
+    if not token.allows_importacion(importacion_id):
+        return JsonResponse({"detail": "Token sin acceso"}, status=403)
+    importacion = get_object_or_404(Importacion, id=importacion_id)
+
+    events: list[AgentEvent] = []
+    for index, item in enumerate(items):
+        event = _batch_event(token, importacion.id, item)
+        if isinstance(event, str):
+            return JsonResponse({"detail": f"Evento {index}: {event}"}, status=400)
+        events.append(event)
+
+    factura_ids = {event.factura_id for event in events if event.factura_id}
+    conocidas = set()
+    if factura_ids:
+        conocidas.update(
+            ImportacionArchivo.objects.filter(
+                importacion=importacion, factura_id__in=factura_ids
+            ).values_list("factura_id", flat=True)
+        )
+    rejected: list[dict] = []
+    validos: list[AgentEvent] = []
+    for index, event in enumerate(events):
+        if event.factura_id and event.factura_id not in conocidas:
+            rejected.append(
+                {"index": index, "detail": "factura_id no pertenece a la importación"}
+            )
+        else:
+            validos.append(event)
+
+    keys = {event.idempotency_key for event in validos if event.idempotency_key}
+    seen: set[str] = set()
+    if keys:
+        seen.update(
+            AgentEvent.objects.filter(
+                token=token, idempotency_key__in=keys
+            ).values_list("idempotency_key", flat=True)
+        )
+    nuevos: list[AgentEvent] = []
+    for event in validos:
+        if event.idempotency_key:
+            if event.idempotency_key in seen:
+                continue
+            seen.add(event.idempotency_key)
+        nuevos.append(event)
+    # ignore_conflicts covers a retry racing the original request.
+    AgentEvent.objects.bulk_create(nuevos, ignore_conflicts=True)
+    return JsonResponse(
+        {
+            "ok": True,
+            "created": len(nuevos),
+            "duplicates": len(validos) - len(nuevos),
+            "rejected": rejected,
+        },
+        status=201,
     )
-    return JsonResponse({"ok": True}, status=201)
 
 
 @login_required
@@ -94,6 +94,19 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 CELERY_BROKER_URL = env("CELERY_BROKER_URL", default="redis://redis:6379/0")
 CELERY_RESULT_BACKEND = env("CELERY_RESULT_BACKEND", default="redis://redis:6379/1")
 
+CELERY_BEAT_SCHEDULE = {
+    "requeue-stale-imports": {
+        "task": "ingesta.tasks.requeue_stale_imports",
+        "schedule": env.float("IMPORT_STALE_SWEEP_INTERVAL", default=300.0),
+    },
+}
+
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
+RULES_CACHE_TIMEOUT = env.int("RULES_CACHE_TIMEOUT", default=86400)
+
+STORAGE_BACKEND = env("STORAGE_BACKEND", default="s3")
+STORAGE_LOCAL_ROOT = env("STORAGE_LOCAL_ROOT", default=str(BASE_DIR / "storage"))
+
 MINIO_ENDPOINT = env("MINIO_ENDPOINT", default="minio:9000")
 MINIO_ROOT_USER = env("MINIO_ROOT_USER", default="")
 MINIO_ROOT_PASSWORD = env("MINIO_ROOT_PASSWORD", default="")
@@ -119,6 +132,32 @@ S3_USE_SSL = env.bool(
     "S3_USE_SSL",
     default=env.bool("MINIO_USE_SSL", default=False),
 )
+S3_STREAM_BUFFER_SIZE = env.int("S3_STREAM_BUFFER_SIZE", default=8 * 1024 * 1024)
+S3_MAX_POOL_CONNECTIONS = env.int("S3_MAX_POOL_CONNECTIONS", default=32)
+S3_UPLOAD_WORKERS = env.int("S3_UPLOAD_WORKERS", default=16)
+S3_UPLOAD_MAX_INFLIGHT_BYTES = env.int(
+    "S3_UPLOAD_MAX_INFLIGHT_BYTES", default=32 * 1024 * 1024
+)
+
+IMPORT_MAX_XML_BYTES = env.int("IMPORT_MAX_XML_BYTES", default=20 * 1024 * 1024)
+IMPORT_BATCH_SIZE = env.int("IMPORT_BATCH_SIZE", default=500)
+IMPORT_PARSE_WORKERS = env.int("IMPORT_PARSE_WORKERS", default=0)
+IMPORT_PARSE_MIN_FILES = env.int("IMPORT_PARSE_MIN_FILES", default=200)
+IMPORT_STREAM_PARSE_MIN_BYTES = env.int(
+    "IMPORT_STREAM_PARSE_MIN_BYTES", default=1024 * 1024
+)
+IMPORT_SHARD_SIZE = env.int("IMPORT_SHARD_SIZE", default=0)
+IMPORT_PROGRESS_INTERVAL = env.float("IMPORT_PROGRESS_INTERVAL", default=2.0)
+IMPORT_STALE_AFTER = env.int("IMPORT_STALE_AFTER", default=900)
+IMPORT_MAX_ATTEMPTS = env.int("IMPORT_MAX_ATTEMPTS", default=3)
+RECLASSIFY_BATCH_SIZE = env.int("RECLASSIFY_BATCH_SIZE", default=2000)
+PLAN_PAGE_SIZE = env.int("PLAN_PAGE_SIZE", default=200)
+PLAN_PAGE_MAX_SIZE = env.int("PLAN_PAGE_MAX_SIZE", default=1000)
+AGENT_EVENTS_BATCH_MAX = env.int("AGENT_EVENTS_BATCH_MAX", default=1000)
+EXPORT_CSV_CHUNK_SIZE = env.int("EXPORT_CSV_CHUNK_SIZE", default=2000)
+EXPORT_BATCH_SIZE = env.int("EXPORT_BATCH_SIZE", default=5000)
+EXPORT_STALE_AFTER = env.int("EXPORT_STALE_AFTER", default=900)
+EXPORT_SPOOL_MAX_BYTES = env.int("EXPORT_SPOOL_MAX_BYTES", default=16 * 1024 * 1024)
 
 LOG_LEVEL = env("LOG_LEVEL", default="INFO")
 LOGGING = {
@@ -1,14 +1,18 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
 from .models import (
     ArchivoFactura,
     AsignacionClasificacionFactura,
     Categoria,
+    ExportJob,
     Factura,
     Importacion,
+    ImportacionArchivo,
+    PlanSnapshot,
     Proveedor,
     ReglaClasificacion,
 )
+from .services.rule_cache import invalidate_rules
 
 
 @admin.register(Importacion)
@@ -54,6 +58,22 @@ class ArchivoFacturaAdmin(admin.ModelAdmin):
     search_fields = ("s3_key_xml", "factura__clave_acceso")
 
 
+@admin.register(ImportacionArchivo)
+class ImportacionArchivoAdmin(admin.ModelAdmin):
+    list_display = ("importacion", "position", "filename", "factura", "unchanged")
+    list_filter = ("unchanged",)
+    search_fields = ("filename", "s3_key_xml")
+    raw_id_fields = ("importacion", "factura")
+
+
+@admin.register(PlanSnapshot)
+class PlanSnapshotAdmin(admin.ModelAdmin):
+    list_display = ("importacion", "version", "factura_limit", "updated_at")
+    readonly_fields = ("version", "factura_limit", "updated_at")
+    exclude = ("body",)
+    raw_id_fields = ("importacion",)
+
+
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
     list_display = ("nombre", "codigo", "activo")
@@ -66,6 +86,12 @@ class ReglaClasificacionAdmin(admin.ModelAdmin):
     list_display = ("tipo", "patron", "categoria", "prioridad", "confianza_base", "activo")
     list_filter = ("tipo", "confianza_base", "activo")
     search_fields = ("patron", "categoria__nombre")
+    actions = ["recompilar_reglas"]
+
+    @admin.action(description="Recompilar reglas en todos los workers")
+    def recompilar_reglas(self, request, queryset):
+        invalidate_rules()
+        self.message_user(request, "Reglas invalidadas.", messages.SUCCESS)
 
 
 @admin.register(AsignacionClasificacionFactura)
@@ -73,3 +99,19 @@ class AsignacionClasificacionFacturaAdmin(admin.ModelAdmin):
     list_display = ("factura", "categoria_sugerida", "confianza", "metodo", "updated_at")
     list_filter = ("confianza", "metodo")
     search_fields = ("factura__clave_acceso", "factura__proveedor__ruc")
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "status",
+        "formato",
+        "progress_processed",
+        "progress_total",
+        "size_bytes",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("status", "formato")
+    readonly_fields = ("params_hash", "data_version", "s3_key")
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class IngestaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ingesta"
+
+    def ready(self) -> None:
+        from ingesta import signals  # noqa: F401
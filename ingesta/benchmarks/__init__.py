@@ -0,0 +1 @@
+"""Synthetic workloads for the parser and import benchmarks."""
@@ -0,0 +1,189 @@
+"""Deterministic SRI comprobante corpus for parser benchmarks.
+
+``generate_corpus(seed)`` always yields the same documents for the same seed,
+so throughput numbers are comparable across runs and commits.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+
+KINDS = ("plain", "autorizacion", "namespaced", "detalles", "malformed")
+
+# Documents per kind in the default corpus.
+DEFAULT_SIZES = {
+    "plain": 400,
+    "autorizacion": 300,
+    "namespaced": 300,
+    "detalles": 12,
+    "malformed": 300,
+}
+
+_VERSIONS = ("1.0.0", "1.1.0", "2.1.0")
+_PROVEEDORES = (
+    "Supermercados La Favorita C.A.",
+    "Farmacias Cruz Azul S.A.",
+    "Corporación El Rosado",
+    "Distribuidora Andina Cía. Ltda.",
+    "Ferretería Kywi S.A.",
+    "Servicios Petroleros del Oriente",
+)
+_PRODUCTOS = ("Arroz 2kg", "Aceite 1L", "Paracetamol 500mg", "Cable #12", "Leche")
+
+
+@dataclass(frozen=True)
+class CorpusDocument:
+    kind: str
+    name: str
+    xml: bytes
+
+
+def _money(value: Decimal) -> str:
+    return str(value.quantize(Decimal("0.01")))
+
+
+def _ruc(rng: random.Random) -> str:
+    return f"{rng.randint(1, 24):02d}{rng.randint(0, 9_999_999):07d}001"
+
+
+def _clave(rng: random.Random, fecha: date, ruc: str) -> str:
+    tail = "".join(str(rng.randint(0, 9)) for _ in range(23))
+    return f"{fecha:%d%m%Y}01{ruc}{tail}"[:49]
+
+
+def _detalles(rng: random.Random, lines: int) -> tuple[str, Decimal]:
+    parts = []
+    subtotal = Decimal("0")
+    for index in range(lines):
+        cantidad = rng.randint(1, 12)
+        precio = Decimal(rng.randint(25, 5_000)) / 100
+        total = precio * cantidad
+        subtotal += total
+        parts.append(
+            "<detalle>"
+            f"<codigoPrincipal>P{index:05d}</codigoPrincipal>"
+            f"<descripcion>{rng.choice(_PRODUCTOS)}</descripcion>"
+            f"<cantidad>{cantidad}</cantidad>"
+            f"<precioUnitario>{_money(precio)}</precioUnitario>"
+            "<descuento>0.00</descuento>"
+            f"<precioTotalSinImpuesto>{_money(total)}</precioTotalSinImpuesto>"
+            "<impuestos><impuesto><codigo>2</codigo><codigoPorcentaje>4"
+            "</codigoPorcentaje><tarifa>15</tarifa>"
+            f"<baseImponible>{_money(total)}</baseImponible>"
+            f"<valor>{_money(total * Decimal('0.15'))}</valor>"
+            "</impuesto></impuestos>"
+            "</detalle>"
+        )
+    return "".join(parts), subtotal
+
+
+def factura_xml(
+    rng: random.Random,
+    lines: int = 3,
+    prefix: str = "",
+    proveedor: tuple[str, str] | None = None,
+) -> str:
+    """A factura as the SRI emits it; ``prefix`` namespaces every element.
+
+    ``proveedor`` is a ``(ruc, razon_social)`` pair; a random one otherwise.
+    """
+    fecha = date(2024, 1, 1) + timedelta(days=rng.randint(0, 364))
+    ruc = proveedor[0] if proveedor else _ruc(rng)
+    detalles, subtotal = _detalles(rng, lines)
+    iva = subtotal * Decimal("0.15")
+    total = subtotal + iva
+    version = rng.choice(_VERSIONS)
+    razon_social = proveedor[1] if proveedor else rng.choice(_PROVEEDORES)
+    xml = (
+        f'<factura id="comprobante" version="{version}">'
+        "<infoTributaria><ambiente>2</ambiente><tipoEmision>1</tipoEmision>"
+        f"<razonSocial>{razon_social}</razonSocial>"
+        f"<ruc>{ruc}</ruc>"
+        f"<claveAcceso>{_clave(rng, fecha, ruc)}</claveAcceso>"
+        "<codDoc>01</codDoc><estab>001</estab><ptoEmi>002</ptoEmi>"
+        f"<secuencial>{rng.randint(1, 999_999_999):09d}</secuencial>"
+        "<dirMatriz>Av. Amazonas N34-451, Quito</dirMatriz>"
+        "</infoTributaria>"
+        f"<infoFactura><fechaEmision>{fecha:%d/%m/%Y}</fechaEmision>"
+        "<obligadoContabilidad>SI</obligadoContabilidad>"
+        "<tipoIdentificacionComprador>04</tipoIdentificacionComprador>"
+        "<razonSocialComprador>Anexo Demo S.A.</razonSocialComprador>"
+        "<identificacionComprador>1790000000001</identificacionComprador>"
+        f"<totalSinImpuestos>{_money(subtotal)}</totalSinImpuestos>"
+        "<totalDescuento>0.00</totalDescuento>"
+        "<totalConImpuestos><totalImpuesto><codigo>2</codigo>"
+        f"<codigoPorcentaje>4</codigoPorcentaje><baseImponible>{_money(subtotal)}"
+        f"</baseImponible><valor>{_money(iva)}</valor></totalImpuesto>"
+        "</totalConImpuestos><propina>0.00</propina>"
+        f"<importeTotal>{_money(total)}</importeTotal><moneda>DOLAR</moneda>"
+        "<pagos><pago><formaPago>01</formaPago>"
+        f"<total>{_money(total)}</total></pago></pagos>"
+        "</infoFactura>"
+        f"<detalles>{detalles}</detalles>"
+        '<infoAdicional><campoAdicional nombre="Email">'
+        "facturacion@example.com</campoAdicional></infoAdicional>"
+        "</factura>"
+    )
+    if prefix:
+        xml = re.sub(r"<(/?)(\w)", rf"<\1{prefix}:\2", xml).replace(
+            f"<{prefix}:factura ",
+            f'<{prefix}:factura xmlns:{prefix}="http://www.sri.gob.ec/factura" ',
+            1,
+        )
+    return xml
+
+
+def autorizacion_xml(rng: random.Random, lines: int = 3) -> str:
+    comprobante = factura_xml(rng, lines)
+    return (
+        "<autorizacion><estado>AUTORIZADO</estado>"
+        f"<numeroAutorizacion>{rng.randint(10**48, 10**49 - 1)}"
+        "</numeroAutorizacion>"
+        "<fechaAutorizacion>2024-06-01T10:00:00-05:00</fechaAutorizacion>"
+        "<ambiente>PRODUCCIÓN</ambiente>"
+        '<comprobante><![CDATA[<?xml version="1.0" encoding="UTF-8"?>'
+        f"{comprobante}]]></comprobante><mensajes/></autorizacion>"
+    )
+
+
+def proveedores(rng: random.Random, count: int) -> list[tuple[str, str]]:
+    """``count`` distinct ``(ruc, razon_social)`` pairs."""
+    pairs: dict[str, str] = {}
+    while len(pairs) < count:
+        ruc = _ruc(rng)
+        pairs.setdefault(ruc, f"{rng.choice(_PROVEEDORES)} {len(pairs) + 1}")
+    return list(pairs.items())
+
+
+def malformed_xml(rng: random.Random) -> str:
+    xml = factura_xml(rng)
+    cut = rng.randint(len(xml) // 4, len(xml) - 20)
+    return xml[:cut]
+
+
+def generate_corpus(
+    seed: int = 20240601, sizes: dict[str, int] | None = None
+) -> list[CorpusDocument]:
+    rng = random.Random(seed)
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    documents: list[CorpusDocument] = []
+    for kind in KINDS:
+        for index in range(sizes[kind]):
+            if kind == "plain":
+                xml = factura_xml(rng, lines=rng.randint(1, 8))
+            elif kind == "autorizacion":
+                xml = autorizacion_xml(rng, lines=rng.randint(1, 8))
+            elif kind == "namespaced":
+                xml = factura_xml(rng, lines=rng.randint(1, 8), prefix="ns")
+            elif kind == "detalles":
+                xml = autorizacion_xml(rng, lines=rng.randint(1_000, 5_000))
+            else:
+                xml = malformed_xml(rng)
+            documents.append(
+                CorpusDocument(kind, f"{kind}-{index:04d}.xml", xml.encode("utf-8"))
+            )
+    return documents
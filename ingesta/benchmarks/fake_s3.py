@@ -0,0 +1,86 @@
+"""In-process stand-in for the boto3 S3 client used by ``s3_client``.
+
+Implements only the calls the import pipeline makes, with the same request
+and response shapes, so ``S3RangeFile`` ranged reads and ``XmlUploader``
+uploads run unchanged without MinIO or a network.
+"""
+
+from __future__ import annotations
+
+import io
+import os
+import threading
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError
+
+from ingesta.services import s3_client
+
+
+def _not_found(operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation)
+
+
+class FakeS3Client:
+    def __init__(self) -> None:
+        self.buckets: dict[str, dict[str, bytes]] = {}
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def _object(self, operation: str, bucket: str, key: str) -> bytes:
+        try:
+            return self.buckets[bucket][key]
+        except KeyError:
+            raise _not_found(operation) from None
+
+    def head_bucket(self, Bucket: str) -> dict:
+        self._count("head_bucket")
+        if Bucket not in self.buckets:
+            raise _not_found("HeadBucket")
+        return {}
+
+    def create_bucket(self, Bucket: str) -> dict:
+        self._count("create_bucket")
+        self.buckets.setdefault(Bucket, {})
+        return {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **_extra) -> dict:
+        self._count("put_object")
+        with self._lock:
+            self.buckets.setdefault(Bucket, {})[Key] = bytes(Body)
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **_extra) -> None:
+        self._count("upload_fileobj")
+        with self._lock:
+            self.buckets.setdefault(Bucket, {})[Key] = Fileobj.read()
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        self._count("head_object")
+        return {"ContentLength": len(self._object("HeadObject", Bucket, Key))}
+
+    def get_object(self, Bucket: str, Key: str, Range: str | None = None) -> dict:
+        self._count("get_object")
+        data = self._object("GetObject", Bucket, Key)
+        if Range:
+            start, end = Range.removeprefix("bytes=").split("-")
+            data = data[int(start) : int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+
+@contextmanager
+def fake_s3(client: FakeS3Client | None = None):
+    """Make ``s3_client.get_client`` return a ``FakeS3Client`` for the block."""
+    client = client or FakeS3Client()
+    s3_client.reset_client()
+    with s3_client._client_lock:
+        s3_client._client = client
+        s3_client._client_pid = os.getpid()
+    try:
+        yield client
+    finally:
+        s3_client.reset_client()
@@ -0,0 +1,226 @@
+"""End-to-end ``process_zip_import`` benchmark against local stand-ins.
+
+Builds a synthetic ZIP, stores it in a local storage backend (the S3 backend
+over a ``FakeS3Client`` by default, or the memory / local-filesystem
+backends) and runs the import in-process on the current database, timing
+each pipeline stage. Stage times
+are exclusive: a DB query issued while classifying counts as ``db``, not
+``classify``. Uploads run on the uploader's threads, so ``upload`` is their
+summed time and is not part of the wall-clock breakdown.
+"""
+
+from __future__ import annotations
+
+import io
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import override_settings
+
+from ingesta import tasks
+from ingesta.benchmarks.corpus import factura_xml, proveedores
+from ingesta.benchmarks.fake_s3 import FakeS3Client, fake_s3
+from ingesta.models import Categoria, Confianza, Importacion, ReglaClasificacion
+from ingesta.services.parse_pool import ParsePool
+from ingesta.services.rule_cache import invalidate_rules
+from ingesta.services.s3_client import S3RangeFile
+from ingesta.services.storage import _MmapReader, reset_storage
+
+STAGES = ("download", "unzip", "parse", "db", "upload", "classify")
+
+
+class StageTimer:
+    """Accumulates exclusive wall time per stage, per thread."""
+
+    def __init__(self) -> None:
+        self.totals: dict[str, float] = defaultdict(float)
+        self.queries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            with self._lock:
+                self.totals[name] += elapsed - nested
+            if stack:
+                stack[-1] += elapsed
+
+    def wrap(self, name: str, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+
+        return timed
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        with self.stage("db"):
+            self.queries += 1
+            return execute(sql, params, many, context)
+
+
+@dataclass
+class ImportBenchReport:
+    invoices: int
+    zip_bytes: int
+    wall: float
+    facturas: int
+    queries: int
+    stages: dict[str, float] = field(default_factory=dict)
+    s3_calls: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def invoices_per_sec(self) -> float:
+        return self.invoices / self.wall if self.wall else 0.0
+
+    @property
+    def other(self) -> float:
+        timed = sum(value for name, value in self.stages.items() if name != "upload")
+        return max(0.0, self.wall - timed)
+
+    def lines(self) -> list[str]:
+        lines = [
+            f"{self.invoices} facturas ({self.zip_bytes / 1024 / 1024:.1f} MB ZIP) "
+            f"en {self.wall:.2f}s: {self.invoices_per_sec:.0f} facturas/s, "
+            f"{self.queries} consultas",
+        ]
+        for name in STAGES:
+            value = self.stages.get(name, 0.0)
+            suffix = " (suma de hilos)" if name == "upload" else ""
+            lines.append(f"  {name:<9} {value:>8.3f}s{suffix}")
+        lines.append(f"  {'otros':<9} {self.other:>8.3f}s")
+        return lines
+
+
+def build_zip(
+    invoices: int, proveedor_count: int, lines: int = 3, seed: int = 20240601
+) -> bytes:
+    rng = random.Random(seed)
+    pool = proveedores(rng, proveedor_count)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        for index in range(invoices):
+            xml = factura_xml(rng, lines=lines, proveedor=rng.choice(pool))
+            zf.writestr(f"facturas/{index:06d}.xml", xml)
+    return buffer.getvalue()
+
+
+def _seed_rules(seed: int, proveedor_count: int) -> None:
+    supermercados = Categoria.objects.create(nombre="Supermercados")
+    farmacias = Categoria.objects.create(nombre="Farmacias")
+    keyword_rules = [
+        ReglaClasificacion(
+            prioridad=10,
+            tipo=ReglaClasificacion.Tipo.KEYWORD,
+            patron=patron,
+            categoria=categoria,
+        )
+        for patron, categoria in (
+            ("supermercados", supermercados),
+            ("farmacias", farmacias),
+        )
+    ]
+    # Same rng sequence as build_zip, so one in ten proveedores has a RUC rule.
+    ruc_rules = [
+        ReglaClasificacion(
+            prioridad=1,
+            tipo=ReglaClasificacion.Tipo.RUC,
+            patron=ruc,
+            categoria=supermercados,
+            confianza_base=Confianza.HIGH,
+        )
+        for ruc, _razon_social in proveedores(random.Random(seed), proveedor_count)
+    ][::10]
+    ReglaClasificacion.objects.bulk_create(keyword_rules + ruc_rules)
+    # bulk_create skips the post_save signal that invalidates cached rules.
+    invalidate_rules()
+
+
+def run_import_benchmark(
+    invoices: int,
+    proveedor_count: int | None = None,
+    lines: int = 3,
+    seed: int = 20240601,
+    backend: str = "s3",
+) -> ImportBenchReport:
+    """Import ``invoices`` synthetic facturas and report where the time went.
+
+    Writes to the current default database; run it on a test database.
+    ``backend`` is a ``STORAGE_BACKEND`` value; "s3" talks to a fake client.
+    """
+    proveedor_count = proveedor_count or max(1, invoices // 20)
+    zip_bytes = build_zip(invoices, proveedor_count, lines=lines, seed=seed)
+    _seed_rules(seed, proveedor_count)
+    timer = StageTimer()
+    client = FakeS3Client()
+
+    with ExitStack() as stack:
+        local_root = stack.enter_context(tempfile.TemporaryDirectory())
+        stack.enter_context(fake_s3(client))
+        stack.enter_context(
+            override_settings(
+                IMPORT_SHARD_SIZE=0,
+                STORAGE_BACKEND=backend,
+                STORAGE_LOCAL_ROOT=local_root,
+            )
+        )
+        stack.callback(reset_storage)
+        reset_storage()
+        tasks.ensure_bucket()
+        importacion = Importacion.objects.create()
+        importacion.s3_key_zip = f"imports/{importacion.id}/source.zip"
+        importacion.save(update_fields=["s3_key_zip"])
+        tasks.upload_xml(zip_bytes, importacion.s3_key_zip)
+        client.calls.clear()
+
+        for target, name, stage in (
+            (tasks, "open_stream", "download"),
+            (S3RangeFile, "readinto", "download"),
+            (_MmapReader, "readinto", "download"),
+            (zipfile.ZipFile, "read", "unzip"),
+            (ParsePool, "parse", "parse"),
+            (tasks, "upload_xml", "upload"),
+            (tasks, "classify_importacion", "classify"),
+        ):
+            stack.enter_context(
+                mock.patch.object(
+                    target, name, timer.wrap(stage, getattr(target, name))
+                )
+            )
+        stack.enter_context(connection.execute_wrapper(timer.db_wrapper))
+        started = time.perf_counter()
+        tasks.process_zip_import(importacion.id)
+        wall = time.perf_counter() - started
+
+    importacion.refresh_from_db()
+    if importacion.status != Importacion.Status.DONE:
+        raise RuntimeError(
+            f"Importación {importacion.id} terminó en {importacion.status}: "
+            f"{importacion.error_summary}"
+        )
+    return ImportBenchReport(
+        invoices=invoices,
+        zip_bytes=len(zip_bytes),
+        wall=wall,
+        facturas=importacion.total_facturas,
+        queries=timer.queries,
+        stages=dict(timer.totals),
+        s3_calls=dict(client.calls),
+    )
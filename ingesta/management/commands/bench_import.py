@@ -0,0 +1,69 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from ingesta.benchmarks.import_run import run_import_benchmark
+
+
+def _parse_sizes(value: str) -> list[int]:
+    try:
+        sizes = [int(size) for size in value.split(",") if size.strip()]
+    except ValueError as exc:
+        raise CommandError(f"Tamaños inválidos: {value}") from exc
+    if not sizes or any(size <= 0 for size in sizes):
+        raise CommandError(f"Tamaños inválidos: {value}")
+    return sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark process_zip_import end to end on synthetic ZIPs, using local "
+        "storage stand-ins and a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=_parse_sizes,
+            default=[1_000, 10_000, 50_000],
+            help="Comma-separated invoice counts (default 1000,10000,50000).",
+        )
+        parser.add_argument(
+            "--proveedores",
+            type=int,
+            default=None,
+            help="Distinct proveedores per ZIP (default: invoices / 20).",
+        )
+        parser.add_argument("--lines", type=int, default=3, help="Detalles each.")
+        parser.add_argument("--seed", type=int, default=20240601)
+        parser.add_argument(
+            "--backend",
+            choices=["s3", "memory", "local"],
+            default="s3",
+            help="Storage backend; s3 runs against an in-process fake client.",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Reuse the test database between runs.",
+        )
+
+    def handle(self, *args, **options):
+        old_config = setup_databases(
+            verbosity=0, interactive=False, keepdb=options["keepdb"]
+        )
+        try:
+            for index, size in enumerate(options["sizes"]):
+                if index:
+                    call_command("flush", interactive=False, verbosity=0)
+                report = run_import_benchmark(
+                    size,
+                    proveedor_count=options["proveedores"],
+                    lines=options["lines"],
+                    seed=options["seed"],
+                    backend=options["backend"],
+                )
+                for line in report.lines():
+                    self.stdout.write(line)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
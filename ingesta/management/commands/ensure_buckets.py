@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand
 
-from ingesta.services.s3_client import ensure_bucket
+from ingesta.services.storage import ensure_bucket
 
 
 class Command(BaseCommand):
-    help = "Ensure S3 bucket exists for ingesta imports."
+    help = "Ensure the storage backend (S3 bucket or local root) is ready."
 
     def handle(self, *args, **options):
         ensure_bucket()
-        self.stdout.write(self.style.SUCCESS("Bucket ensured."))
+        self.stdout.write(self.style.SUCCESS("Storage ready."))
@@ -0,0 +1,76 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ingesta.services.reclassify import reclassify, reclassify_queryset
+from ingesta.tasks import reclassify_facturas
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError as exc:
+        raise CommandError(f"Fecha inválida: {value} (use AAAA-MM-DD)") from exc
+
+
+class Command(BaseCommand):
+    help = "Reclassify existing facturas with the current rules (skips MANUAL)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--importacion", type=int, help="Importacion id.")
+        parser.add_argument("--proveedor", type=int, help="Proveedor id.")
+        parser.add_argument(
+            "--desde", type=_parse_date, help="fecha_emision >= AAAA-MM-DD."
+        )
+        parser.add_argument(
+            "--hasta", type=_parse_date, help="fecha_emision <= AAAA-MM-DD."
+        )
+        parser.add_argument(
+            "--solo-pendientes",
+            action="store_true",
+            help="Only LOW confidence or unclassified facturas.",
+        )
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="run_async",
+            help="Enqueue a Celery task instead of running inline.",
+        )
+
+    def handle(self, *args, **options):
+        filters = {
+            "importacion_id": options["importacion"],
+            "proveedor_id": options["proveedor"],
+            "fecha_desde": options["desde"],
+            "fecha_hasta": options["hasta"],
+            "solo_pendientes": options["solo_pendientes"],
+        }
+        if options["run_async"]:
+            result = reclassify_facturas.delay(
+                **{
+                    key: value.isoformat() if isinstance(value, date) else value
+                    for key, value in filters.items()
+                },
+                batch_size=options["batch_size"],
+            )
+            self.stdout.write(self.style.SUCCESS(f"Tarea encolada: {result.id}"))
+            return
+
+        def report(stats):
+            self.stdout.write(
+                f"{stats.scanned} facturas revisadas ({stats.rate:.0f}/s)"
+            )
+
+        stats = reclassify(
+            reclassify_queryset(**filters),
+            batch_size=options["batch_size"],
+            on_batch=report if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reclasificadas {stats.scanned} facturas: {stats.updated} "
+                f"actualizadas, {stats.created} creadas en {stats.elapsed:.1f}s "
+                f"({stats.rate:.0f} facturas/s)."
+            )
+        )
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0002_clasificacion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="archivofactura",
+            name="sha256_xml",
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0003_archivofactura_sha256_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importacion",
+            name="progress_stage",
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name="importacion",
+            name="progress_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importacion",
+            name="progress_processed",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importacion",
+            name="progress_errors",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importacion",
+            name="progress_updated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
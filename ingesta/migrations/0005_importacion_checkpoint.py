@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0004_importacion_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importacion",
+            name="checkpoint_json",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,127 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def forwards(apps, schema_editor):
+    Importacion = apps.get_model("ingesta", "Importacion")
+    ImportacionArchivo = apps.get_model("ingesta", "ImportacionArchivo")
+    ArchivoFactura = apps.get_model("ingesta", "ArchivoFactura")
+    Factura = apps.get_model("ingesta", "Factura")
+
+    importaciones = Importacion.objects.exclude(log_json__isnull=True).only(
+        "id", "log_json"
+    )
+    for importacion in importaciones.iterator(chunk_size=100):
+        log_json = importacion.log_json
+        if not isinstance(log_json, dict) or "files" not in log_json:
+            continue
+        file_logs = log_json.get("files") or []
+        s3_keys = {
+            entry.get("s3_key_xml") or entry.get("s3_key")
+            for entry in file_logs
+            if not entry.get("factura_id")
+        }
+        factura_by_key = dict(
+            ArchivoFactura.objects.filter(s3_key_xml__in=s3_keys - {None}).values_list(
+                "s3_key_xml", "factura_id"
+            )
+        )
+        existing_ids = set(
+            Factura.objects.filter(
+                id__in={entry.get("factura_id") for entry in file_logs} - {None}
+            ).values_list("id", flat=True)
+        )
+        archivos = []
+        for position, entry in enumerate(file_logs):
+            key = entry.get("s3_key_xml") or entry.get("s3_key") or ""
+            factura_id = entry.get("factura_id")
+            if factura_id not in existing_ids:
+                factura_id = factura_by_key.get(key)
+            archivos.append(
+                ImportacionArchivo(
+                    importacion_id=importacion.id,
+                    position=position,
+                    filename=entry.get("filename") or "",
+                    factura_id=factura_id,
+                    s3_key_xml=key,
+                    warnings=entry.get("warnings") or [],
+                    errors=entry.get("errors") or [],
+                    unchanged=bool(entry.get("unchanged")),
+                    duplicate_of=entry.get("duplicate_of") or "",
+                )
+            )
+        ImportacionArchivo.objects.bulk_create(archivos, batch_size=BATCH_SIZE)
+        rest = {key: value for key, value in log_json.items() if key != "files"}
+        importacion.log_json = rest or None
+        importacion.save(update_fields=["log_json"])
+
+
+def backwards(apps, schema_editor):
+    Importacion = apps.get_model("ingesta", "Importacion")
+    ImportacionArchivo = apps.get_model("ingesta", "ImportacionArchivo")
+
+    importacion_ids = (
+        ImportacionArchivo.objects.values_list("importacion_id", flat=True)
+        .distinct()
+        .order_by()
+    )
+    for importacion in Importacion.objects.filter(id__in=importacion_ids):
+        files = []
+        archivos = ImportacionArchivo.objects.filter(
+            importacion_id=importacion.id
+        ).order_by("position")
+        for archivo in archivos.select_related("factura").iterator(
+            chunk_size=BATCH_SIZE
+        ):
+            entry = {
+                "filename": archivo.filename,
+                "warnings": archivo.warnings,
+                "errors": archivo.errors,
+            }
+            if archivo.factura_id:
+                entry["factura_id"] = archivo.factura_id
+                entry["clave_acceso"] = archivo.factura.clave_acceso
+            if archivo.s3_key_xml:
+                entry["s3_key_xml"] = archivo.s3_key_xml
+            if archivo.unchanged:
+                entry["unchanged"] = True
+            if archivo.duplicate_of:
+                entry["duplicate_of"] = archivo.duplicate_of
+            files.append(entry)
+        importacion.log_json = {**(importacion.log_json or {}), "files": files}
+        importacion.save(update_fields=["log_json"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0005_importacion_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportacionArchivo",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("position", models.PositiveIntegerField()),
+                ("filename", models.CharField(max_length=500)),
+                ("s3_key_xml", models.CharField(blank=True, max_length=255)),
+                ("warnings", models.JSONField(default=list)),
+                ("errors", models.JSONField(default=list)),
+                ("unchanged", models.BooleanField(default=False)),
+                ("duplicate_of", models.CharField(blank=True, max_length=500)),
+                ("factura", models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="importacion_archivos", to="ingesta.factura")),
+                ("importacion", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="archivos", to="ingesta.importacion")),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("importacion", "position"), name="importacion_archivo_position_uniq"),
+                ],
+                "indexes": [
+                    models.Index(fields=["importacion", "factura"], name="importacion_archivo_fact_idx"),
+                ],
+            },
+        ),
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,30 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0006_importacionarchivo"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlanSnapshot",
+            fields=[
+                (
+                    "importacion",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="plan_snapshot",
+                        serialize=False,
+                        to="ingesta.importacion",
+                    ),
+                ),
+                ("version", models.CharField(max_length=64)),
+                ("factura_limit", models.PositiveIntegerField()),
+                ("body", models.BinaryField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0007_plansnapshot"),
+    ]
+
+    operations = [
+        # (importacion, factura, position) also serves every lookup the old
+        # (importacion, factura) index did; build it before dropping that one.
+        migrations.AddIndex(
+            model_name="importacionarchivo",
+            index=models.Index(
+                fields=["importacion", "factura", "position"],
+                name="importacion_archivo_fact_pos",
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="importacionarchivo",
+            name="importacion_archivo_fact_idx",
+        ),
+    ]
@@ -0,0 +1,76 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0008_importacionarchivo_fact_pos_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExportJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Pending"),
+                            ("RUNNING", "Running"),
+                            ("DONE", "Done"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="PENDING",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "formato",
+                    models.CharField(
+                        choices=[("csv", "CSV"), ("jsonl", "JSONL")], max_length=10
+                    ),
+                ),
+                ("params", models.JSONField(default=dict)),
+                ("params_hash", models.CharField(max_length=64)),
+                ("data_version", models.CharField(max_length=64)),
+                ("progress_total", models.PositiveIntegerField(default=0)),
+                ("progress_processed", models.PositiveIntegerField(default=0)),
+                ("progress_updated_at", models.DateTimeField(blank=True, null=True)),
+                ("s3_key", models.CharField(blank=True, max_length=255)),
+                ("size_bytes", models.PositiveBigIntegerField(default=0)),
+                ("error_summary", models.TextField(blank=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="export_jobs",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["params_hash", "data_version"],
+                        name="export_job_reuse_idx",
+                    )
+                ],
+            },
+        ),
+    ]
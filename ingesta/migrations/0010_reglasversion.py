@@ -0,0 +1,33 @@
+import time
+
+from django.db import migrations, models
+
+
+def seed_version(apps, schema_editor):
+    ReglasVersion = apps.get_model("ingesta", "ReglasVersion")
+    ReglasVersion.objects.get_or_create(id=1, defaults={"version": time.time_ns()})
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("ingesta", "0009_exportjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReglasVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(seed_version, migrations.RunPython.noop),
+    ]
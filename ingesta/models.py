@@ -31,6 +31,12 @@ class Importacion(models.Model):
     error_summary = models.TextField(blank=True)
     log_json = models.JSONField(null=True, blank=True)
     s3_key_zip = models.CharField(max_length=255, blank=True)
+    progress_stage = models.CharField(max_length=20, blank=True)
+    progress_total = models.PositiveIntegerField(default=0)
+    progress_processed = models.PositiveIntegerField(default=0)
+    progress_errors = models.PositiveIntegerField(default=0)
+    progress_updated_at = models.DateTimeField(null=True, blank=True)
+    checkpoint_json = models.JSONField(null=True, blank=True)
 
     def __str__(self) -> str:
         return f"Importacion {self.id} ({self.status})"
@@ -70,13 +76,52 @@ class ArchivoFactura(models.Model):
         related_name="archivo",
     )
     s3_key_xml = models.CharField(max_length=255, unique=True)
-    sha256_xml = models.CharField(max_length=64, null=True, blank=True)
+    sha256_xml = models.CharField(max_length=64, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self) -> str:
         return f"{self.factura_id} -> {self.s3_key_xml}"
 
 
+class ImportacionArchivo(models.Model):
+    importacion = models.ForeignKey(
+        Importacion,
+        on_delete=models.CASCADE,
+        related_name="archivos",
+    )
+    position = models.PositiveIntegerField()
+    filename = models.CharField(max_length=500)
+    factura = models.ForeignKey(
+        Factura,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="importacion_archivos",
+    )
+    s3_key_xml = models.CharField(max_length=255, blank=True)
+    warnings = models.JSONField(default=list)
+    errors = models.JSONField(default=list)
+    unchanged = models.BooleanField(default=False)
+    duplicate_of = models.CharField(max_length=500, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["importacion", "position"],
+                name="importacion_archivo_position_uniq",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["importacion", "factura", "position"],
+                name="importacion_archivo_fact_pos",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.importacion_id}:{self.position} {self.filename}"
+
+
 class Categoria(models.Model):
     nombre = models.CharField(max_length=120)
     codigo = models.CharField(max_length=32, blank=True)
@@ -118,6 +163,19 @@ class ReglaClasificacion(models.Model):
         return f"{self.tipo}:{self.patron} -> {self.categoria}"
 
 
+class ReglasVersion(models.Model):
+    """Single row holding the version of the classification rules.
+
+    It lives in the database so web and worker processes agree on it
+    whatever cache backend each one runs with.
+    """
+
+    version = models.BigIntegerField()
+
+    def __str__(self) -> str:
+        return f"Reglas v{self.version}"
+
+
 class AsignacionClasificacionFactura(models.Model):
     class Metodo(models.TextChoices):
         AUTO = "AUTO", "Auto"
@@ -150,3 +208,74 @@ class AsignacionClasificacionFactura(models.Model):
 
     def __str__(self) -> str:
         return f"{self.factura_id} -> {self.categoria_sugerida_id or 'sin categoria'}"
+
+
+class PlanSnapshot(models.Model):
+    """Serialized ``build_plan_payload`` of an import, served as-is."""
+
+    importacion = models.OneToOneField(
+        Importacion,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="plan_snapshot",
+    )
+    version = models.CharField(max_length=64)
+    factura_limit = models.PositiveIntegerField()
+    body = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"Plan {self.importacion_id} ({self.version[:12]})"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+class ExportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        DONE = "DONE", "Done"
+        FAILED = "FAILED", "Failed"
+
+    class Formato(models.TextChoices):
+        CSV = "csv", "CSV"
+        JSONL = "jsonl", "JSONL"
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="export_jobs",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    formato = models.CharField(max_length=10, choices=Formato.choices)
+    params = models.JSONField(default=dict)
+    params_hash = models.CharField(max_length=64)
+    data_version = models.CharField(max_length=64)
+    progress_total = models.PositiveIntegerField(default=0)
+    progress_processed = models.PositiveIntegerField(default=0)
+    progress_updated_at = models.DateTimeField(null=True, blank=True)
+    s3_key = models.CharField(max_length=255, blank=True)
+    size_bytes = models.PositiveBigIntegerField(default=0)
+    error_summary = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["params_hash", "data_version"],
+                name="export_job_reuse_idx",
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"Exportacion {self.id} ({self.status})"
@@ -0,0 +1,292 @@
+"""Batched persistence of parsed facturas for ZIP imports."""
+from __future__ import annotations
+
+import hashlib
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from django.db import connection, transaction
+
+from ingesta.models import ArchivoFactura, Factura, Proveedor
+from ingesta.services.parser_xml import ParsedFactura
+
+FACTURA_UPDATE_FIELDS = [
+    "proveedor",
+    "fecha_emision",
+    "total",
+    "subtotal",
+    "iva",
+    "moneda",
+]
+
+
+@dataclass
+class _Pendiente:
+    parsed: ParsedFactura
+    xml_bytes: bytes
+    log_entry: dict
+    sha256: str
+    xml_key: str = ""
+
+
+def _factura_values(factura: Factura) -> dict:
+    return {
+        "proveedor_id": factura.proveedor_id,
+        "fecha_emision": factura.fecha_emision,
+        "total": factura.total,
+        "subtotal": factura.subtotal,
+        "iva": factura.iva,
+        "moneda": factura.moneda,
+    }
+
+
+def _merge_factura(values: dict, parsed: ParsedFactura, proveedor: Proveedor) -> None:
+    values["proveedor_id"] = proveedor.id
+    if parsed.fecha_emision:
+        values["fecha_emision"] = parsed.fecha_emision
+    for field in ("total", "subtotal", "iva"):
+        value = getattr(parsed, field)
+        if value is not None:
+            values[field] = value
+    if parsed.moneda:
+        values["moneda"] = parsed.moneda
+
+
+def _copy_factura_refs(log_entry: dict, original: dict) -> None:
+    for key in ("factura_id", "clave_acceso", "s3_key_xml"):
+        log_entry[key] = original[key]
+
+
+def _insert_new(objs: list, unique_field: str) -> dict[str, int]:
+    """INSERT ... ON CONFLICT DO NOTHING; maps the keys actually inserted to
+    their new primary keys.
+
+    Counting from the statement rather than from an earlier read keeps the
+    totals right when concurrent shards insert the same rows.
+    """
+    if not objs:
+        return {}
+    meta = objs[0]._meta
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(field.column) for field in fields)
+    key = quote(meta.get_field(unique_field).column)
+    pk = quote(meta.pk.column)
+    row = f"({', '.join(['%s'] * len(fields))})"
+    insertadas: dict[str, int] = {}
+    batch_size = connection.ops.bulk_batch_size(fields, objs)
+    with connection.cursor() as cursor:
+        for start in range(0, len(objs), batch_size):
+            batch = objs[start : start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {quote(meta.db_table)} ({columns}) "
+                f"VALUES {', '.join([row] * len(batch))} "
+                f"ON CONFLICT ({key}) DO NOTHING RETURNING {key}, {pk}",
+                [
+                    field.get_db_prep_save(field.pre_save(obj, True), connection)
+                    for obj in batch
+                    for field in fields
+                ],
+            )
+            insertadas.update(cursor.fetchall())
+    return insertadas
+
+
+class FacturaBatchWriter:
+    """Collects parsed facturas and persists each batch with one upsert per table.
+
+    ``flush`` submits the XML uploads, writes the batch in one transaction and,
+    before committing, calls ``wait`` so every upload has landed and then the
+    optional ``before_commit`` hook (used for checkpoints). Log entries passed
+    to ``add`` are completed in place (``factura_id``, ``clave_acceso``,
+    ``s3_key_xml``); entries registered with ``add_duplicate`` receive the same
+    values as their original. Facturas are not classified here; the caller
+    classifies the whole import once it is written.
+    """
+
+    def __init__(
+        self,
+        upload: Callable[[bytes, str], str],
+        wait: Callable[[], None] | None = None,
+    ):
+        self.upload = upload
+        self.wait = wait
+        self.total_facturas = 0
+        self.total_proveedores = 0
+        self._pendientes: list[_Pendiente] = []
+        self._duplicados: list[tuple[dict, dict]] = []
+
+    def add(
+        self,
+        parsed: ParsedFactura,
+        xml_bytes: bytes,
+        log_entry: dict,
+        sha256: str | None = None,
+    ) -> None:
+        sha256 = sha256 or hashlib.sha256(xml_bytes).hexdigest()
+        self._pendientes.append(_Pendiente(parsed, xml_bytes, log_entry, sha256))
+
+    def add_duplicate(self, log_entry: dict, original: dict) -> None:
+        if "factura_id" in original:
+            _copy_factura_refs(log_entry, original)
+        else:
+            self._duplicados.append((log_entry, original))
+
+    def flush(self, before_commit: Callable[[], None] | None = None) -> None:
+        pendientes = self._pendientes
+        self._pendientes = []
+        for pendiente in pendientes:
+            parsed = pendiente.parsed
+            pendiente.xml_key = f"{parsed.ruc}/{parsed.clave_acceso}.xml"
+            self.upload(pendiente.xml_bytes, pendiente.xml_key)
+        with transaction.atomic():
+            if pendientes:
+                proveedores = self._upsert_proveedores(pendientes)
+                facturas = self._upsert_facturas(pendientes, proveedores)
+                self._upsert_archivos(pendientes, facturas)
+                for pendiente in pendientes:
+                    parsed = pendiente.parsed
+                    pendiente.log_entry.update(
+                        {
+                            "factura_id": facturas[parsed.clave_acceso].id,
+                            "clave_acceso": parsed.clave_acceso,
+                            "s3_key_xml": pendiente.xml_key,
+                        }
+                    )
+                for log_entry, original in self._duplicados:
+                    _copy_factura_refs(log_entry, original)
+                self._duplicados = []
+            if self.wait is not None:
+                self.wait()
+            if before_commit is not None:
+                before_commit()
+
+    def _upsert_proveedores(self, pendientes: list[_Pendiente]) -> dict[str, Proveedor]:
+        razones: dict[str, str | None] = {}
+        for pendiente in pendientes:
+            ruc = pendiente.parsed.ruc
+            if not razones.get(ruc):
+                razones[ruc] = pendiente.parsed.razon_social
+        existentes = {
+            proveedor.ruc: proveedor
+            for proveedor in Proveedor.objects.filter(ruc__in=razones)
+        }
+        nuevos = sorted(razones.keys() - existentes.keys())
+        creados = _insert_new(
+            [Proveedor(ruc=ruc, razon_social=razones[ruc]) for ruc in nuevos], "ruc"
+        )
+        self.total_proveedores += len(creados)
+        perdidos = [ruc for ruc in nuevos if ruc not in creados]
+        if perdidos:
+            # Inserted by a concurrent shard after the read above.
+            existentes.update(
+                {
+                    proveedor.ruc: proveedor
+                    for proveedor in Proveedor.objects.filter(ruc__in=perdidos)
+                }
+            )
+        por_guardar = [
+            Proveedor(ruc=ruc, razon_social=razon_social)
+            for ruc, razon_social in sorted(razones.items())
+            if ruc in existentes and razon_social and not existentes[ruc].razon_social
+        ]
+        for proveedor in por_guardar:
+            existentes[proveedor.ruc].razon_social = proveedor.razon_social
+        if por_guardar:
+            Proveedor.objects.bulk_create(
+                por_guardar,
+                update_conflicts=True,
+                unique_fields=["ruc"],
+                update_fields=["razon_social"],
+            )
+        for ruc, proveedor_id in creados.items():
+            existentes[ruc] = Proveedor(
+                id=proveedor_id, ruc=ruc, razon_social=razones[ruc]
+            )
+        return existentes
+
+    def _upsert_facturas(
+        self,
+        pendientes: list[_Pendiente],
+        proveedores: dict[str, Proveedor],
+    ) -> dict[str, Factura]:
+        claves = {pendiente.parsed.clave_acceso for pendiente in pendientes}
+        valores: dict[str, dict] = {
+            factura.clave_acceso: _factura_values(factura)
+            for factura in Factura.objects.filter(clave_acceso__in=claves)
+        }
+        nuevas: dict[str, dict] = {}
+        for pendiente in pendientes:
+            parsed = pendiente.parsed
+            if parsed.clave_acceso in valores:
+                continue
+            proveedor = proveedores[parsed.ruc]
+            values = nuevas.get(parsed.clave_acceso)
+            if values is None:
+                nuevas[parsed.clave_acceso] = {
+                    "proveedor_id": proveedor.id,
+                    "fecha_emision": parsed.fecha_emision,
+                    "total": parsed.total,
+                    "subtotal": parsed.subtotal,
+                    "iva": parsed.iva,
+                    "moneda": parsed.moneda or "USD",
+                }
+            else:
+                _merge_factura(values, parsed, proveedor)
+        creadas = _insert_new(
+            [Factura(clave_acceso=clave, **nuevas[clave]) for clave in sorted(nuevas)],
+            "clave_acceso",
+        )
+        self.total_facturas += len(creadas)
+        perdidas = nuevas.keys() - creadas
+        if perdidas:
+            # Inserted by a concurrent shard: merge into its row instead.
+            valores.update(
+                {
+                    factura.clave_acceso: _factura_values(factura)
+                    for factura in Factura.objects.filter(clave_acceso__in=perdidas)
+                }
+            )
+        for pendiente in pendientes:
+            parsed = pendiente.parsed
+            values = valores.get(parsed.clave_acceso)
+            if values is not None:
+                _merge_factura(values, parsed, proveedores[parsed.ruc])
+        if valores:
+            Factura.objects.bulk_create(
+                [
+                    Factura(clave_acceso=clave, **valores[clave])
+                    for clave in sorted(valores)
+                ],
+                update_conflicts=True,
+                unique_fields=["clave_acceso"],
+                update_fields=FACTURA_UPDATE_FIELDS,
+            )
+        proveedores_by_id = {
+            proveedor.id: proveedor for proveedor in proveedores.values()
+        }
+        facturas: dict[str, Factura] = {}
+        for factura in Factura.objects.filter(clave_acceso__in=claves):
+            factura.proveedor = proveedores_by_id[factura.proveedor_id]
+            facturas[factura.clave_acceso] = factura
+        return facturas
+
+    def _upsert_archivos(
+        self,
+        pendientes: list[_Pendiente],
+        facturas: dict[str, Factura],
+    ) -> None:
+        archivos: dict[int, ArchivoFactura] = {}
+        for pendiente in pendientes:
+            factura = facturas[pendiente.parsed.clave_acceso]
+            archivos[factura.id] = ArchivoFactura(
+                factura=factura,
+                s3_key_xml=pendiente.xml_key,
+                sha256_xml=pendiente.sha256,
+            )
+        ArchivoFactura.objects.bulk_create(
+            [archivos[factura_id] for factura_id in sorted(archivos)],
+            update_conflicts=True,
+            unique_fields=["factura"],
+            update_fields=["s3_key_xml", "sha256_xml"],
+        )
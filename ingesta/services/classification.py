@@ -1,14 +1,40 @@
 from __future__ import annotations
 
-from typing import Iterable
+import hashlib
+from collections import deque
+from collections.abc import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Trim
+from django.utils import timezone
 
 from ingesta.models import (
     AsignacionClasificacionFactura,
     Categoria,
     Confianza,
     Factura,
+    ImportacionArchivo,
+    Proveedor,
     ReglaClasificacion,
 )
+from ingesta.services.plan import invalidate_plan_snapshots
+
+PROVEEDOR_MEMO_KEY = "ingesta:rules:proveedor:{version}:{proveedor_id}:{digest}"
+RUC_RANK = -1
+
+# (categoria_id, confianza, razones, rank)
+ProveedorOutcome = tuple[int | None, str, list[str], int | None]
+
+ASIGNACION_UPSERT_FIELDS = [
+    "categoria_sugerida",
+    "confianza",
+    "razones",
+    "metodo",
+    "updated_at",
+]
 
 
 def _build_text(parts: Iterable[str | None]) -> str:
@@ -16,49 +42,416 @@ def _build_text(parts: Iterable[str | None]) -> str:
     return " ".join(cleaned)
 
 
+class KeywordAutomaton:
+    """Aho-Corasick matcher that reports the best-ranked pattern found in a text.
+
+    Patterns are added with an integer rank (lower wins); ``best_match`` scans
+    the text once, whatever the number of patterns.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[str, int]]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._best: list[int | None] = [None]
+        for pattern, rank in patterns:
+            self._add(pattern, rank)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, rank: int) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._best.append(None)
+            state = next_state
+        current = self._best[state]
+        if current is None or rank < current:
+            self._best[state] = rank
+
+    def _build_failure_links(self) -> None:
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                inherited = self._best[self._fail[next_state]]
+                own = self._best[next_state]
+                if inherited is not None and (own is None or inherited < own):
+                    self._best[next_state] = inherited
+
+    def best_match(self, text: str) -> int | None:
+        goto = self._goto
+        fail = self._fail
+        best_by_state = self._best
+        best: int | None = None
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            rank = best_by_state[state]
+            if rank is not None and (best is None or rank < best):
+                best = rank
+                if best == 0:
+                    break
+        return best
+
+
+class RuleSet:
+    """Active classification rules compiled for in-memory matching.
+
+    RUC rules are indexed by uppercase RUC and keyword rules by a
+    ``KeywordAutomaton``; in both cases the first rule by (prioridad, id)
+    wins, as with the per-factura queries this replaces.
+    """
+
+    def __init__(self, reglas: Iterable[ReglaClasificacion]):
+        self.version: int | None = None
+        self.por_ruc: dict[str, ReglaClasificacion] = {}
+        self.keywords: list[ReglaClasificacion] = []
+        self.categorias: dict[int, Categoria] = {}
+        for regla in sorted(reglas, key=lambda regla: (regla.prioridad, regla.id)):
+            self.categorias[regla.categoria_id] = regla.categoria
+            if regla.tipo == ReglaClasificacion.Tipo.RUC:
+                self.por_ruc.setdefault(regla.patron.upper(), regla)
+            elif regla.tipo == ReglaClasificacion.Tipo.KEYWORD and regla.patron.strip():
+                self.keywords.append(regla)
+        self.automaton = KeywordAutomaton(
+            (regla.patron.strip().upper(), rank)
+            for rank, regla in enumerate(self.keywords)
+        )
+        # Best rank of a keyword that could match inside a numeric clave.
+        self.min_digit_rank = next(
+            (
+                rank
+                for rank, regla in enumerate(self.keywords)
+                if any(char.isdigit() for char in regla.patron)
+            ),
+            None,
+        )
+
+    @classmethod
+    def load(cls) -> RuleSet:
+        return cls(
+            ReglaClasificacion.objects.filter(activo=True).select_related("categoria")
+        )
+
+    def classify(self, factura: Factura) -> tuple[Categoria | None, str, list[str]]:
+        proveedor = factura.proveedor
+        razones: list[str] = []
+
+        ruc = (proveedor.ruc or "").strip() if proveedor else ""
+        if ruc:
+            regla_ruc = self.por_ruc.get(ruc.upper())
+            if regla_ruc:
+                razones.append(f"RUC match {ruc}")
+                return regla_ruc.categoria, regla_ruc.confianza_base, razones
+
+        texto = _build_text(
+            [proveedor.razon_social if proveedor else None, factura.clave_acceso]
+        )
+        if texto and self.keywords:
+            rank = self.automaton.best_match(texto.upper())
+            if rank is not None:
+                regla = self.keywords[rank]
+                razones.append(f"Keyword '{regla.patron.strip()}' matched")
+                return regla.categoria, regla.confianza_base, razones
+
+        razones.append("Sin reglas aplicables")
+        return None, Confianza.LOW, razones
+
+    def classify_proveedor(self, proveedor: Proveedor) -> ProveedorOutcome:
+        """Outcome from the RUC and razón social alone, with the rank that
+        produced it (``RUC_RANK`` for RUC rules, None without a match)."""
+        ruc = (proveedor.ruc or "").strip()
+        if ruc:
+            regla_ruc = self.por_ruc.get(ruc.upper())
+            if regla_ruc:
+                return (
+                    regla_ruc.categoria_id,
+                    regla_ruc.confianza_base,
+                    [f"RUC match {ruc}"],
+                    RUC_RANK,
+                )
+        texto = _build_text([proveedor.razon_social])
+        if texto and self.keywords:
+            rank = self.automaton.best_match(texto.upper())
+            if rank is not None:
+                regla = self.keywords[rank]
+                return (
+                    regla.categoria_id,
+                    regla.confianza_base,
+                    [f"Keyword '{regla.patron.strip()}' matched"],
+                    rank,
+                )
+        return None, Confianza.LOW, ["Sin reglas aplicables"], None
+
+    def outcome_applies(self, rank: int | None, clave_acceso: str | None) -> bool:
+        """Whether a ``classify_proveedor`` outcome also holds for a factura.
+
+        Keywords never span into the clave (patterns are stripped), so a
+        numeric clave can only add matches for patterns containing digits.
+        """
+        if rank == RUC_RANK:
+            return True
+        clave = (clave_acceso or "").strip()
+        if not clave:
+            return True
+        if not (clave.isascii() and clave.isdigit()):
+            return False
+        if self.min_digit_rank is None:
+            return True
+        return rank is not None and rank < self.min_digit_rank
+
+
+class ProveedorMemo:
+    """Per-proveedor classification outcomes shared through the Django cache.
+
+    Entries are keyed by rules version, proveedor and a digest of its RUC and
+    razón social, so rule edits and razón social updates never reuse a stale
+    outcome. Facturas whose result depends on their clave fall back to
+    ``RuleSet.classify``.
+    """
+
+    def __init__(self, rule_set: RuleSet):
+        self.rule_set = rule_set
+        self._local: dict[str, ProveedorOutcome] = {}
+        self._pending: dict[str, ProveedorOutcome] = {}
+
+    def _key(self, proveedor: Proveedor) -> str:
+        digest = hashlib.sha1(
+            f"{proveedor.ruc}\0{proveedor.razon_social or ''}".encode()
+        ).hexdigest()[:16]
+        return PROVEEDOR_MEMO_KEY.format(
+            version=self.rule_set.version,
+            proveedor_id=proveedor.id,
+            digest=digest,
+        )
+
+    def prime(self, facturas: Iterable[Factura]) -> None:
+        if self.rule_set.version is None:
+            return
+        keys = {
+            self._key(factura.proveedor)
+            for factura in facturas
+            if factura.proveedor_id
+        } - self._local.keys()
+        if keys:
+            self._local.update(cache.get_many(keys))
+
+    def classify(self, factura: Factura) -> tuple[Categoria | None, str, list[str]]:
+        proveedor = factura.proveedor
+        if proveedor is None:
+            return self.rule_set.classify(factura)
+        key = self._key(proveedor)
+        outcome = self._local.get(key)
+        if outcome is None:
+            outcome = self.rule_set.classify_proveedor(proveedor)
+            self._local[key] = outcome
+            self._pending[key] = outcome
+        categoria_id, confianza, razones, rank = outcome
+        if not self.rule_set.outcome_applies(rank, factura.clave_acceso):
+            return self.rule_set.classify(factura)
+        return self.rule_set.categorias.get(categoria_id), confianza, list(razones)
+
+    def save(self) -> None:
+        if self._pending and self.rule_set.version is not None:
+            cache.set_many(self._pending, timeout=settings.RULES_CACHE_TIMEOUT)
+        self._pending = {}
+
+
 def classify_factura(
     factura: Factura,
+    rule_set: RuleSet | None = None,
 ) -> tuple[Categoria | None, str, list[str]]:
-    proveedor = factura.proveedor
-    razones: list[str] = []
-
-    ruc = (proveedor.ruc or "").strip() if proveedor else ""
-    if ruc:
-        regla_ruc = (
-            ReglaClasificacion.objects.filter(
-                activo=True,
-                tipo=ReglaClasificacion.Tipo.RUC,
-                patron__iexact=ruc,
+    if rule_set is None:
+        rule_set = RuleSet.load()
+    return rule_set.classify(factura)
+
+
+def _ruc_upsert_sql() -> str:
+    postgresql = connection.vendor == "postgresql"
+    json_array = "jsonb_build_array" if postgresql else "json_array"
+    distinct = "IS DISTINCT FROM" if postgresql else "IS NOT"
+    asignacion = AsignacionClasificacionFactura._meta.db_table
+    return f"""
+        WITH ranked AS (
+            SELECT
+                f.id AS factura_id,
+                r.categoria_id AS categoria_id,
+                r.confianza_base AS confianza,
+                TRIM(p.ruc) AS ruc,
+                ROW_NUMBER() OVER (
+                    PARTITION BY f.id ORDER BY r.prioridad, r.id
+                ) AS rn
+            FROM {Factura._meta.db_table} f
+            JOIN {Proveedor._meta.db_table} p ON p.id = f.proveedor_id
+            JOIN {ReglaClasificacion._meta.db_table} r
+                ON r.activo = %s
+                AND r.tipo = %s
+                AND r.patron <> ''
+                AND UPPER(r.patron) = UPPER(TRIM(p.ruc))
+            WHERE f.id IN (
+                SELECT ia.factura_id FROM {ImportacionArchivo._meta.db_table} ia
+                WHERE ia.importacion_id = %s AND ia.factura_id IS NOT NULL
+                AND (
+                    ia.unchanged = %s
+                    OR NOT EXISTS (
+                        SELECT 1 FROM {asignacion} a WHERE a.factura_id = ia.factura_id
+                    )
+                )
             )
-            .select_related("categoria")
-            .order_by("prioridad", "id")
-            .first()
         )
-        if regla_ruc:
-            razones.append(f"RUC match {ruc}")
-            return regla_ruc.categoria, regla_ruc.confianza_base, razones
-
-    texto = _build_text([proveedor.razon_social if proveedor else None, factura.clave_acceso])
-    texto_upper = texto.upper()
-    if texto_upper:
-        reglas = (
-            ReglaClasificacion.objects.filter(
-                activo=True,
-                tipo=ReglaClasificacion.Tipo.KEYWORD,
+        INSERT INTO {asignacion}
+            (factura_id, categoria_sugerida_id, confianza, razones, metodo, updated_at)
+        SELECT
+            factura_id, categoria_id, confianza, {json_array}(%s || ruc), %s, %s
+        FROM ranked
+        WHERE rn = 1
+        ON CONFLICT (factura_id) DO UPDATE SET
+            categoria_sugerida_id = EXCLUDED.categoria_sugerida_id,
+            confianza = EXCLUDED.confianza,
+            razones = EXCLUDED.razones,
+            metodo = EXCLUDED.metodo,
+            updated_at = EXCLUDED.updated_at
+        WHERE {asignacion}.metodo <> %s AND (
+            {asignacion}.categoria_sugerida_id {distinct} EXCLUDED.categoria_sugerida_id
+            OR {asignacion}.confianza <> EXCLUDED.confianza
+            OR {asignacion}.razones {distinct} EXCLUDED.razones
+        )
+        RETURNING factura_id
+    """
+
+
+def classify_importacion(
+    importacion_id: int,
+    rule_set: RuleSet | None = None,
+    heartbeat: Callable[[], None] | None = None,
+) -> dict[str, int]:
+    """Classifies the facturas an import wrote, set-based where possible.
+
+    Files skipped as ``unchanged`` keep the assignment they already have;
+    their facturas are classified only when they have none yet, as happens
+    after an earlier run committed them and failed before classifying.
+
+    RUC rules are applied with a single INSERT ... SELECT ... ON CONFLICT
+    statement that ranks matching rules per factura by (prioridad, id).
+    Only the facturas left over go through ``rule_set`` in Python. The
+    outcome matches ``classify_factura``; MANUAL assignments are kept.
+    ``heartbeat`` is called after every batch of that pass.
+
+    Only assignments whose outcome differs are written, and the stored plans
+    holding those facturas are dropped; the counts returned are of those.
+    """
+    metodo = AsignacionClasificacionFactura.Metodo
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                _ruc_upsert_sql(),
+                [
+                    True,
+                    ReglaClasificacion.Tipo.RUC,
+                    importacion_id,
+                    False,
+                    "RUC match ",
+                    metodo.AUTO,
+                    connection.ops.adapt_datetimefield_value(timezone.now()),
+                    metodo.MANUAL,
+                ],
             )
-            .select_related("categoria")
-            .order_by("prioridad", "id")
+            cambiadas = [factura_id for (factura_id,) in cursor.fetchall()]
+        # Raw and bulk writes skip the signals that invalidate stored plans.
+        if cambiadas:
+            invalidate_plan_snapshots(cambiadas)
+    por_ruc = len(cambiadas)
+
+    if rule_set is None:
+        rule_set = RuleSet.load()
+    restantes = (
+        Factura.objects.filter(
+            id__in=ImportacionArchivo.objects.filter(
+                Q(unchanged=False) | Q(factura__clasificacion__isnull=True),
+                importacion_id=importacion_id,
+                factura__isnull=False,
+            ).values("factura_id")
         )
-        for regla in reglas:
-            patron = regla.patron.strip()
-            if not patron:
-                continue
-            if patron.upper() in texto_upper:
-                razones.append(f"Keyword '{patron}' matched")
-                return regla.categoria, regla.confianza_base, razones
+        .exclude(clasificacion__metodo=metodo.MANUAL)
+        .exclude(
+            Exists(
+                ReglaClasificacion.objects.filter(
+                    activo=True,
+                    tipo=ReglaClasificacion.Tipo.RUC,
+                    patron__iexact=Trim(OuterRef("proveedor__ruc")),
+                ).exclude(patron="")
+            )
+        )
+        .select_related("proveedor", "clasificacion")
+        .order_by("id")
+    )
+    batch_size = settings.RECLASSIFY_BATCH_SIZE
+    memo = ProveedorMemo(rule_set)
+    por_keyword = 0
+    batch: list[Factura] = []
+    for factura in restantes.iterator(chunk_size=batch_size):
+        batch.append(factura)
+        if len(batch) >= batch_size:
+            por_keyword += _classify_batch(batch, memo)
+            batch = []
+            if heartbeat is not None:
+                heartbeat()
+    if batch:
+        por_keyword += _classify_batch(batch, memo)
+    return {"ruc": por_ruc, "restantes": por_keyword}
+
+
+def _classify_batch(batch: list[Factura], memo: ProveedorMemo) -> int:
+    memo.prime(batch)
+    asignaciones: list[AsignacionClasificacionFactura] = []
+    for factura in batch:
+        categoria, confianza, razones = memo.classify(factura)
+        actual = getattr(factura, "clasificacion", None)
+        if (
+            actual is not None
+            and actual.categoria_sugerida_id == (categoria.id if categoria else None)
+            and actual.confianza == confianza
+            and actual.razones == razones
+        ):
+            continue
+        asignaciones.append(
+            AsignacionClasificacionFactura(
+                factura=factura,
+                categoria_sugerida=categoria,
+                confianza=confianza,
+                razones=razones,
+                metodo=AsignacionClasificacionFactura.Metodo.AUTO,
+            )
+        )
+    if asignaciones:
+        with transaction.atomic():
+            _upsert_asignaciones(asignaciones)
+            invalidate_plan_snapshots(
+                [asignacion.factura_id for asignacion in asignaciones]
+            )
+    memo.save()
+    return len(asignaciones)
+
 
-    razones.append("Sin reglas aplicables")
-    return None, Confianza.LOW, razones
+def _upsert_asignaciones(asignaciones: list[AsignacionClasificacionFactura]) -> int:
+    AsignacionClasificacionFactura.objects.bulk_create(
+        asignaciones,
+        update_conflicts=True,
+        unique_fields=["factura"],
+        update_fields=ASIGNACION_UPSERT_FIELDS,
+    )
+    return len(asignaciones)
 
 
 def upsert_asignacion_factura(
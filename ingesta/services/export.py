@@ -0,0 +1,63 @@
+"""CSV export of every factura in an import, produced while it is read."""
+
+from __future__ import annotations
+
+import csv
+import io
+from collections.abc import Iterable, Iterator
+
+from django.conf import settings
+
+from ingesta.services.plan import first_archivos
+
+CSV_HEADER = ["ruc", "razon_social", "clave_acceso", "categoria_sugerida", "confianza"]
+CSV_FLUSH_BYTES = 64 * 1024
+
+
+def export_rows(importacion, chunk_size: int | None = None) -> Iterator[list[str]]:
+    """CSV rows in file order, fetched ``chunk_size`` at a time.
+
+    Reads plain tuples through ``iterator()`` (a server-side cursor on
+    PostgreSQL), so memory does not grow with the import.
+    """
+    rows = (
+        first_archivos(importacion)
+        .order_by("position")
+        .values_list(
+            "factura__proveedor__ruc",
+            "factura__proveedor__razon_social",
+            "factura__clave_acceso",
+            "factura__clasificacion__categoria_sugerida__nombre",
+            "factura__clasificacion__confianza",
+        )
+    )
+    for ruc, razon_social, clave_acceso, categoria, confianza in rows.iterator(
+        chunk_size=chunk_size or settings.EXPORT_CSV_CHUNK_SIZE
+    ):
+        yield [
+            ruc,
+            razon_social or "",
+            clave_acceso,
+            categoria or "Sin categoría",
+            confianza or "-",
+        ]
+
+
+def iter_csv(
+    rows: Iterable[list[str]], flush_bytes: int = CSV_FLUSH_BYTES
+) -> Iterator[bytes]:
+    """UTF-8 CSV: the header right away, then rows in ~``flush_bytes`` blocks."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_HEADER)
+    yield buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= flush_bytes:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
@@ -0,0 +1,267 @@
+"""Bulk factura exports written to object storage by a Celery job.
+
+``request_export`` records an ``ExportJob`` (or hands back an equivalent one
+whose data has not changed since) and ``run_export`` streams the matching
+facturas in keyset batches into a gzip-compressed CSV or JSONL object.
+"""
+
+from __future__ import annotations
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import tempfile
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Max, QuerySet
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ingesta.models import (
+    Categoria,
+    ExportJob,
+    Factura,
+    Importacion,
+    ImportacionArchivo,
+)
+from ingesta.services.storage import ensure_bucket, get_storage
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = (
+    ("factura_id", "id"),
+    ("clave_acceso", "clave_acceso"),
+    ("fecha_emision", "fecha_emision"),
+    ("proveedor_ruc", "proveedor__ruc"),
+    ("razon_social", "proveedor__razon_social"),
+    ("categoria", "clasificacion__categoria_sugerida__nombre"),
+    ("confianza", "clasificacion__confianza"),
+    ("metodo", "clasificacion__metodo"),
+    ("subtotal", "subtotal"),
+    ("iva", "iva"),
+    ("total", "total"),
+    ("moneda", "moneda"),
+)
+EXPORT_COLUMNS = [column for column, _lookup in EXPORT_FIELDS]
+ACTIVE_STATUSES = (ExportJob.Status.PENDING, ExportJob.Status.RUNNING)
+REUSABLE_STATUSES = (*ACTIVE_STATUSES, ExportJob.Status.DONE)
+
+
+def normalize_params(raw: dict) -> dict:
+    """Validated filters with a canonical shape. Raises ``ValueError``."""
+    params: dict = {}
+    for name in ("fecha_desde", "fecha_hasta"):
+        value = raw.get(name)
+        if value:
+            try:
+                params[name] = date.fromisoformat(str(value)).isoformat()
+            except ValueError:
+                raise ValueError(f"{name} inválida: {value}") from None
+    if params.get("fecha_desde", "") > params.get("fecha_hasta", "9999-12-31"):
+        raise ValueError("fecha_desde posterior a fecha_hasta")
+    importacion_ids = raw.get("importacion_ids")
+    if importacion_ids:
+        if not isinstance(importacion_ids, list):
+            raise ValueError("importacion_ids debe ser una lista")
+        try:
+            params["importacion_ids"] = sorted(
+                {int(value) for value in importacion_ids}
+            )
+        except (TypeError, ValueError):
+            raise ValueError(f"importacion_ids inválidos: {importacion_ids}") from None
+    return params
+
+
+def export_queryset(params: dict) -> QuerySet[Factura]:
+    facturas = Factura.objects.all()
+    if params.get("fecha_desde"):
+        facturas = facturas.filter(fecha_emision__gte=params["fecha_desde"])
+    if params.get("fecha_hasta"):
+        facturas = facturas.filter(fecha_emision__lte=params["fecha_hasta"])
+    if params.get("importacion_ids"):
+        facturas = facturas.filter(
+            id__in=ImportacionArchivo.objects.filter(
+                importacion_id__in=params["importacion_ids"],
+                factura__isnull=False,
+            ).values("factura_id")
+        )
+    return facturas
+
+
+def _hash(value) -> str:
+    encoded = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def data_fingerprint(params: dict) -> str:
+    """Cheap digest of everything an export with ``params`` would contain.
+
+    Facturas and proveedores are only written by imports, which commit them
+    batch by batch whether they end DONE or FAILED, so the latest import
+    progress or finish stands in for their contents; assignments carry
+    ``updated_at`` and categorías are few enough to hash whole. Edits made
+    through the admin are not seen; pass ``force`` to ``request_export`` after
+    those.
+    """
+    facturas = export_queryset(params).aggregate(
+        count=Count("id"),
+        max_id=Max("id"),
+        asignaciones=Count("clasificacion"),
+        asignado=Max("clasificacion__updated_at"),
+    )
+    importado = Importacion.objects.aggregate(
+        finished=Max("finished_at"),
+        progress=Max("progress_updated_at"),
+    )
+    categorias = list(Categoria.objects.order_by("id").values_list("id", "nombre"))
+    return _hash([facturas, importado, categorias])
+
+
+def request_export(
+    formato: str,
+    params: dict,
+    user=None,
+    force: bool = False,
+) -> tuple[ExportJob, bool]:
+    """Return ``(job, reused)``; a new job still has to be enqueued.
+
+    A PENDING or RUNNING job without progress for ``EXPORT_STALE_AFTER``
+    seconds is taken as lost: it is marked FAILED and a new job is created.
+    """
+    params = normalize_params(params)
+    params_hash = _hash({"formato": formato, "params": params})
+    data_version = data_fingerprint(params)
+    if not force:
+        job = (
+            ExportJob.objects.filter(
+                params_hash=params_hash,
+                data_version=data_version,
+                status__in=REUSABLE_STATUSES,
+            )
+            .annotate(
+                last_activity=Coalesce(
+                    "progress_updated_at", "started_at", "created_at"
+                )
+            )
+            .order_by("-id")
+            .first()
+        )
+        if job is not None and _is_stale(job):
+            ExportJob.objects.filter(id=job.id, status=job.status).update(
+                status=ExportJob.Status.FAILED,
+                finished_at=timezone.now(),
+                error_summary="Exportación sin progreso",
+            )
+            job = None
+        if job is not None and (
+            job.status != ExportJob.Status.DONE or get_storage().exists(job.s3_key)
+        ):
+            return job, True
+    job = ExportJob.objects.create(
+        user=user if user is not None and user.is_authenticated else None,
+        formato=formato,
+        params=params,
+        params_hash=params_hash,
+        data_version=data_version,
+    )
+    return job, False
+
+
+def _is_stale(job: ExportJob) -> bool:
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPORT_STALE_AFTER)
+    return job.status in ACTIVE_STATUSES and job.last_activity < cutoff
+
+
+def _csv_writer(text: io.TextIOBase):
+    writer = csv.writer(text)
+    writer.writerow(EXPORT_COLUMNS)
+    return lambda rows: writer.writerows(
+        ["" if value is None else value for value in row] for row in rows
+    )
+
+
+def _jsonl_writer(text: io.TextIOBase):
+    def write(rows) -> None:
+        for row in rows:
+            text.write(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row, strict=True)), default=str)
+            )
+            text.write("\n")
+
+    return write
+
+
+WRITERS = {
+    ExportJob.Formato.CSV: _csv_writer,
+    ExportJob.Formato.JSONL: _jsonl_writer,
+}
+
+
+def export_key(job: ExportJob) -> str:
+    return f"exports/{job.id}/facturas.{job.formato}.gz"
+
+
+def run_export(job_id: int, batch_size: int | None = None) -> None:
+    """Build and upload the artifact of a PENDING job; others are left alone."""
+    claimed = ExportJob.objects.filter(
+        id=job_id, status=ExportJob.Status.PENDING
+    ).update(status=ExportJob.Status.RUNNING, started_at=timezone.now())
+    if not claimed:
+        logger.info("Exportacion %s ya fue tomada", job_id)
+        return
+    job = ExportJob.objects.get(id=job_id)
+    try:
+        _write_export(job, batch_size or settings.EXPORT_BATCH_SIZE)
+    except Exception as exc:
+        logger.exception("Fallo exportando %s", job_id)
+        ExportJob.objects.filter(id=job_id).update(
+            status=ExportJob.Status.FAILED,
+            finished_at=timezone.now(),
+            error_summary=str(exc),
+        )
+
+
+def _write_export(job: ExportJob, batch_size: int) -> None:
+    facturas = export_queryset(job.params)
+    total = facturas.count()
+    ExportJob.objects.filter(id=job.id).update(
+        progress_total=total, progress_updated_at=timezone.now()
+    )
+    rows = facturas.order_by("id").values_list(
+        *(lookup for _column, lookup in EXPORT_FIELDS)
+    )
+    processed = 0
+    with tempfile.SpooledTemporaryFile(settings.EXPORT_SPOOL_MAX_BYTES) as spool:
+        with gzip.GzipFile(fileobj=spool, mode="wb") as compressed:
+            text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+            write = WRITERS[job.formato](text)
+            last_id = 0
+            while True:
+                batch = list(rows.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                write(batch)
+                processed += len(batch)
+                ExportJob.objects.filter(id=job.id).update(
+                    progress_processed=processed, progress_updated_at=timezone.now()
+                )
+            text.flush()
+            text.detach()
+        size = spool.tell()
+        spool.seek(0)
+        key = export_key(job)
+        ensure_bucket()
+        get_storage().put_fileobj(spool, key, "application/gzip")
+    ExportJob.objects.filter(id=job.id).update(
+        status=ExportJob.Status.DONE,
+        finished_at=timezone.now(),
+        progress_total=max(total, processed),
+        progress_processed=processed,
+        s3_key=key,
+        size_bytes=size,
+    )
@@ -0,0 +1,66 @@
+"""Optional multi-process parse stage for ZIP imports."""
+from __future__ import annotations
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from ingesta.services.parser_xml import ParsedFactura, parse_xml_bytes
+
+logger = logging.getLogger(__name__)
+
+ParseResult = tuple[ParsedFactura | None, list[str], str | None]
+
+
+def parse_safe(xml_bytes: bytes, stream_min_bytes: int = 0) -> ParseResult:
+    try:
+        parsed, warnings = parse_xml_bytes(xml_bytes, stream_min_bytes)
+    except Exception as exc:
+        return None, [], f"XML inválido: {exc}"
+    return parsed, warnings, None
+
+
+class ParsePool:
+    """Parses XML blobs in input order, in worker processes when worthwhile.
+
+    With ``workers <= 1`` or fewer than ``min_files`` documents it parses
+    serially in the calling process. If the pool cannot run (for example
+    inside a daemonic worker) it logs a warning and falls back to serial.
+    Documents of at least ``stream_min_bytes`` are parsed in streaming mode.
+    """
+
+    def __init__(
+        self, workers: int, total: int, min_files: int, stream_min_bytes: int = 0
+    ):
+        self.workers = workers
+        self._parse = partial(parse_safe, stream_min_bytes=stream_min_bytes)
+        self._executor: ProcessPoolExecutor | None = None
+        if workers > 1 and total >= min_files:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+
+    @property
+    def parallel(self) -> bool:
+        return self._executor is not None
+
+    def parse(self, blobs: list[bytes]) -> list[ParseResult]:
+        if self._executor is None:
+            return [self._parse(xml_bytes) for xml_bytes in blobs]
+        chunksize = max(1, len(blobs) // (self.workers * 4))
+        try:
+            return list(self._executor.map(self._parse, blobs, chunksize=chunksize))
+        except (BrokenProcessPool, AssertionError, OSError):
+            logger.warning("Pool de parseo no disponible; se parsea en serie")
+            self.close()
+            return [self._parse(xml_bytes) for xml_bytes in blobs]
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> ParsePool:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-from typing import Iterable
 from xml.etree import ElementTree
 
+GENERIC_LAYOUT = "generic"
+STREAM_LAYOUT = "stream"
+
 
 @dataclass
 class ParsedFactura:
@@ -17,23 +19,204 @@ class ParsedFactura:
     subtotal: Decimal | None
     iva: Decimal | None
     moneda: str | None
+    # Extraction path taken: a known layout key, "generic" or "stream".
+    layout: str = field(default=GENERIC_LAYOUT, compare=False)
+
+
+# Target fields and, per normalized tag, the fields it can fill. A field takes
+# the first element in document order with non-empty text.
+_FIELD_TAGS = {
+    "ruc": ("ruc", "rucemisor", "ruccomprador"),
+    "razon_social": ("razonsocial", "razonsocialcomprador", "razonsocialemisor"),
+    "clave": ("claveacceso", "clave"),
+    "fecha_emision": ("fechaemision", "fecha"),
+    "subtotal": ("totalsinimpuestos", "subtotal"),
+    "total": ("importetotal", "total"),
+    "iva": ("iva",),
+    "moneda": ("moneda",),
+}
+_FIELDS_BY_TAG: dict[str, tuple[str, ...]] = {}
+for _name, _tags in _FIELD_TAGS.items():
+    for _tag in _tags:
+        _FIELDS_BY_TAG[_tag] = _FIELDS_BY_TAG.get(_tag, ()) + (_name,)
+# First ``valor`` inside a ``totalImpuesto``: IVA fallback when there is no <iva>.
+_IVA_IMPUESTO = "iva_impuesto"
+
+# Direct paths for known SRI layouts, keyed by (root tag, version attribute).
+# A layout is used only when every required field is found at its path;
+# otherwise the document goes through the generic search.
+_FACTURA_PATHS = {
+    "ruc": "infoTributaria/ruc",
+    "razon_social": "infoTributaria/razonSocial",
+    "clave": "infoTributaria/claveAcceso",
+    "fecha_emision": "infoFactura/fechaEmision",
+    "subtotal": "infoFactura/totalSinImpuestos",
+    "total": "infoFactura/importeTotal",
+    _IVA_IMPUESTO: "infoFactura/totalConImpuestos/totalImpuesto/valor",
+    "moneda": "infoFactura/moneda",
+}
+_LAYOUTS: dict[tuple[str, str], dict[str, str]] = {
+    ("factura", version): _FACTURA_PATHS
+    for version in ("1.0.0", "1.1.0", "2.0.0", "2.1.0")
+}
+_REQUIRED_FIELDS = ("ruc", "razon_social", "clave", "fecha_emision", "total")
+
+_TAG_CACHE: dict[str, str] = {}
+_TAG_CACHE_MAX = 4096
 
 
 def _normalize_tag(tag: str) -> str:
+    normalized = _TAG_CACHE.get(tag)
+    if normalized is not None:
+        return normalized
     if "}" in tag:
-        return tag.split("}", 1)[1].lower()
-    return tag.lower()
+        normalized = tag.split("}", 1)[1].lower()
+    else:
+        normalized = tag.lower()
+    if len(_TAG_CACHE) >= _TAG_CACHE_MAX:
+        _TAG_CACHE.clear()
+    _TAG_CACHE[tag] = normalized
+    return normalized
+
+
+def _first_valor(elem: ElementTree.Element) -> str | None:
+    for child in elem.iter():
+        if _normalize_tag(child.tag) == "valor" and child.text:
+            value = child.text.strip()
+            if value:
+                return value
+    return None
 
 
-def _find_first_text(root: ElementTree.Element, names: Iterable[str]) -> str | None:
-    candidates = {name.lower() for name in names}
+def _extract_fields(root: ElementTree.Element) -> dict[str, str]:
+    """Fill every target field in a single walk over ``root``."""
+    values: dict[str, str] = {}
+    cache = _TAG_CACHE
     for elem in root.iter():
+        tag = elem.tag
+        normalized = cache.get(tag) or _normalize_tag(tag)
+        fields = _FIELDS_BY_TAG.get(normalized)
+        if fields is None:
+            if normalized == "totalimpuesto" and _IVA_IMPUESTO not in values:
+                value = _first_valor(elem)
+                if value:
+                    values[_IVA_IMPUESTO] = value
+            continue
+        text = elem.text
+        if not text:
+            continue
+        value = text.strip()
+        if not value:
+            continue
+        for name in fields:
+            if name not in values:
+                values[name] = value
+    return values
+
+
+_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_events(data: bytes | str):
+    parser = ElementTree.XMLPullParser(events=("start", "end"))
+    for offset in range(0, len(data), _STREAM_CHUNK_SIZE):
+        parser.feed(data[offset : offset + _STREAM_CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def _stream_fields(
+    data: bytes | str, warnings: list[str], *, unwrap: bool = True
+) -> dict[str, str]:
+    """Streaming counterpart of ``_unwrap_autorizacion`` + ``_extract_fields``.
+
+    Each element is detached from its parent as soon as it ends, so only the
+    open path is kept in memory. Values are read at ``end`` but ranked by
+    ``start`` order, which keeps the same first-match precedence. An
+    ``autorizacion`` comprobante is streamed from its text when it ends.
+    """
+    values: dict[str, str] = {}
+    ranks: dict[str, int] = {}
+    pending: dict[ElementTree.Element, int] = {}
+    stack: list[ElementTree.Element] = []
+    started = 0
+    impuesto_depth = 0
+    wrapper = False
+    comprobante_seen = False
+    inner: dict[str, str] | None = None
+
+    for event, elem in _iter_events(data):
         tag = _normalize_tag(elem.tag)
-        if tag in candidates and elem.text:
+        if event == "start":
+            if not stack:
+                wrapper = unwrap and tag == "autorizacion"
+            if tag == "totalimpuesto":
+                impuesto_depth += 1
+            if tag in _FIELDS_BY_TAG or (tag == "valor" and impuesto_depth):
+                pending[elem] = started
+            started += 1
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        if tag == "totalimpuesto":
+            impuesto_depth -= 1
+        rank = pending.pop(elem, None)
+        if rank is not None and elem.text:
+            value = elem.text.strip()
+            fields = _FIELDS_BY_TAG.get(tag, ())
+            if tag == "valor" and impuesto_depth:
+                fields = (*fields, _IVA_IMPUESTO)
+            for name in fields if value else ():
+                if name not in ranks or rank < ranks[name]:
+                    ranks[name] = rank
+                    values[name] = value
+        if wrapper and tag == "comprobante" and not comprobante_seen:
+            comprobante_seen = True
+            inner = _stream_comprobante(elem.text, warnings)
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+    if wrapper and not comprobante_seen:
+        warnings.append("No se encontró comprobante en autorización")
+    return values if inner is None else inner
+
+
+def _stream_comprobante(text: str | None, warnings: list[str]) -> dict[str, str] | None:
+    if not text:
+        warnings.append("No se encontró comprobante en autorización")
+        return None
+    comprobante_text = text.strip()
+    if not comprobante_text:
+        warnings.append("Comprobante vacío")
+        return None
+    try:
+        return _stream_fields(comprobante_text, warnings, unwrap=False)
+    except ElementTree.ParseError:
+        warnings.append("No se pudo parsear comprobante")
+        return None
+
+
+def _layout_key(root: ElementTree.Element) -> tuple[str, str] | None:
+    key = (root.tag, root.get("version", ""))
+    return key if key in _LAYOUTS else None
+
+
+def _extract_known(
+    root: ElementTree.Element, paths: dict[str, str]
+) -> dict[str, str] | None:
+    values: dict[str, str] = {}
+    for name, path in paths.items():
+        elem = root.find(path)
+        if elem is not None and elem.text:
             value = elem.text.strip()
             if value:
-                return value
-    return None
+                values[name] = value
+    if any(name not in values for name in _REQUIRED_FIELDS):
+        return None
+    return values
 
 
 def _parse_decimal(value: str | None) -> Decimal | None:
@@ -61,17 +244,6 @@ def _parse_date(value: str | None) -> datetime.date | None:
     return None
 
 
-def _find_iva(root: ElementTree.Element) -> str | None:
-    for elem in root.iter():
-        if _normalize_tag(elem.tag) == "totalimpuesto":
-            for child in elem.iter():
-                if _normalize_tag(child.tag) == "valor" and child.text:
-                    value = child.text.strip()
-                    if value:
-                        return value
-    return None
-
-
 def _normalize_currency(value: str | None) -> str | None:
     if not value:
         return None
@@ -110,51 +282,72 @@ def _unwrap_autorizacion(
         return root
 
 
-def parse_xml_bytes(xml_bytes: bytes) -> tuple[ParsedFactura, list[str]]:
+def parse_xml_bytes(
+    xml_bytes: bytes, stream_min_bytes: int = 0
+) -> tuple[ParsedFactura, list[str]]:
+    """Parse a comprobante or ``autorizacion`` wrapper.
+
+    Documents of at least ``stream_min_bytes`` (when positive) go through
+    ``parse_xml_stream`` instead of building the whole tree.
+    """
+    if stream_min_bytes > 0 and len(xml_bytes) >= stream_min_bytes:
+        return parse_xml_stream(xml_bytes)
     warnings: list[str] = []
     root = ElementTree.fromstring(xml_bytes)
     root = _unwrap_autorizacion(root, warnings)
+    key = _layout_key(root)
+    if key is not None:
+        values = _extract_known(root, _LAYOUTS[key])
+        if values is not None:
+            return _build_parsed(values, warnings, layout="@".join(key))
+    return _build_parsed(_extract_fields(root), warnings)
+
+
+def parse_xml_stream(xml_bytes: bytes) -> tuple[ParsedFactura, list[str]]:
+    """Same result as ``parse_xml_bytes`` with memory flat in the line count."""
+    warnings: list[str] = []
+    values = _stream_fields(xml_bytes, warnings)
+    return _build_parsed(values, warnings, layout=STREAM_LAYOUT)
+
 
-    ruc = _find_first_text(root, ["ruc", "rucemisor", "ruccomprador"])
+def _build_parsed(
+    fields: dict[str, str], warnings: list[str], layout: str = GENERIC_LAYOUT
+) -> tuple[ParsedFactura, list[str]]:
+    ruc = fields.get("ruc")
     if not ruc:
         warnings.append("No se encontró RUC")
 
-    razon_social = _find_first_text(
-        root, ["razonsocial", "razonsocialcomprador", "razonsocialemisor"]
-    )
+    razon_social = fields.get("razon_social")
     if not razon_social:
         warnings.append("No se encontró razón social")
 
-    clave = _find_first_text(root, ["claveacceso", "clave"])
+    clave = fields.get("clave")
     if not clave:
         warnings.append("No se encontró clave de acceso")
 
-    fecha_emision_raw = _find_first_text(root, ["fechaemision", "fecha"])
+    fecha_emision_raw = fields.get("fecha_emision")
     fecha_emision = _parse_date(fecha_emision_raw)
     if fecha_emision_raw and not fecha_emision:
         warnings.append("No se pudo parsear fecha de emisión")
     if not fecha_emision_raw:
         warnings.append("No se encontró fecha de emisión")
 
-    subtotal_raw = _find_first_text(root, ["totalsinimpuestos", "subtotal"])
+    subtotal_raw = fields.get("subtotal")
     subtotal = _parse_decimal(subtotal_raw)
     if subtotal_raw and subtotal is None:
         warnings.append("No se pudo parsear subtotal")
 
-    total_raw = _find_first_text(root, ["importetotal", "total"])
+    total_raw = fields.get("total")
     total = _parse_decimal(total_raw)
     if total_raw and total is None:
         warnings.append("No se pudo parsear total")
 
-    iva_raw = _find_first_text(root, ["iva"])
-    if not iva_raw:
-        iva_raw = _find_iva(root)
+    iva_raw = fields.get("iva") or fields.get(_IVA_IMPUESTO)
     iva = _parse_decimal(iva_raw)
     if iva_raw and iva is None:
         warnings.append("No se pudo parsear IVA")
 
-    moneda_raw = _find_first_text(root, ["moneda"])
-    moneda = _normalize_currency(moneda_raw) or "USD"
+    moneda = _normalize_currency(fields.get("moneda")) or "USD"
 
     return (
         ParsedFactura(
@@ -166,6 +359,7 @@ def parse_xml_bytes(xml_bytes: bytes) -> tuple[ParsedFactura, list[str]]:
             subtotal=subtotal,
             iva=iva,
             moneda=moneda,
+            layout=layout,
         ),
         warnings,
     )
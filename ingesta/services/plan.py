@@ -1,12 +1,18 @@
+import base64
+import binascii
+import hashlib
+import json
 import logging
 import re
 
+from django.db.models import Exists, Min, OuterRef
 from django.utils import timezone
 
 from ingesta.models import (
-    ArchivoFactura,
     AsignacionClasificacionFactura,
     Factura,
+    ImportacionArchivo,
+    PlanSnapshot,
 )
 
 logger = logging.getLogger(__name__)
@@ -35,28 +41,58 @@ def _build_proveedor_ruc(factura: Factura) -> str:
     return ruc
 
 
-def build_plan_payload(importacion, max_facturas=50):
-    file_logs = (importacion.log_json or {}).get("files", [])
-    factura_ids: list[int] = []
-    factura_seen: set[int] = set()
-    for entry in file_logs:
-        factura_id = entry.get("factura_id")
-        if factura_id and factura_id not in factura_seen:
-            factura_ids.append(factura_id)
-            factura_seen.add(factura_id)
-    if not factura_ids:
-        s3_keys: list[str] = []
-        for entry in file_logs:
-            key = entry.get("s3_key_xml") or entry.get("s3_key")
-            if key:
-                s3_keys.append(key)
-        if s3_keys:
-            factura_ids = list(
-                ArchivoFactura.objects.filter(s3_key_xml__in=s3_keys)
-                .values_list("factura_id", flat=True)
-                .distinct()
-            )
-    factura_ids = factura_ids[:max_facturas]
+def _importacion_facturas(importacion):
+    return ImportacionArchivo.objects.filter(
+        importacion=importacion,
+        factura__isnull=False,
+    )
+
+
+def _first_positions(importacion, limit=None) -> list[tuple[int, int]]:
+    rows = (
+        _importacion_facturas(importacion)
+        .values("factura_id")
+        .annotate(first_position=Min("position"))
+        .order_by("first_position")
+    )
+    if limit is not None:
+        rows = rows[:limit]
+    return [(row["factura_id"], row["first_position"]) for row in rows]
+
+
+def importacion_factura_ids(importacion, limit=None) -> list[int]:
+    """Distinct factura ids of an import, in the order their files appeared."""
+    return [
+        factura_id for factura_id, _position in _first_positions(importacion, limit)
+    ]
+
+
+def count_importacion_facturas(importacion) -> int:
+    return _importacion_facturas(importacion).values("factura_id").distinct().count()
+
+
+PLAN_FACTURA_LIMIT = 50
+
+
+def _plan_accion(factura: Factura, asignacion) -> dict[str, object]:
+    return {
+        "proveedor_id": factura.proveedor_id,
+        "proveedor_ruc": _build_proveedor_ruc(factura),
+        "factura_id": factura.id,
+        "clave_acceso": factura.clave_acceso,
+        "categoria_id": asignacion.categoria_sugerida_id,
+        "categoria_nombre": asignacion.categoria_sugerida.nombre,
+        "confianza": asignacion.confianza,
+    }
+
+
+def build_plan_payload(importacion, max_facturas=PLAN_FACTURA_LIMIT):
+    """The plan for the first ``max_facturas`` facturas of the import.
+
+    ``next_cursor`` continues through ``plan_page`` when more facturas follow.
+    """
+    positions = _first_positions(importacion, limit=max_facturas)
+    factura_ids = [factura_id for factura_id, _position in positions]
     facturas = (
         Factura.objects.filter(id__in=factura_ids)
         .select_related("proveedor")
@@ -77,22 +113,146 @@ def build_plan_payload(importacion, max_facturas=50):
         asignacion = asignaciones_by_id.get(factura_id)
         if not asignacion or not asignacion.categoria_sugerida:
             continue
-        proveedor_ruc = _build_proveedor_ruc(factura)
-        acciones.append(
-            {
-                "proveedor_id": factura.proveedor_id,
-                "proveedor_ruc": proveedor_ruc,
-                "factura_id": factura.id,
-                "clave_acceso": factura.clave_acceso,
-                "categoria_id": asignacion.categoria_sugerida_id,
-                "categoria_nombre": asignacion.categoria_sugerida.nombre,
-                "confianza": asignacion.confianza,
-            }
-        )
+        acciones.append(_plan_accion(factura, asignacion))
+    next_cursor = None
+    if len(positions) == max_facturas:
+        next_cursor = encode_plan_cursor(positions[-1][1])
     return {
         "importacion_id": importacion.id,
         "generated_at": timezone.now().isoformat(),
         "factura_limit": max_facturas,
         "total_items": len(acciones),
         "acciones": acciones,
+        "next_cursor": next_cursor,
+    }
+
+
+def encode_plan_cursor(position: int, total_items: int | None = None) -> str:
+    """Opaque cursor: the last position served and, once known, the total."""
+    raw = json.dumps({"p": position, "t": total_items}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("ascii")).decode("ascii").rstrip("=")
+
+
+def decode_plan_cursor(cursor: str) -> tuple[int, int | None]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        position, total_items = data["p"], data["t"]
+    except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError) as exc:
+        raise ValueError(f"Cursor inválido: {cursor}") from exc
+    valid_total = total_items is None or (
+        isinstance(total_items, int) and total_items >= 0
+    )
+    if not isinstance(position, int) or position < 0 or not valid_total:
+        raise ValueError(f"Cursor inválido: {cursor}")
+    return position, total_items
+
+
+def first_archivos(importacion):
+    """The import's files with a factura, one per factura at its first position.
+
+    Meant for keyset pagination or streaming in ``position`` order.
+    """
+    earlier = ImportacionArchivo.objects.filter(
+        importacion=importacion,
+        factura_id=OuterRef("factura_id"),
+        position__lt=OuterRef("position"),
+    )
+    return _importacion_facturas(importacion).exclude(Exists(earlier))
+
+
+def _plan_archivos(importacion):
+    """One row per plan action."""
+    return first_archivos(importacion).filter(
+        factura__clasificacion__categoria_sugerida__isnull=False
+    )
+
+
+def count_plan_items(importacion) -> int:
+    return _plan_archivos(importacion).count()
+
+
+def plan_page(importacion, limit: int, cursor: str | None = None) -> dict:
+    """One page of plan actions, keyset-paginated on the file position.
+
+    Each page is a single index range scan of ``limit + 1`` rows; the total is
+    counted on the first page only and carried in the cursor after that.
+    Raises ``ValueError`` for a malformed cursor.
+    """
+    after, total_items = decode_plan_cursor(cursor) if cursor else (-1, None)
+    if total_items is None:
+        total_items = count_plan_items(importacion)
+    rows = list(
+        _plan_archivos(importacion)
+        .filter(position__gt=after)
+        .select_related(
+            "factura__proveedor",
+            "factura__clasificacion__categoria_sugerida",
+        )
+        .order_by("position")[: limit + 1]
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_plan_cursor(rows[-1].position, total_items)
+    return {
+        "importacion_id": importacion.id,
+        "total_items": total_items,
+        "limit": limit,
+        "acciones": [
+            _plan_accion(row.factura, row.factura.clasificacion) for row in rows
+        ],
+        "next_cursor": next_cursor,
     }
+
+
+def _plan_version(payload: dict) -> str:
+    content = {key: value for key, value in payload.items() if key != "generated_at"}
+    encoded = json.dumps(content, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def refresh_plan_snapshot(importacion) -> PlanSnapshot:
+    """Rebuild the stored plan; the row is only rewritten if its content changed.
+
+    ``version`` hashes everything but ``generated_at``, so it doubles as a
+    stable ETag across rebuilds that produce the same plan.
+    """
+    payload = build_plan_payload(importacion)
+    version = _plan_version(payload)
+    snapshot = PlanSnapshot.objects.filter(importacion=importacion).first()
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    snapshot, _created = PlanSnapshot.objects.update_or_create(
+        importacion=importacion,
+        defaults={
+            "version": version,
+            "factura_limit": payload["factura_limit"],
+            "body": json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        },
+    )
+    return snapshot
+
+
+def get_plan_snapshot(importacion) -> PlanSnapshot:
+    snapshot = PlanSnapshot.objects.filter(importacion=importacion).first()
+    if snapshot is None:
+        snapshot = refresh_plan_snapshot(importacion)
+    return snapshot
+
+
+def invalidate_plan_snapshots(factura_ids=None) -> int:
+    """Drop the stored plans that include any of ``factura_ids`` (all if None).
+
+    ``factura_ids`` may be a list or a ``values("factura_id")`` queryset.
+    Dropped plans are rebuilt on their next request.
+    """
+    snapshots = PlanSnapshot.objects.all()
+    if factura_ids is not None:
+        snapshots = snapshots.filter(
+            importacion__in=ImportacionArchivo.objects.filter(
+                factura_id__in=factura_ids
+            ).values("importacion_id")
+        )
+    deleted, _by_model = snapshots.delete()
+    return deleted
@@ -0,0 +1,73 @@
+"""Throttled progress publishing for long-running imports."""
+from __future__ import annotations
+
+import time
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from ingesta.models import Importacion
+
+STAGE_LABELS = {
+    "listing": "Listando archivos",
+    "processing": "Procesando XML",
+    "classifying": "Clasificando facturas",
+    "plan": "Generando plan",
+    "done": "Terminada",
+    "failed": "Fallida",
+}
+
+
+def stage_label(stage: str) -> str:
+    return STAGE_LABELS.get(stage, stage or "Pendiente")
+
+
+class ProgressReporter:
+    """Accumulates processed/error deltas and writes them at most every
+    ``interval`` seconds, as increments so concurrent shards can share a row.
+    """
+
+    def __init__(self, importacion_id: int, interval: float | None = None):
+        self.importacion_id = importacion_id
+        self.interval = (
+            settings.IMPORT_PROGRESS_INTERVAL if interval is None else interval
+        )
+        self._processed = 0
+        self._errors = 0
+        self._last_flush = time.monotonic()
+
+    def start(self, stage: str, total: int = 0, processed: int = 0) -> None:
+        Importacion.objects.filter(id=self.importacion_id).update(
+            progress_stage=stage,
+            progress_total=total,
+            progress_processed=processed,
+            progress_errors=0,
+            progress_updated_at=timezone.now(),
+        )
+        self._last_flush = time.monotonic()
+
+    def stage(self, stage: str) -> None:
+        self.flush(progress_stage=stage)
+
+    def heartbeat(self) -> None:
+        """Keeps ``progress_updated_at`` fresh during stages that count nothing,
+        so ``requeue_stale_imports`` does not take them for dead runs."""
+        self.advance(0)
+
+    def advance(self, processed: int, errors: int = 0) -> None:
+        self._processed += processed
+        self._errors += errors
+        if time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, **extra) -> None:
+        Importacion.objects.filter(id=self.importacion_id).update(
+            progress_processed=F("progress_processed") + self._processed,
+            progress_errors=F("progress_errors") + self._errors,
+            progress_updated_at=timezone.now(),
+            **extra,
+        )
+        self._processed = 0
+        self._errors = 0
+        self._last_flush = time.monotonic()
@@ -0,0 +1,166 @@
+"""Bulk reclassification of existing facturas with the current rules."""
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from datetime import date
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from ingesta.models import (
+    AsignacionClasificacionFactura,
+    Confianza,
+    Factura,
+    ImportacionArchivo,
+)
+from ingesta.services.classification import ProveedorMemo, RuleSet
+from ingesta.services.plan import invalidate_plan_snapshots
+from ingesta.services.rule_cache import get_rule_set
+
+ASIGNACION_UPDATE_FIELDS = ["categoria_sugerida", "confianza", "razones", "updated_at"]
+
+
+@dataclass
+class ReclassifyStats:
+    scanned: int = 0
+    updated: int = 0
+    created: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.scanned / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "rate": round(self.rate, 1)}
+
+
+def reclassify_queryset(
+    importacion_id: int | None = None,
+    proveedor_id: int | None = None,
+    fecha_desde: date | None = None,
+    fecha_hasta: date | None = None,
+    solo_pendientes: bool = False,
+) -> QuerySet[Factura]:
+    facturas = Factura.objects.exclude(
+        clasificacion__metodo=AsignacionClasificacionFactura.Metodo.MANUAL
+    )
+    if importacion_id is not None:
+        facturas = facturas.filter(
+            id__in=ImportacionArchivo.objects.filter(
+                importacion_id=importacion_id,
+                factura__isnull=False,
+            ).values("factura_id")
+        )
+    if proveedor_id is not None:
+        facturas = facturas.filter(proveedor_id=proveedor_id)
+    if fecha_desde is not None:
+        facturas = facturas.filter(fecha_emision__gte=fecha_desde)
+    if fecha_hasta is not None:
+        facturas = facturas.filter(fecha_emision__lte=fecha_hasta)
+    if solo_pendientes:
+        facturas = facturas.filter(
+            Q(clasificacion__isnull=True)
+            | Q(clasificacion__confianza=Confianza.LOW)
+            | Q(clasificacion__categoria_sugerida__isnull=True)
+        )
+    return facturas
+
+
+def reclassify(
+    facturas: QuerySet[Factura],
+    batch_size: int | None = None,
+    rule_set: RuleSet | None = None,
+    on_batch: Callable[[ReclassifyStats], None] | None = None,
+) -> ReclassifyStats:
+    """Reclassifies ``facturas`` in keyset-paginated batches.
+
+    Only assignments whose outcome changed are written. MANUAL assignments
+    are never touched, whatever ``facturas`` contains.
+    """
+    batch_size = batch_size or settings.RECLASSIFY_BATCH_SIZE
+    memo = ProveedorMemo(rule_set or get_rule_set())
+    stats = ReclassifyStats()
+    started = time.monotonic()
+    facturas = facturas.select_related("proveedor", "clasificacion").order_by("id")
+    last_id = 0
+    while True:
+        batch = list(facturas.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        _reclassify_batch(batch, memo, stats)
+        stats.elapsed = time.monotonic() - started
+        if on_batch is not None:
+            on_batch(stats)
+    stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def _reclassify_batch(
+    batch: list[Factura],
+    memo: ProveedorMemo,
+    stats: ReclassifyStats,
+) -> None:
+    now = timezone.now()
+    memo.prime(batch)
+    por_actualizar: list[AsignacionClasificacionFactura] = []
+    por_crear: list[AsignacionClasificacionFactura] = []
+    for factura in batch:
+        categoria, confianza, razones = memo.classify(factura)
+        categoria_id = categoria.id if categoria else None
+        try:
+            asignacion = factura.clasificacion
+        except AsignacionClasificacionFactura.DoesNotExist:
+            por_crear.append(
+                AsignacionClasificacionFactura(
+                    factura=factura,
+                    categoria_sugerida_id=categoria_id,
+                    confianza=confianza,
+                    razones=razones,
+                )
+            )
+            continue
+        if asignacion.metodo == AsignacionClasificacionFactura.Metodo.MANUAL:
+            continue
+        if (
+            asignacion.categoria_sugerida_id == categoria_id
+            and asignacion.confianza == confianza
+            and asignacion.razones == razones
+        ):
+            continue
+        asignacion.categoria_sugerida_id = categoria_id
+        asignacion.confianza = confianza
+        asignacion.razones = razones
+        asignacion.updated_at = now
+        por_actualizar.append(asignacion)
+
+    if por_actualizar or por_crear:
+        _save_batch(por_actualizar, por_crear)
+    memo.save()
+    stats.scanned += len(batch)
+    stats.updated += len(por_actualizar)
+    stats.created += len(por_crear)
+
+
+def _save_batch(
+    por_actualizar: list[AsignacionClasificacionFactura],
+    por_crear: list[AsignacionClasificacionFactura],
+) -> None:
+    with transaction.atomic():
+        if por_actualizar:
+            AsignacionClasificacionFactura.objects.bulk_update(
+                por_actualizar, ASIGNACION_UPDATE_FIELDS
+            )
+        if por_crear:
+            AsignacionClasificacionFactura.objects.bulk_create(
+                por_crear, ignore_conflicts=True
+            )
+        # bulk writes skip the signals that invalidate stored plans.
+        invalidate_plan_snapshots(
+            [asignacion.factura_id for asignacion in por_actualizar + por_crear]
+        )
@@ -0,0 +1,86 @@
+"""Versioned, cross-process cache of the compiled classification RuleSet."""
+from __future__ import annotations
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from ingesta.models import ReglasVersion
+from ingesta.services.classification import RuleSet
+
+RULES_VERSION_ID = 1
+RULE_SET_KEY = "ingesta:rules:set:{version}"
+
+_local_lock = threading.Lock()
+_local: tuple[int, RuleSet] | None = None
+
+
+def get_rules_version() -> int:
+    """The current rules version, read from the database.
+
+    The cache may be local to each process, so it cannot carry the version
+    from the process that edited the rules to the workers.
+    """
+    version = (
+        ReglasVersion.objects.filter(id=RULES_VERSION_ID)
+        .values_list("version", flat=True)
+        .first()
+    )
+    if version is None:
+        # A time-based seed keeps versions unique across database resets, so
+        # entries left in a shared cache are never taken for current ones.
+        row, _created = ReglasVersion.objects.get_or_create(
+            id=RULES_VERSION_ID, defaults={"version": time.time_ns()}
+        )
+        version = row.version
+    return version
+
+
+def bump_rules_version() -> None:
+    updated = ReglasVersion.objects.filter(id=RULES_VERSION_ID).update(
+        version=F("version") + 1
+    )
+    if not updated:
+        get_rules_version()
+
+
+def invalidate_rules() -> None:
+    """Bumps the version in the caller's transaction.
+
+    Other processes see the new version exactly when the rule change they
+    must recompile for is committed.
+    """
+    bump_rules_version()
+
+
+def get_rule_set() -> RuleSet:
+    """Returns the compiled rules for the current version.
+
+    Costs one primary-key read while the local copy is current, plus one
+    cache read on a shared cache hit, and only reads the rules table when
+    the version is new.
+    """
+    global _local
+    version = get_rules_version()
+    local = _local
+    if local is not None and local[0] == version:
+        return local[1]
+    with _local_lock:
+        if _local is not None and _local[0] == version:
+            return _local[1]
+        key = RULE_SET_KEY.format(version=version)
+        rule_set = cache.get(key)
+        if rule_set is None:
+            rule_set = RuleSet.load()
+            rule_set.version = version
+            cache.set(key, rule_set, timeout=settings.RULES_CACHE_TIMEOUT)
+        _local = (version, rule_set)
+    return rule_set
+
+
+def reset_local_rule_set() -> None:
+    global _local
+    _local = None
@@ -1,26 +1,61 @@
+"""boto3 client, bucket bootstrap and ranged reads for the S3 storage backend."""
+
 from __future__ import annotations
 
+import io
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
 import boto3
 from botocore.config import Config
 from botocore.exceptions import ClientError
 from django.conf import settings
 
+_client = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+_ensured_buckets: set[str] = set()
+
 
 def get_client():
-    endpoint_url = settings.S3_ENDPOINT_URL or None
-    return boto3.client(
-        "s3",
-        endpoint_url=endpoint_url,
-        aws_access_key_id=settings.S3_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
-        use_ssl=settings.S3_USE_SSL,
-        config=Config(s3={"addressing_style": "path"}),
-    )
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            endpoint_url = settings.S3_ENDPOINT_URL or None
+            _client = boto3.session.Session().client(
+                "s3",
+                endpoint_url=endpoint_url,
+                aws_access_key_id=settings.S3_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+                use_ssl=settings.S3_USE_SSL,
+                config=Config(
+                    s3={"addressing_style": "path"},
+                    max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    retries={"max_attempts": 5, "mode": "standard"},
+                ),
+            )
+            _client_pid = pid
+    return _client
+
+
+def reset_client() -> None:
+    global _client, _client_pid
+    with _client_lock:
+        _client = None
+        _client_pid = None
+        _ensured_buckets.clear()
 
 
 def ensure_bucket() -> None:
-    client = get_client()
     bucket = settings.S3_BUCKET_NAME
+    if bucket in _ensured_buckets:
+        return
+    client = get_client()
     try:
         client.head_bucket(Bucket=bucket)
     except ClientError as exc:
@@ -29,31 +64,127 @@ def ensure_bucket() -> None:
             client.create_bucket(Bucket=bucket)
         else:
             raise
+    _ensured_buckets.add(bucket)
 
 
-def upload_xml(xml_bytes: bytes, key: str) -> str:
-    client = get_client()
-    client.put_object(
-        Bucket=settings.S3_BUCKET_NAME,
-        Key=key,
-        Body=xml_bytes,
-        ContentType="application/xml",
-    )
-    return key
+class XmlUploader:
+    """Runs ``upload`` for each XML on a thread pool, bounding the bytes held in flight.
 
+    ``submit`` blocks while the pending uploads exceed ``max_inflight_bytes``;
+    ``wait`` blocks until every submitted upload landed and re-raises the
+    first failure.
+    """
 
-def upload_zip(fileobj, key: str) -> str:
-    client = get_client()
-    client.upload_fileobj(
-        fileobj,
-        settings.S3_BUCKET_NAME,
-        key,
-        ExtraArgs={"ContentType": "application/zip"},
-    )
-    return key
+    def __init__(
+        self,
+        upload: Callable[[bytes, str], str],
+        workers: int | None = None,
+        max_inflight_bytes: int | None = None,
+    ):
+        self.upload = upload
+        self.max_inflight_bytes = (
+            max_inflight_bytes or settings.S3_UPLOAD_MAX_INFLIGHT_BYTES
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or settings.S3_UPLOAD_WORKERS,
+            thread_name_prefix="xml-upload",
+        )
+        self._condition = threading.Condition()
+        self._inflight = 0
+        self._futures: list[Future] = []
+
+    def submit(self, xml_bytes: bytes, key: str) -> str:
+        size = len(xml_bytes)
+        with self._condition:
+            while self._inflight and self._inflight + size > self.max_inflight_bytes:
+                self._condition.wait()
+            self._inflight += size
+        self._futures.append(self._executor.submit(self._upload, xml_bytes, key, size))
+        return key
+
+    def _upload(self, xml_bytes: bytes, key: str, size: int) -> str:
+        try:
+            return self.upload(xml_bytes, key)
+        finally:
+            with self._condition:
+                self._inflight -= size
+                self._condition.notify_all()
+
+    def wait(self) -> None:
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> XmlUploader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
 
 def download_bytes(key: str) -> bytes:
     client = get_client()
     response = client.get_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
     return response["Body"].read()
+
+
+class S3RangeFile(io.RawIOBase):
+    """Read-only, seekable view of an S3 object backed by ranged GET requests."""
+
+    def __init__(self, key: str, client=None):
+        super().__init__()
+        self._client = client or get_client()
+        self._key = key
+        self._pos = 0
+        response = self._client.head_object(Bucket=settings.S3_BUCKET_NAME, Key=key)
+        self._size = response["ContentLength"]
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        if position < 0:
+            raise ValueError("Posición negativa")
+        self._pos = position
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size:
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        response = self._client.get_object(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=self._key,
+            Range=f"bytes={self._pos}-{end}",
+        )
+        data = response["Body"].read()
+        count = len(data)
+        buffer[:count] = data
+        self._pos += count
+        return count
+
+
+def open_stream(key: str):
+    raw = S3RangeFile(key)
+    return io.BufferedReader(raw, buffer_size=settings.S3_STREAM_BUFFER_SIZE)
@@ -0,0 +1,325 @@
+"""Object storage behind a setting: S3 (boto3), in-memory or local filesystem.
+
+``STORAGE_BACKEND`` picks the implementation ("s3", "memory" or "local");
+``get_storage`` builds it once per process. The module-level helpers at the
+bottom are what the import pipeline, the upload view and ``ensure_buckets``
+call.
+"""
+
+from __future__ import annotations
+
+import io
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+from typing import BinaryIO
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+from ingesta.services import s3_client
+
+
+class Storage(ABC):
+    """Keyed blob storage. Ranges are half-open: ``[start, end)``.
+
+    Backends implement the abstract methods; the rest have defaults built on
+    them that backends override when they can do better.
+    """
+
+    def ensure_ready(self) -> None:  # noqa: B027
+        """Creates the bucket or directory; optional, nothing to do by default."""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes, content_type: str = "") -> str:
+        ...
+
+    def put_fileobj(self, fileobj: BinaryIO, key: str, content_type: str = "") -> str:
+        return self.put(key, fileobj.read(), content_type)
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        ...
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        return self.get(key)[start:end]
+
+    def size(self, key: str) -> int:
+        return len(self.get(key))
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def list(self, prefix: str = "") -> Iterator[str]:
+        ...
+
+    def open(self, key: str) -> BinaryIO:
+        """Seekable binary reader over ``key``; close it when done."""
+        return io.BytesIO(self.get(key))
+
+
+class S3Storage(Storage):
+    def ensure_ready(self) -> None:
+        s3_client.ensure_bucket()
+
+    def put(self, key: str, data: bytes, content_type: str = "") -> str:
+        client = s3_client.get_client()
+        client.put_object(
+            Bucket=settings.S3_BUCKET_NAME,
+            Key=key,
+            Body=data,
+            ContentType=content_type or "application/octet-stream",
+        )
+        return key
+
+    def put_fileobj(self, fileobj: BinaryIO, key: str, content_type: str = "") -> str:
+        client = s3_client.get_client()
+        client.upload_fileobj(
+            fileobj,
+            settings.S3_BUCKET_NAME,
+            key,
+            ExtraArgs={"ContentType": content_type or "application/octet-stream"},
+        )
+        return key
+
+    def get(self, key: str) -> bytes:
+        return s3_client.download_bytes(key)
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        if end <= start:
+            return b""
+        response = s3_client.get_client().get_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=key, Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+
+    def size(self, key: str) -> int:
+        response = s3_client.get_client().head_object(
+            Bucket=settings.S3_BUCKET_NAME, Key=key
+        )
+        return response["ContentLength"]
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.size(key)
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in {"404", "NoSuchKey"}:
+                return False
+            raise
+        return True
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        paginator = s3_client.get_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=settings.S3_BUCKET_NAME, Prefix=prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"]
+
+    def open(self, key: str) -> BinaryIO:
+        return s3_client.open_stream(key)
+
+
+class MemoryStorage(Storage):
+    """Process-local dict of blobs, for tests and benchmarks."""
+
+    def __init__(self) -> None:
+        self._blobs: dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put(self, key: str, data: bytes, content_type: str = "") -> str:
+        with self._lock:
+            self._blobs[key] = bytes(data)
+        return key
+
+    def get(self, key: str) -> bytes:
+        try:
+            return self._blobs[key]
+        except KeyError:
+            raise FileNotFoundError(key) from None
+
+    def exists(self, key: str) -> bool:
+        return key in self._blobs
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        with self._lock:
+            keys = sorted(key for key in self._blobs if key.startswith(prefix))
+        return iter(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blobs.clear()
+
+
+class _MmapReader(io.RawIOBase):
+    """Seekable raw reader that copies straight from a read-only mapping."""
+
+    def __init__(self, path: Path):
+        super().__init__()
+        with open(path, "rb") as fileobj:
+            self._size = os.fstat(fileobj.fileno()).st_size
+            self._map = (
+                mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+                if self._size
+                else None
+            )
+        self._view = memoryview(self._map) if self._map is not None else b""
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"whence inválido: {whence}")
+        if position < 0:
+            raise ValueError("Posición negativa")
+        self._pos = position
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        count = max(0, min(len(buffer), self._size - self._pos))
+        buffer[:count] = self._view[self._pos : self._pos + count]
+        self._pos += count
+        return count
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._view.release()
+            self._map.close()
+            self._map = None
+        super().close()
+
+
+class LocalStorage(Storage):
+    """Files under ``root``; reads are served from ``mmap``."""
+
+    def __init__(self, root: str | os.PathLike):
+        self.root = Path(root).resolve()
+
+    def _path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Clave fuera del almacenamiento: {key}")
+        return path
+
+    def ensure_ready(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, key: str, data: bytes, content_type: str = "") -> str:
+        return self._write(key, lambda fileobj: fileobj.write(data))
+
+    def put_fileobj(self, fileobj: BinaryIO, key: str, content_type: str = "") -> str:
+        return self._write(key, lambda target: shutil.copyfileobj(fileobj, target))
+
+    def _write(self, key: str, write) -> str:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as target:
+                write(target)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return key
+
+    def get(self, key: str) -> bytes:
+        return self._path(key).read_bytes()
+
+    def get_range(self, key: str, start: int, end: int) -> bytes:
+        with self.open(key) as reader:
+            reader.seek(start)
+            return reader.read(max(0, end - start))
+
+    def size(self, key: str) -> int:
+        return self._path(key).stat().st_size
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).is_file()
+
+    def list(self, prefix: str = "") -> Iterator[str]:
+        if not self.root.exists():
+            return iter(())
+        keys = (
+            path.relative_to(self.root).as_posix()
+            for path in self.root.rglob("*")
+            if path.is_file() and not path.name.startswith(".tmp-")
+        )
+        return iter(sorted(key for key in keys if key.startswith(prefix)))
+
+    def open(self, key: str) -> BinaryIO:
+        return _MmapReader(self._path(key))
+
+
+_storage: Storage | None = None
+_storage_config: tuple[str, str] | None = None
+_storage_lock = threading.Lock()
+
+
+def _build_storage(backend: str, local_root: str) -> Storage:
+    if backend == "s3":
+        return S3Storage()
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "local":
+        return LocalStorage(local_root)
+    raise ValueError(f"STORAGE_BACKEND desconocido: {backend}")
+
+
+def get_storage() -> Storage:
+    """The configured backend, rebuilt only when the settings change."""
+    global _storage, _storage_config
+    config = (settings.STORAGE_BACKEND, str(settings.STORAGE_LOCAL_ROOT))
+    if _storage is not None and _storage_config == config:
+        return _storage
+    with _storage_lock:
+        if _storage is None or _storage_config != config:
+            _storage = _build_storage(*config)
+            _storage_config = config
+    return _storage
+
+
+def reset_storage() -> None:
+    global _storage, _storage_config
+    with _storage_lock:
+        _storage = None
+        _storage_config = None
+
+
+def ensure_bucket() -> None:
+    get_storage().ensure_ready()
+
+
+def upload_xml(xml_bytes: bytes, key: str) -> str:
+    return get_storage().put(key, xml_bytes, "application/xml")
+
+
+def upload_zip(fileobj: BinaryIO, key: str) -> str:
+    return get_storage().put_fileobj(fileobj, key, "application/zip")
+
+
+def download_bytes(key: str) -> bytes:
+    return get_storage().get(key)
+
+
+def open_stream(key: str) -> BinaryIO:
+    return get_storage().open(key)
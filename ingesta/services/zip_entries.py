@@ -0,0 +1,69 @@
+"""ZIP central-directory helpers for reading single entries by byte range."""
+from __future__ import annotations
+
+import bz2
+import struct
+import zipfile
+import zlib
+
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+_FLAG_ENCRYPTED = 0x1
+
+
+def list_xml_entries(zf: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    return [
+        info
+        for info in zf.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(".xml")
+    ]
+
+
+def describe_entry(info: zipfile.ZipInfo) -> dict:
+    return {
+        "filename": info.filename,
+        "header_offset": info.header_offset,
+        "compress_size": info.compress_size,
+        "file_size": info.file_size,
+        "compress_type": info.compress_type,
+        "crc": info.CRC,
+        "flag_bits": info.flag_bits,
+    }
+
+
+def read_entry(fileobj, entry: dict) -> bytes:
+    if entry["flag_bits"] & _FLAG_ENCRYPTED:
+        raise zipfile.BadZipFile("Entrada cifrada no soportada")
+    fileobj.seek(entry["header_offset"])
+    header = fileobj.read(_LOCAL_HEADER.size)
+    if len(header) != _LOCAL_HEADER.size:
+        raise zipfile.BadZipFile("Cabecera local truncada")
+    fields = _LOCAL_HEADER.unpack(header)
+    if fields[0] != _LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipFile("Firma de cabecera local inválida")
+    fileobj.seek(fields[10] + fields[11], 1)
+    data = fileobj.read(entry["compress_size"])
+    if len(data) != entry["compress_size"]:
+        raise zipfile.BadZipFile("Entrada truncada")
+
+    compress_type = entry["compress_type"]
+    if compress_type == zipfile.ZIP_DEFLATED:
+        data = _decompress(zlib.decompressobj(-15), data, entry["file_size"])
+    elif compress_type == zipfile.ZIP_BZIP2:
+        data = _decompress(bz2.BZ2Decompressor(), data, entry["file_size"])
+    elif compress_type != zipfile.ZIP_STORED:
+        raise zipfile.BadZipFile(f"Compresión no soportada: {compress_type}")
+    if len(data) != entry["file_size"]:
+        raise zipfile.BadZipFile("Tamaño descomprimido inválido")
+    if zlib.crc32(data) != entry["crc"]:
+        raise zipfile.BadZipFile("CRC inválido")
+    return data
+
+
+def _decompress(decompressor, data: bytes, file_size: int) -> bytes:
+    """Decompress at most one byte past ``file_size``, so an entry whose
+    header understates its size is rejected without inflating all of it."""
+    output = decompressor.decompress(data, file_size + 1)
+    if len(output) > file_size or not decompressor.eof:
+        raise zipfile.BadZipFile("Tamaño descomprimido inválido")
+    return output
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ingesta.models import AsignacionClasificacionFactura, Categoria, ReglaClasificacion
+from ingesta.services.plan import invalidate_plan_snapshots
+from ingesta.services.rule_cache import invalidate_rules
+
+
+@receiver(post_save, sender=ReglaClasificacion)
+@receiver(post_delete, sender=ReglaClasificacion)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidate_rules_on_change(sender, **kwargs) -> None:
+    invalidate_rules()
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidate_plans_on_categoria_change(sender, **kwargs) -> None:
+    # Plans carry categoria_nombre; renames are rare enough to drop them all.
+    invalidate_plan_snapshots()
+
+
+@receiver(post_save, sender=AsignacionClasificacionFactura)
+@receiver(post_delete, sender=AsignacionClasificacionFactura)
+def invalidate_plans_on_asignacion_change(sender, instance, **kwargs) -> None:
+    invalidate_plan_snapshots([instance.factura_id])
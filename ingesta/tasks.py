@@ -3,24 +3,427 @@ from __future__ import annotations
 import hashlib
 import logging
 import zipfile
-from io import BytesIO
+from collections import Counter
+from collections.abc import Callable
+from datetime import date, timedelta
+from functools import partial
 
-from celery import shared_task
-from django.db import transaction
+from celery import chord, shared_task
+from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
 
-from ingesta.models import ArchivoFactura, Factura, Importacion, Proveedor
-from ingesta.services.classification import (
-    classify_factura,
-    upsert_asignacion_factura,
+from ingesta.models import (
+    ArchivoFactura,
+    Importacion,
+    ImportacionArchivo,
+    PlanSnapshot,
+)
+from ingesta.services.bulk import FacturaBatchWriter
+from ingesta.services.classification import classify_importacion
+from ingesta.services.export_jobs import run_export
+from ingesta.services.parse_pool import ParsePool
+from ingesta.services.plan import refresh_plan_snapshot
+from ingesta.services.progress import ProgressReporter
+from ingesta.services.reclassify import reclassify, reclassify_queryset
+from ingesta.services.rule_cache import get_rule_set
+from ingesta.services.s3_client import XmlUploader
+from ingesta.services.storage import ensure_bucket, open_stream, upload_xml
+from ingesta.services.zip_entries import (
+    describe_entry,
+    list_xml_entries,
+    read_entry,
 )
-from ingesta.services.parser_xml import parse_xml_bytes
-from ingesta.services.s3_client import download_bytes, ensure_bucket, upload_xml
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
+def _read_entry(
+    read: Callable[[dict], bytes], entry: dict
+) -> tuple[bytes, str | None]:
+    if entry["file_size"] > settings.IMPORT_MAX_XML_BYTES:
+        return b"", "XML demasiado grande"
+    try:
+        return read(entry), None
+    except Exception as exc:
+        return b"", f"XML inválido: {exc}"
+
+
+def _process_entries(
+    importacion_id: int,
+    entries: list[dict],
+    read: Callable[[dict], bytes],
+    progress: ProgressReporter,
+    checkpoint: dict | None = None,
+    save_checkpoint: Callable[[int, FacturaBatchWriter, int], None] | None = None,
+) -> dict:
+    checkpoint = checkpoint or {}
+    counts = {"errors": checkpoint.get("error_count", 0), "layouts": Counter()}
+    try:
+        with XmlUploader(upload=upload_xml) as uploader:
+            writer = FacturaBatchWriter(
+                upload=uploader.submit,
+                wait=uploader.wait,
+            )
+            writer.total_facturas = checkpoint.get("total_facturas", 0)
+            writer.total_proveedores = checkpoint.get("total_proveedores", 0)
+            _run_entries(
+                importacion_id,
+                entries,
+                read,
+                writer,
+                counts,
+                progress,
+                start_index=checkpoint.get("next_index", 0),
+                save_checkpoint=save_checkpoint,
+            )
+    except Exception as exc:
+        logger.exception("Fallo procesando entradas del ZIP")
+        return _fatal_result(exc, counts["errors"])
+    finally:
+        progress.flush()
+        if counts["layouts"]:
+            logger.info(
+                "Importación %s: rutas de parseo %s",
+                importacion_id,
+                dict(counts["layouts"]),
+            )
+    return {
+        "total_archivos": len(entries),
+        "total_facturas": writer.total_facturas,
+        "total_proveedores": writer.total_proveedores,
+        "error_count": counts["errors"],
+    }
+
+
+def _run_entries(
+    importacion_id: int,
+    entries: list[dict],
+    read: Callable[[dict], bytes],
+    writer: FacturaBatchWriter,
+    counts: dict,
+    progress: ProgressReporter,
+    start_index: int = 0,
+    save_checkpoint: Callable[[int, FacturaBatchWriter, int], None] | None = None,
+) -> None:
+    chunk_size = settings.IMPORT_BATCH_SIZE
+    seen: dict[str, dict] = {}
+    with ParsePool(
+        workers=settings.IMPORT_PARSE_WORKERS,
+        total=len(entries) - start_index,
+        min_files=settings.IMPORT_PARSE_MIN_FILES,
+        stream_min_bytes=settings.IMPORT_STREAM_PARSE_MIN_BYTES,
+    ) as pool:
+        for start in range(start_index, len(entries), chunk_size):
+            chunk = entries[start : start + chunk_size]
+            next_index = start + len(chunk)
+            file_logs: list[dict] = []
+            _process_chunk(
+                chunk, read, pool, writer, file_logs, seen, counts["layouts"]
+            )
+            counts["errors"] += sum(len(entry["errors"]) for entry in file_logs)
+            writer.flush(
+                before_commit=partial(
+                    _commit_chunk,
+                    importacion_id,
+                    chunk,
+                    file_logs,
+                    save_checkpoint,
+                    next_index,
+                    writer,
+                    counts["errors"],
+                )
+            )
+            progress.advance(
+                len(chunk),
+                errors=sum(bool(entry["errors"]) for entry in file_logs),
+            )
+
+
+def _commit_chunk(
+    importacion_id: int,
+    chunk: list[dict],
+    file_logs: list[dict],
+    save_checkpoint: Callable[[int, FacturaBatchWriter, int], None] | None,
+    next_index: int,
+    writer: FacturaBatchWriter,
+    error_count: int,
+) -> None:
+    _save_archivos(importacion_id, chunk, file_logs)
+    if save_checkpoint is not None:
+        save_checkpoint(next_index, writer, error_count)
+
+
+def _save_archivos(
+    importacion_id: int, chunk: list[dict], file_logs: list[dict]
+) -> None:
+    ImportacionArchivo.objects.bulk_create(
+        [
+            ImportacionArchivo(
+                importacion_id=importacion_id,
+                position=source["position"],
+                filename=entry["filename"],
+                factura_id=entry.get("factura_id"),
+                s3_key_xml=entry.get("s3_key_xml") or "",
+                warnings=entry["warnings"],
+                errors=entry["errors"],
+                unchanged=entry.get("unchanged", False),
+                duplicate_of=entry.get("duplicate_of", ""),
+            )
+            for source, entry in zip(chunk, file_logs, strict=True)
+        ]
+    )
+
+
+def _process_chunk(
+    chunk: list[dict],
+    read: Callable[[dict], bytes],
+    pool: ParsePool,
+    writer: FacturaBatchWriter,
+    file_logs: list[dict],
+    seen: dict[str, dict],
+    layouts: Counter,
+) -> None:
+    blobs, read_errors = zip(
+        *(_read_entry(read, entry) for entry in chunk), strict=True
+    )
+    hashes = [
+        hashlib.sha256(blob).hexdigest() if err is None else None
+        for blob, err in zip(blobs, read_errors, strict=True)
+    ]
+    existing = {
+        row["sha256_xml"]: row
+        for row in ArchivoFactura.objects.filter(
+            sha256_xml__in={sha for sha in hashes if sha}
+        ).values("sha256_xml", "factura_id", "factura__clave_acceso", "s3_key_xml")
+    }
+    to_parse: list[int] = []
+    queued: set[str] = set()
+    for index, sha in enumerate(hashes):
+        if sha and sha not in existing and sha not in seen and sha not in queued:
+            queued.add(sha)
+            to_parse.append(index)
+    results = dict(zip(to_parse, pool.parse([blobs[i] for i in to_parse]), strict=True))
+
+    for index, entry in enumerate(chunk):
+        sha = hashes[index]
+        if read_errors[index] is not None:
+            file_logs.append(
+                {
+                    "filename": entry["filename"],
+                    "warnings": [],
+                    "errors": [read_errors[index]],
+                }
+            )
+            continue
+        if sha in existing:
+            row = existing[sha]
+            file_logs.append(
+                {
+                    "filename": entry["filename"],
+                    "warnings": [],
+                    "errors": [],
+                    "unchanged": True,
+                    "factura_id": row["factura_id"],
+                    "clave_acceso": row["factura__clave_acceso"],
+                    "s3_key_xml": row["s3_key_xml"],
+                }
+            )
+            continue
+        if sha in seen:
+            original = seen[sha]
+            log_entry = {
+                "filename": entry["filename"],
+                "warnings": list(original["warnings"]),
+                "errors": list(original["errors"]),
+                "duplicate_of": original["filename"],
+            }
+            file_logs.append(log_entry)
+            if not log_entry["errors"]:
+                writer.add_duplicate(log_entry, original)
+            continue
+
+        parsed, warnings, parse_error = results[index]
+        if parse_error is not None:
+            log_entry = {
+                "filename": entry["filename"],
+                "warnings": [],
+                "errors": [parse_error],
+            }
+            file_logs.append(log_entry)
+            seen[sha] = log_entry
+            continue
+
+        layouts[parsed.layout] += 1
+        file_errors: list[str] = []
+        if not parsed.ruc:
+            file_errors.append("Falta RUC")
+        if not parsed.clave_acceso:
+            file_errors.append("Falta clave de acceso")
+
+        log_entry = {
+            "filename": entry["filename"],
+            "warnings": warnings,
+            "errors": file_errors,
+        }
+        file_logs.append(log_entry)
+        seen[sha] = log_entry
+        if not file_errors:
+            writer.add(parsed, blobs[index], log_entry, sha256=sha)
+
+
+FINISH_FIELDS = [
+    "status",
+    "finished_at",
+    "total_archivos",
+    "total_facturas",
+    "total_proveedores",
+    "error_count",
+    "error_summary",
+    "log_json",
+    "progress_stage",
+]
+
+
+def _finish_import(importacion: Importacion, results: list[dict]) -> None:
+    error_count = sum(result["error_count"] for result in results)
+    fatal = next((r["fatal"] for r in results if r.get("fatal")), None)
+    progress = ProgressReporter(importacion.id)
+    if not fatal:
+        progress.stage("classifying")
+        try:
+            classify_importacion(
+                importacion.id,
+                rule_set=get_rule_set(),
+                heartbeat=progress.heartbeat,
+            )
+        except Exception as exc:
+            logger.exception("Fallo clasificando importacion %s", importacion.id)
+            fatal = f"Clasificación fallida: {exc}"
+    importacion.finished_at = timezone.now()
+    if fatal:
+        importacion.status = Importacion.Status.FAILED
+        importacion.error_count = error_count + 1
+        importacion.error_summary = fatal
+        importacion.log_json = {"fatal": fatal}
+        importacion.progress_stage = "failed"
+        # checkpoint_json queda intacto para poder reanudar.
+        importacion.save(update_fields=FINISH_FIELDS)
+        # A plan built while the import was running must not outlive it.
+        PlanSnapshot.objects.filter(importacion=importacion).delete()
+        return
+
+    progress.stage("plan")
+    _publish_plan(importacion)
+    importacion.status = Importacion.Status.DONE
+    importacion.total_archivos = sum(result["total_archivos"] for result in results)
+    importacion.total_facturas = sum(result["total_facturas"] for result in results)
+    importacion.total_proveedores = sum(
+        result["total_proveedores"] for result in results
+    )
+    importacion.error_count = error_count
+    importacion.error_summary = "; ".join(
+        errors[0]
+        for errors in importacion.archivos.exclude(errors=[])
+        .order_by("position")
+        .values_list("errors", flat=True)
+    )
+    importacion.log_json = None
+    importacion.progress_stage = "done"
+    importacion.checkpoint_json = None
+    importacion.save(update_fields=[*FINISH_FIELDS, "checkpoint_json"])
+
+
+def _publish_plan(importacion: Importacion) -> None:
+    """Store the finished import's plan.
+
+    Plans of other imports were already dropped by classification for the
+    facturas whose assignment changed. A failure here leaves the plan to be
+    built on its first request.
+    """
+    try:
+        refresh_plan_snapshot(importacion)
+    except Exception:
+        logger.exception("Fallo guardando el plan de importacion %s", importacion.id)
+
+
+def _fatal_result(exc: Exception | str, error_count: int = 0) -> dict:
+    return {
+        "total_archivos": 0,
+        "total_facturas": 0,
+        "total_proveedores": 0,
+        "error_count": error_count,
+        "fatal": str(exc),
+    }
+
+
+def _save_checkpoint(
+    importacion_id: int,
+    attempts: int,
+    next_index: int,
+    writer: FacturaBatchWriter,
+    error_count: int,
+) -> None:
+    Importacion.objects.filter(id=importacion_id).update(
+        checkpoint_json={
+            "attempts": attempts,
+            "next_index": next_index,
+            "total_facturas": writer.total_facturas,
+            "total_proveedores": writer.total_proveedores,
+            "error_count": error_count,
+        }
+    )
+
+
+def _save_shard_checkpoint(
+    importacion_id: int,
+    shard_key: str,
+    next_index: int,
+    writer: FacturaBatchWriter,
+    error_count: int,
+) -> None:
+    # Runs inside the chunk's transaction; the row lock keeps concurrent
+    # shards from overwriting each other's entry.
+    checkpoint = (
+        Importacion.objects.select_for_update()
+        .values_list("checkpoint_json", flat=True)
+        .get(id=importacion_id)
+    ) or {}
+    checkpoint.setdefault("shards", {})[shard_key] = {
+        "next_index": next_index,
+        "total_facturas": writer.total_facturas,
+        "total_proveedores": writer.total_proveedores,
+        "error_count": error_count,
+    }
+    Importacion.objects.filter(id=importacion_id).update(checkpoint_json=checkpoint)
+
+
+def _shard_key(entries: list[dict]) -> str:
+    return str(entries[0]["position"])
+
+
+def _shard_entries(entries: list[dict], shard_size: int) -> list[list[dict]]:
+    """Cut entries into shards of about ``shard_size``, keeping copies together.
+
+    Shards are contiguous slices, except that an entry whose (crc, size) was
+    already seen joins the shard of its first occurrence. Identical XMLs thus
+    meet in one shard, where the hash check marks the later ones as
+    ``duplicate_of`` exactly like the serial path.
+    """
+    shards: list[list[dict]] = []
+    first_shard: dict[tuple[int, int], int] = {}
+    for entry in entries:
+        key = (entry["crc"], entry["file_size"])
+        index = first_shard.get(key)
+        if index is None:
+            if not shards or len(shards[-1]) >= shard_size:
+                shards.append([])
+            index = first_shard[key] = len(shards) - 1
+        shards[index].append(entry)
+    return shards
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def process_zip_import(importacion_id: int) -> None:
     try:
         importacion = Importacion.objects.get(id=importacion_id)
@@ -28,150 +431,196 @@ def process_zip_import(importacion_id: int) -> None:
         logger.error("Importacion %s no existe", importacion_id)
         return
 
+    checkpoint = importacion.checkpoint_json or {}
+    attempts = checkpoint.get("attempts", 0) + 1
+    if attempts > settings.IMPORT_MAX_ATTEMPTS:
+        logger.error(
+            "Importacion %s abandonada tras %s intentos", importacion_id, attempts - 1
+        )
+        _finish_import(
+            importacion,
+            [_fatal_result(f"Importación abandonada tras {attempts - 1} intentos")],
+        )
+        return
     importacion.status = Importacion.Status.RUNNING
-    importacion.started_at = timezone.now()
-    importacion.save(update_fields=["status", "started_at"])
-
-    file_logs: list[dict] = []
-    total_archivos = 0
-    total_facturas = 0
-    total_proveedores = 0
-    error_count = 0
+    resuming = checkpoint.get("next_index") or checkpoint.get("shards")
+    if not resuming or not importacion.started_at:
+        importacion.started_at = timezone.now()
+    checkpoint = {**checkpoint, "attempts": attempts}
+    importacion.checkpoint_json = checkpoint
+    importacion.save(update_fields=["status", "started_at", "checkpoint_json"])
+    progress = ProgressReporter(importacion_id)
+    progress.start("listing")
 
     try:
         ensure_bucket()
-        zip_bytes = download_bytes(importacion.s3_key_zip)
-        with zipfile.ZipFile(BytesIO(zip_bytes)) as zf:
-            for info in zf.infolist():
-                if info.is_dir():
-                    continue
-                if not info.filename.lower().endswith(".xml"):
-                    continue
-
-                total_archivos += 1
-                file_errors: list[str] = []
-                try:
-                    xml_bytes = zf.read(info)
-                    parsed, warnings = parse_xml_bytes(xml_bytes)
-                except Exception as exc:
-                    error_count += 1
-                    file_errors.append(f"XML inválido: {exc}")
-                    file_logs.append(
-                        {
-                            "filename": info.filename,
-                            "warnings": [],
-                            "errors": file_errors,
-                        }
-                    )
-                    continue
-
-                if not parsed.ruc:
-                    error_count += 1
-                    file_errors.append("Falta RUC")
-                if not parsed.clave_acceso:
-                    error_count += 1
-                    file_errors.append("Falta clave de acceso")
-
-                if file_errors:
-                    file_logs.append(
-                        {
-                            "filename": info.filename,
-                            "warnings": warnings,
-                            "errors": file_errors,
-                        }
-                    )
-                    continue
-
-                with transaction.atomic():
-                    proveedor, created = Proveedor.objects.get_or_create(
-                        ruc=parsed.ruc,
-                        defaults={"razon_social": parsed.razon_social},
-                    )
-                    if created:
-                        total_proveedores += 1
-                    elif parsed.razon_social and not proveedor.razon_social:
-                        proveedor.razon_social = parsed.razon_social
-                        proveedor.save(update_fields=["razon_social"])
-
-                    factura, created_factura = Factura.objects.get_or_create(
-                        clave_acceso=parsed.clave_acceso,
-                        defaults={
-                            "proveedor": proveedor,
-                            "fecha_emision": parsed.fecha_emision,
-                            "total": parsed.total,
-                            "subtotal": parsed.subtotal,
-                            "iva": parsed.iva,
-                            "moneda": parsed.moneda or "USD",
-                        },
-                    )
-                    if created_factura:
-                        total_facturas += 1
-                    else:
-                        updated = False
-                        if factura.proveedor_id != proveedor.id:
-                            factura.proveedor = proveedor
-                            updated = True
-                        if parsed.fecha_emision and factura.fecha_emision != parsed.fecha_emision:
-                            factura.fecha_emision = parsed.fecha_emision
-                            updated = True
-                        if parsed.total is not None and factura.total != parsed.total:
-                            factura.total = parsed.total
-                            updated = True
-                        if parsed.subtotal is not None and factura.subtotal != parsed.subtotal:
-                            factura.subtotal = parsed.subtotal
-                            updated = True
-                        if parsed.iva is not None and factura.iva != parsed.iva:
-                            factura.iva = parsed.iva
-                            updated = True
-                        if parsed.moneda and factura.moneda != parsed.moneda:
-                            factura.moneda = parsed.moneda
-                            updated = True
-                        if updated:
-                            factura.save()
-
-                    xml_key = f"{parsed.ruc}/{parsed.clave_acceso}.xml"
-                    upload_xml(xml_bytes, xml_key)
-                    xml_sha = hashlib.sha256(xml_bytes).hexdigest()
-                    ArchivoFactura.objects.update_or_create(
-                        factura=factura,
-                        defaults={"s3_key_xml": xml_key, "sha256_xml": xml_sha},
-                    )
-                    categoria, confianza, razones = classify_factura(factura)
-                    upsert_asignacion_factura(
-                        factura,
-                        categoria,
-                        confianza,
-                        razones,
-                    )
-
-                file_logs.append(
-                    {
-                        "filename": info.filename,
-                        "warnings": warnings,
-                        "errors": [],
-                        "factura_id": factura.id,
-                        "clave_acceso": factura.clave_acceso,
-                        "s3_key_xml": xml_key,
-                    }
+        with open_stream(importacion.s3_key_zip) as stream, zipfile.ZipFile(
+            stream
+        ) as zf:
+            infos = list_xml_entries(zf)
+            entries = [
+                {**describe_entry(info), "position": position}
+                for position, info in enumerate(infos)
+            ]
+            shard_size = settings.IMPORT_SHARD_SIZE
+            if shard_size and len(entries) > shard_size:
+                _dispatch_shards(importacion, entries, shard_size, checkpoint)
+                return
+            resume_from = checkpoint.get("next_index", 0)
+            if resume_from:
+                logger.info(
+                    "Reanudando importacion %s desde la entrada %s",
+                    importacion_id,
+                    resume_from,
                 )
+            importacion.archivos.filter(position__gte=resume_from).delete()
+            progress.start(
+                "processing",
+                total=len(entries),
+                processed=resume_from,
+            )
+            infos_by_offset = {info.header_offset: info for info in infos}
+            result = _process_entries(
+                importacion_id,
+                entries,
+                lambda entry: zf.read(infos_by_offset[entry["header_offset"]]),
+                progress,
+                checkpoint=checkpoint,
+                save_checkpoint=partial(_save_checkpoint, importacion_id, attempts),
+            )
+    except Exception as exc:
+        logger.exception("Fallo importacion %s", importacion_id)
+        result = _fatal_result(exc)
+    _finish_import(importacion, [result])
+
 
-        error_summary = "; ".join(
-            entry["errors"][0] for entry in file_logs if entry["errors"]
+def _dispatch_shards(
+    importacion: Importacion,
+    entries: list[dict],
+    shard_size: int,
+    checkpoint: dict,
+) -> None:
+    """Queue one task per shard and ``finalize_zip_import`` after all of them.
+
+    Shards of an earlier attempt with the same ``shard_size`` resume from
+    their own checkpoints; otherwise the files logged so far are discarded.
+    """
+    shards = _shard_entries(entries, shard_size)
+    if checkpoint.get("shard_size") != shard_size:
+        importacion.archivos.all().delete()
+        checkpoint = {
+            "attempts": checkpoint["attempts"],
+            "shard_size": shard_size,
+            "shards": {},
+        }
+        Importacion.objects.filter(id=importacion.id).update(
+            checkpoint_json=checkpoint
+        )
+    resumed = checkpoint["shards"]
+    processed = sum(
+        resumed.get(_shard_key(shard), {}).get("next_index", 0) for shard in shards
+    )
+    if processed:
+        logger.info(
+            "Reanudando importacion %s con %s entradas ya procesadas",
+            importacion.id,
+            processed,
         )
-        importacion.status = Importacion.Status.DONE
-        importacion.finished_at = timezone.now()
-        importacion.total_archivos = total_archivos
-        importacion.total_facturas = total_facturas
-        importacion.total_proveedores = total_proveedores
-        importacion.error_count = error_count
-        importacion.error_summary = error_summary
-        importacion.log_json = {"files": file_logs}
-        importacion.save()
+    ProgressReporter(importacion.id).start(
+        "processing",
+        total=len(entries),
+        processed=processed,
+    )
+    chord(process_zip_shard.s(importacion.id, shard) for shard in shards)(
+        finalize_zip_import.s(importacion.id)
+    )
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def process_zip_shard(importacion_id: int, entries: list[dict]) -> dict:
+    """Process one shard; a redelivered shard resumes from its checkpoint."""
+    shard_key = _shard_key(entries)
+    try:
+        importacion = Importacion.objects.get(id=importacion_id)
+        shards = (importacion.checkpoint_json or {}).get("shards", {})
+        with open_stream(importacion.s3_key_zip) as stream:
+            return _process_entries(
+                importacion_id,
+                entries,
+                lambda entry: read_entry(stream, entry),
+                ProgressReporter(importacion_id),
+                checkpoint=shards.get(shard_key),
+                save_checkpoint=partial(
+                    _save_shard_checkpoint, importacion_id, shard_key
+                ),
+            )
     except Exception as exc:
-        logger.exception("Fallo importacion %s", importacion_id)
-        importacion.status = Importacion.Status.FAILED
-        importacion.finished_at = timezone.now()
-        importacion.error_count = error_count + 1
-        importacion.error_summary = str(exc)
-        importacion.log_json = {"files": file_logs, "fatal": str(exc)}
-        importacion.save()
+        logger.exception("Fallo shard de importacion %s", importacion_id)
+        return _fatal_result(exc)
+
+
+@shared_task
+def finalize_zip_import(results: list[dict], importacion_id: int) -> None:
+    try:
+        importacion = Importacion.objects.get(id=importacion_id)
+    except Importacion.DoesNotExist:
+        logger.error("Importacion %s no existe", importacion_id)
+        return
+    _finish_import(importacion, results)
+
+
+@shared_task
+def requeue_stale_imports() -> list[int]:
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.IMPORT_STALE_AFTER)
+    stale_ids = list(
+        Importacion.objects.filter(status=Importacion.Status.RUNNING)
+        .filter(
+            Q(progress_updated_at__lt=cutoff)
+            | Q(progress_updated_at__isnull=True, started_at__lt=cutoff)
+        )
+        .values_list("id", flat=True)
+    )
+    requeued: list[int] = []
+    for importacion_id in stale_ids:
+        claimed = Importacion.objects.filter(
+            id=importacion_id,
+            status=Importacion.Status.RUNNING,
+        ).update(progress_updated_at=now)
+        if claimed:
+            logger.warning("Reencolando importacion detenida %s", importacion_id)
+            process_zip_import.delay(importacion_id)
+            requeued.append(importacion_id)
+    return requeued
+
+
+@shared_task
+def reclassify_facturas(
+    importacion_id: int | None = None,
+    proveedor_id: int | None = None,
+    fecha_desde: str | None = None,
+    fecha_hasta: str | None = None,
+    solo_pendientes: bool = False,
+    batch_size: int | None = None,
+) -> dict:
+    facturas = reclassify_queryset(
+        importacion_id=importacion_id,
+        proveedor_id=proveedor_id,
+        fecha_desde=date.fromisoformat(fecha_desde) if fecha_desde else None,
+        fecha_hasta=date.fromisoformat(fecha_hasta) if fecha_hasta else None,
+        solo_pendientes=solo_pendientes,
+    )
+    stats = reclassify(facturas, batch_size=batch_size)
+    logger.info(
+        "Reclasificacion: %s facturas, %s actualizadas, %s creadas (%.0f/s)",
+        stats.scanned,
+        stats.updated,
+        stats.created,
+        stats.rate,
+    )
+    return stats.as_dict()
+
+
+@shared_task
+def export_facturas(job_id: int) -> None:
+    run_export(job_id)
@@ -6,6 +6,17 @@ urlpatterns = [
     path("", views.index, name="ingesta-index"),
     path("importaciones/", views.importacion_list, name="ingesta-list"),
     path("revisar/", views.revisar, name="ingesta-revisar"),
+    path("exportaciones/", views.exportacion_create, name="ingesta-export-create"),
+    path(
+        "exportaciones/<int:job_id>.json",
+        views.exportacion_status,
+        name="ingesta-export-status",
+    ),
+    path(
+        "exportaciones/<int:job_id>/descargar",
+        views.exportacion_download,
+        name="ingesta-export-download",
+    ),
     path(
         "importaciones/<int:importacion_id>/export.csv",
         views.importacion_export_csv,
@@ -16,6 +27,11 @@ urlpatterns = [
         views.importacion_export_plan_json,
         name="ingesta-export-plan-json",
     ),
+    path(
+        "importaciones/<int:importacion_id>/progress.json",
+        views.importacion_progress,
+        name="ingesta-progress",
+    ),
     path(
         "importaciones/<int:importacion_id>/",
         views.importacion_detail,
@@ -1,25 +1,49 @@
-import csv
 import json
+import re
 
 from django.contrib import messages
 from django.db.models import Count, F, Q, Value
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.text import compress_sequence
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 
+from agente.auth import get_valid_token, unauthorized
 from ingesta.forms import ImportacionUploadForm
 from ingesta.models import (
-    ArchivoFactura,
     AsignacionClasificacionFactura,
     Confianza,
+    ExportJob,
     Factura,
     Importacion,
 )
-from ingesta.services.s3_client import ensure_bucket, upload_zip
-from ingesta.services.plan import build_plan_payload
-from ingesta.tasks import process_zip_import
+from ingesta.services.export import export_rows, iter_csv
+from ingesta.services.export_jobs import normalize_params, request_export
+from ingesta.services.plan import (
+    count_importacion_facturas,
+    get_plan_snapshot,
+    importacion_factura_ids,
+)
+from ingesta.services.progress import stage_label
+from ingesta.services.storage import ensure_bucket, get_storage, upload_zip
+from ingesta.tasks import export_facturas, process_zip_import
+
+ACCEPTS_GZIP_RE = re.compile(r"\bgzip\b")
 
 
 @require_http_methods(["GET", "POST"])
@@ -71,35 +95,17 @@ def importacion_list(request):
 def importacion_detail(request, importacion_id: int):
     importacion = get_object_or_404(Importacion, id=importacion_id)
     agent_events = importacion.agent_events.order_by("-created_at")[:50]
-    file_logs = (importacion.log_json or {}).get("files", [])
-    factura_ids: list[int] = []
-    factura_seen: set[int] = set()
-    for entry in file_logs:
-        factura_id = entry.get("factura_id")
-        if factura_id and factura_id not in factura_seen:
-            factura_ids.append(factura_id)
-            factura_seen.add(factura_id)
-    fallback_message = ""
-    if not factura_ids:
-        s3_keys: list[str] = []
-        for entry in file_logs:
-            key = entry.get("s3_key_xml") or entry.get("s3_key")
-            if key:
-                s3_keys.append(key)
-        if s3_keys:
-            factura_ids = list(
-                ArchivoFactura.objects.filter(s3_key_xml__in=s3_keys)
-                .values_list("factura_id", flat=True)
-                .distinct()
-            )
-        if not factura_ids:
-            fallback_message = (
-                "Esta importación no contiene referencia a facturas (importación antigua). "
-                "Reimporta el ZIP para ver sugerencias."
-            )
     max_facturas = 50
-    total_facturas = len(factura_ids)
-    factura_ids = factura_ids[:max_facturas]
+    factura_ids = importacion_factura_ids(importacion, limit=max_facturas)
+    fallback_message = ""
+    total_facturas = 0
+    if factura_ids:
+        total_facturas = count_importacion_facturas(importacion)
+    else:
+        fallback_message = (
+            "Esta importación no contiene referencia a facturas (importación antigua). "
+            "Reimporta el ZIP para ver sugerencias."
+        )
     facturas = (
         Factura.objects.filter(id__in=factura_ids)
         .select_related("proveedor")
@@ -140,93 +146,178 @@ def importacion_detail(request, importacion_id: int):
         "ingesta/detail.html",
         {
             "importacion": importacion,
+            "progress_label": stage_label(importacion.progress_stage),
             "agent_events": agent_events,
             "factura_sugerencias": factura_sugerencias,
             "factura_limit": max_facturas,
             "factura_total": total_facturas,
             "fallback_message": fallback_message,
             "resumen_por_categoria": resumen_por_categoria,
+            "archivos_con_incidencias": importacion.archivos.exclude(
+                errors=[], warnings=[]
+            ).order_by("position")[:100],
         },
     )
 
 
-def importacion_export_csv(request, importacion_id: int):
-    importacion = get_object_or_404(Importacion, id=importacion_id)
-    file_logs = (importacion.log_json or {}).get("files", [])
-    factura_ids: list[int] = []
-    factura_seen: set[int] = set()
-    for entry in file_logs:
-        factura_id = entry.get("factura_id")
-        if factura_id and factura_id not in factura_seen:
-            factura_ids.append(factura_id)
-            factura_seen.add(factura_id)
-    if not factura_ids:
-        s3_keys: list[str] = []
-        for entry in file_logs:
-            key = entry.get("s3_key_xml") or entry.get("s3_key")
-            if key:
-                s3_keys.append(key)
-        if s3_keys:
-            factura_ids = list(
-                ArchivoFactura.objects.filter(s3_key_xml__in=s3_keys)
-                .values_list("factura_id", flat=True)
-                .distinct()
-            )
-    max_facturas = 50
-    factura_ids = factura_ids[:max_facturas]
-    facturas = (
-        Factura.objects.filter(id__in=factura_ids)
-        .select_related("proveedor")
-        .order_by()
+@require_http_methods(["GET"])
+def importacion_progress(request, importacion_id: int):
+    progress = (
+        Importacion.objects.filter(id=importacion_id)
+        .values(
+            "id",
+            "status",
+            "progress_stage",
+            "progress_total",
+            "progress_processed",
+            "progress_errors",
+            "progress_updated_at",
+        )
+        .first()
     )
-    facturas_by_id = {factura.id: factura for factura in facturas}
-    asignaciones = (
-        AsignacionClasificacionFactura.objects.filter(factura_id__in=factura_ids)
-        .select_related("factura__proveedor", "categoria_sugerida")
-        .order_by()
+    if progress is None:
+        raise Http404("Importación no encontrada")
+    return JsonResponse(
+        {
+            "importacion_id": progress["id"],
+            "status": progress["status"],
+            "stage": progress["progress_stage"],
+            "stage_label": stage_label(progress["progress_stage"]),
+            "total": progress["progress_total"],
+            "processed": progress["progress_processed"],
+            "errors": progress["progress_errors"],
+            "updated_at": (
+                progress["progress_updated_at"].isoformat()
+                if progress["progress_updated_at"]
+                else None
+            ),
+        }
     )
-    asignaciones_by_id = {asignacion.factura_id: asignacion for asignacion in asignaciones}
-    response = HttpResponse(content_type="text/csv; charset=utf-8")
+
+
+def importacion_export_csv(request, importacion_id: int):
+    importacion = get_object_or_404(Importacion, id=importacion_id)
+    content = iter_csv(export_rows(importacion))
+    gzipped = bool(ACCEPTS_GZIP_RE.search(request.headers.get("Accept-Encoding", "")))
+    if gzipped:
+        content = compress_sequence(content)
+    response = StreamingHttpResponse(content, content_type="text/csv; charset=utf-8")
     response["Content-Disposition"] = (
         f'attachment; filename="importacion-{importacion.id}-checklist.csv"'
     )
-    writer = csv.writer(response)
-    writer.writerow(
-        ["ruc", "razon_social", "clave_acceso", "categoria_sugerida", "confianza"]
-    )
-    for factura_id in factura_ids:
-        factura = facturas_by_id.get(factura_id)
-        if not factura:
-            continue
-        asignacion = asignaciones_by_id.get(factura_id)
-        categoria = "Sin categoría"
-        if asignacion and asignacion.categoria_sugerida:
-            categoria = asignacion.categoria_sugerida.nombre
-        confianza = "-"
-        if asignacion and asignacion.confianza:
-            confianza = asignacion.confianza
-        writer.writerow(
-            [
-                factura.proveedor.ruc,
-                factura.proveedor.razon_social or "",
-                factura.clave_acceso,
-                categoria,
-                confianza,
-            ]
-        )
+    if gzipped:
+        response["Content-Encoding"] = "gzip"
+    patch_vary_headers(response, ("Accept-Encoding",))
     return response
 
 
 def importacion_export_plan_json(request, importacion_id: int):
     importacion = get_object_or_404(Importacion, id=importacion_id)
-    payload = build_plan_payload(importacion)
+    snapshot = get_plan_snapshot(importacion)
     response = HttpResponse(
-        json.dumps(payload, ensure_ascii=False),
+        bytes(snapshot.body),
         content_type="application/json; charset=utf-8",
     )
     response["Content-Disposition"] = (
         f'attachment; filename="importacion-{importacion.id}-plan.json"'
     )
+    response["ETag"] = snapshot.etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=snapshot.etag, response=response)
+
+
+def _export_job_payload(job: ExportJob) -> dict:
+    done = job.status == ExportJob.Status.DONE
+    return {
+        "id": job.id,
+        "status": job.status,
+        "formato": job.formato,
+        "params": job.params,
+        "total": job.progress_total,
+        "processed": job.progress_processed,
+        "size_bytes": job.size_bytes,
+        "error": job.error_summary,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "status_url": reverse("ingesta-export-status", args=[job.id]),
+        "download_url": (
+            reverse("ingesta-export-download", args=[job.id]) if done else None
+        ),
+    }
+
+
+def _token_covers(token, importacion_ids) -> bool:
+    """Tokens tied to one importación may only export that importación."""
+    if not token.allowed_importacion_id:
+        return True
+    return bool(importacion_ids) and all(
+        token.allows_importacion(importacion_id) for importacion_id in importacion_ids
+    )
+
+
+def _export_job_for_token(request, job_id: int, **filters):
+    token = get_valid_token(request)
+    if not token:
+        return None, unauthorized()
+    job = get_object_or_404(ExportJob, id=job_id, **filters)
+    if not _token_covers(token, job.params.get("importacion_ids")):
+        return None, JsonResponse({"detail": "Token sin acceso"}, status=403)
+    return job, None
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def exportacion_create(request):
+    token = get_valid_token(request)
+    if not token:
+        return unauthorized()
+    try:
+        data = json.loads(request.body.decode("utf-8") or "{}")
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        data = None
+    if not isinstance(data, dict):
+        return JsonResponse({"detail": "JSON inválido"}, status=400)
+    formato = data.get("formato") or ExportJob.Formato.CSV
+    if formato not in ExportJob.Formato.values:
+        return JsonResponse({"detail": f"Formato inválido: {formato}"}, status=400)
+    try:
+        params = normalize_params(data)
+    except ValueError as exc:
+        return JsonResponse({"detail": str(exc)}, status=400)
+    if not _token_covers(token, params.get("importacion_ids")):
+        return JsonResponse({"detail": "Token sin acceso"}, status=403)
+    job, reused = request_export(
+        formato,
+        params,
+        user=token.user,
+        force=bool(data.get("force")),
+    )
+    if not reused:
+        export_facturas.delay(job.id)
+    payload = {**_export_job_payload(job), "reused": reused}
+    return JsonResponse(payload, status=200 if reused else 202)
+
+
+@require_http_methods(["GET"])
+def exportacion_status(request, job_id: int):
+    job, error = _export_job_for_token(request, job_id)
+    if error:
+        return error
+    return JsonResponse(_export_job_payload(job))
+
+
+@require_http_methods(["GET"])
+def exportacion_download(request, job_id: int):
+    job, error = _export_job_for_token(request, job_id, status=ExportJob.Status.DONE)
+    if error:
+        return error
+    response = FileResponse(
+        get_storage().open(job.s3_key),
+        as_attachment=True,
+        filename=f"exportacion-{job.id}.{job.formato}.gz",
+        content_type="application/gzip",
+    )
+    response["Content-Length"] = str(job.size_bytes)
     return response
 
 
@@ -0,0 +1,12 @@
+import os
+
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("BENCHMARK") == "1":
+        return
+    skip = pytest.mark.skip(reason="set BENCHMARK=1 to run benchmarks")
+    for item in items:
+        if item.get_closest_marker("benchmark"):
+            item.add_marker(skip)
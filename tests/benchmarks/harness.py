@@ -0,0 +1,149 @@
+"""Timing, reporting and baseline comparison for the benchmark suite.
+
+Tests marked ``benchmark`` only run with ``BENCHMARK=1``. Each round is preceded by a fixed
+calibration workload and throughput is stored in ``baseline.json`` relative
+to it, so a baseline recorded on one machine still holds on a faster or
+slower one. Set ``BENCHMARK_UPDATE=1`` to rewrite the baseline,
+``BENCHMARK_TOLERANCE`` (default 0.25) to change the allowed throughput drop
+and ``BENCHMARK_ROUNDS`` (default 5) to change how many rounds run; the
+median round of each result counts.
+"""
+
+from __future__ import annotations
+
+import gc
+import json
+import os
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from xml.etree import ElementTree
+
+import pytest
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+_CALIBRATION_XML = (
+    "<r>" + "".join(f"<e n='{i}'><v>{i}</v></e>" for i in range(200)) + "</r>"
+).encode("utf-8")
+
+
+@dataclass
+class BenchResult:
+    name: str
+    latencies: list[float] = field(default_factory=list)
+    # docs_per_sec divided by the calibration ops/s of the same round.
+    relative: float = 0.0
+
+    @property
+    def docs(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def elapsed(self) -> float:
+        return sum(self.latencies)
+
+    @property
+    def docs_per_sec(self) -> float:
+        return self.docs / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, pct: float) -> float:
+        ordered = sorted(self.latencies)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+        return ordered[index]
+
+    def summary(self) -> str:
+        return (
+            f"{self.name:<14} {self.docs:>6} docs {self.docs_per_sec:>10.0f} docs/s "
+            f"p50 {self.percentile(50) * 1000:.3f}ms "
+            f"p95 {self.percentile(95) * 1000:.3f}ms "
+            f"p99 {self.percentile(99) * 1000:.3f}ms"
+        )
+
+
+@contextmanager
+def gc_paused():
+    """Keep collector pauses from earlier documents out of the timings."""
+    gc.collect()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+def calibrate(rounds: int = 5, number: int = 100) -> float:
+    """Best-of-``rounds`` operations per second of a fixed parse-and-walk job."""
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            root = ElementTree.fromstring(_CALIBRATION_XML)
+            for elem in root.iter():
+                elem.tag.lower()
+        best = min(best, time.perf_counter() - started)
+    return number / best
+
+
+def measure(run: Callable[[], list[BenchResult]]) -> list[BenchResult]:
+    """Run ``run`` for every round and keep each result's median round."""
+    rounds: dict[str, list[BenchResult]] = {}
+    for _ in range(int(os.environ.get("BENCHMARK_ROUNDS", "5"))):
+        calibration = calibrate()
+        with gc_paused():
+            results = run()
+        for result in results:
+            result.relative = result.docs_per_sec / calibration
+            rounds.setdefault(result.name, []).append(result)
+    return [
+        sorted(runs, key=lambda result: result.relative)[len(runs) // 2]
+        for runs in rounds.values()
+    ]
+
+
+def load_baseline() -> dict:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+
+
+def check_baseline(suite: str, results: list[BenchResult]) -> list[str]:
+    """Fail if any result's relative throughput fell past the tolerance.
+
+    Returns the report lines. With ``BENCHMARK_UPDATE=1`` the suite's entry
+    in ``baseline.json`` is rewritten instead of compared.
+    """
+    tolerance = float(os.environ.get("BENCHMARK_TOLERANCE", "0.25"))
+    lines = [result.summary() for result in results]
+
+    baseline = load_baseline()
+    if os.environ.get("BENCHMARK_UPDATE") == "1":
+        baseline[suite] = {result.name: round(result.relative, 6) for result in results}
+        BASELINE_PATH.write_text(
+            json.dumps(baseline, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+        )
+        return lines
+
+    stored = baseline.get(suite, {})
+    regressions = []
+    for result in results:
+        expected = stored.get(result.name)
+        if expected is None:
+            lines.append(f"{result.name}: sin línea base")
+            continue
+        ratio = result.relative / expected
+        lines.append(f"{result.name}: {ratio:.2f}x de la línea base")
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result.name} ({ratio:.2f}x)")
+    if regressions:
+        pytest.fail(
+            "Regresión de rendimiento en "
+            + ", ".join(regressions)
+            + "\n"
+            + "\n".join(lines)
+        )
+    return lines
@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from ingesta.benchmarks.import_run import STAGES, run_import_benchmark
+from ingesta.models import AsignacionClasificacionFactura, Factura
+
+
+@pytest.mark.django_db
+def test_import_benchmark_reporta_etapas_y_consultas():
+    report = run_import_benchmark(40, proveedor_count=5)
+
+    assert report.facturas == 40
+    assert Factura.objects.count() == 40
+    assert AsignacionClasificacionFactura.objects.count() == 40
+    assert report.s3_calls["put_object"] == 40
+    assert report.queries > 0
+    assert set(STAGES) - {"upload"} <= set(report.stages)
+    assert report.stages["upload"] > 0
+    assert report.invoices_per_sec > 0
+
+
+@pytest.mark.benchmark
+@pytest.mark.django_db
+def test_import_throughput(capsys):
+    sizes = os.environ.get("BENCHMARK_IMPORT_SIZES", "1000")
+    lines = []
+    for size in (int(size) for size in sizes.split(",")):
+        lines.extend(run_import_benchmark(size, seed=size).lines())
+    with capsys.disabled():
+        print("\n" + "\n".join(lines))
@@ -0,0 +1,53 @@
+import time
+from xml.etree import ElementTree
+
+import pytest
+from django.conf import settings
+
+from benchmarks.harness import BenchResult, check_baseline, measure
+from ingesta.benchmarks.corpus import KINDS, generate_corpus
+from ingesta.services.parse_pool import parse_safe
+from ingesta.services.parser_xml import parse_xml_bytes
+
+
+def test_corpus_es_deterministico_y_parseable():
+    sizes = {kind: 2 for kind in KINDS}
+    corpus = generate_corpus(seed=7, sizes=sizes)
+
+    assert [doc.xml for doc in corpus] == [
+        doc.xml for doc in generate_corpus(seed=7, sizes=sizes)
+    ]
+    assert [doc.xml for doc in corpus] != [
+        doc.xml for doc in generate_corpus(seed=8, sizes=sizes)
+    ]
+    for doc in corpus:
+        if doc.kind == "malformed":
+            with pytest.raises(ElementTree.ParseError):
+                parse_xml_bytes(doc.xml)
+            continue
+        parsed, warnings = parse_xml_bytes(doc.xml)
+        assert parsed.ruc and parsed.clave_acceso and parsed.total, doc.name
+        assert warnings == [], doc.name
+
+
+@pytest.mark.benchmark
+def test_parser_throughput(capsys):
+    corpus = generate_corpus()
+    stream_min_bytes = settings.IMPORT_STREAM_PARSE_MIN_BYTES
+    for doc in corpus[:50]:
+        parse_safe(doc.xml, stream_min_bytes)
+
+    def run() -> list[BenchResult]:
+        results = {kind: BenchResult(kind) for kind in KINDS}
+        overall = BenchResult("total")
+        for doc in corpus:
+            started = time.perf_counter()
+            parse_safe(doc.xml, stream_min_bytes)
+            latency = time.perf_counter() - started
+            results[doc.kind].latencies.append(latency)
+            overall.latencies.append(latency)
+        return [*results.values(), overall]
+
+    lines = check_baseline("parser", measure(run))
+    with capsys.disabled():
+        print("\n" + "\n".join(lines))
@@ -0,0 +1,13 @@
+import pytest
+from django.core.cache import cache
+
+from ingesta.services.rule_cache import reset_local_rule_set
+
+
+@pytest.fixture(autouse=True)
+def _clear_rule_cache():
+    cache.clear()
+    reset_local_rule_set()
+    yield
+    cache.clear()
+    reset_local_rule_set()
@@ -4,17 +4,21 @@ from datetime import timedelta
 
 import pytest
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.utils import timezone
 
-from agente.models import AgentToken
+from agente.models import AgentEvent, AgentToken
 from ingesta.models import (
     AsignacionClasificacionFactura,
     Categoria,
     Confianza,
     Factura,
     Importacion,
+    ImportacionArchivo,
+    PlanSnapshot,
     Proveedor,
 )
+from ingesta.services.plan import build_plan_payload, plan_page
 
 
 @pytest.mark.django_db
@@ -89,8 +93,12 @@ def test_token_can_download_plan_json(client):
         categoria_sugerida=categoria,
         confianza=Confianza.HIGH,
     )
-    importacion = Importacion.objects.create(
-        log_json={"files": [{"factura_id": factura.id}]}
+    importacion = Importacion.objects.create()
+    ImportacionArchivo.objects.create(
+        importacion=importacion,
+        position=0,
+        filename="factura.xml",
+        factura=factura,
     )
 
     raw_token = "valid-token"
@@ -110,3 +118,260 @@ def test_token_can_download_plan_json(client):
     payload = json.loads(response.content.decode("utf-8"))
     assert payload["importacion_id"] == importacion.id
     assert payload["total_items"] == 1
+
+
+@pytest.mark.django_db
+def test_plan_json_etag_responde_304_hasta_que_cambia_la_asignacion(client):
+    proveedor = Proveedor.objects.create(ruc="999", razon_social="Proveedor ETag")
+    factura = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-ETAG-1")
+    salud = Categoria.objects.create(nombre="SALUD")
+    educacion = Categoria.objects.create(nombre="EDUCACION")
+    asignacion = AsignacionClasificacionFactura.objects.create(
+        factura=factura,
+        categoria_sugerida=salud,
+        confianza=Confianza.HIGH,
+    )
+    importacion = Importacion.objects.create()
+    ImportacionArchivo.objects.create(
+        importacion=importacion,
+        position=0,
+        filename="factura.xml",
+        factura=factura,
+    )
+    raw_token = "etag-token"
+    AgentToken.objects.create(
+        token_hash=hashlib.sha256(raw_token.encode("utf-8")).hexdigest(),
+        expires_at=timezone.now() + timedelta(hours=1),
+    )
+    url = f"/api/agent/importaciones/{importacion.id}/plan.json"
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {raw_token}"}
+
+    first = client.get(url, **auth)
+    etag = first["ETag"]
+    assert first.status_code == 200
+    assert PlanSnapshot.objects.filter(importacion=importacion).exists()
+
+    cached = client.get(url, HTTP_IF_NONE_MATCH=etag, **auth)
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached["ETag"] == etag
+
+    unauthorized = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert unauthorized.status_code == 401
+
+    asignacion.categoria_sugerida = educacion
+    asignacion.save()
+
+    changed = client.get(url, HTTP_IF_NONE_MATCH=etag, **auth)
+    assert changed.status_code == 200
+    assert changed["ETag"] != etag
+    payload = json.loads(changed.content.decode("utf-8"))
+    assert payload["acciones"][0]["categoria_nombre"] == "EDUCACION"
+
+
+@pytest.mark.django_db
+def test_plan_acciones_paginado_por_cursor(client, django_assert_num_queries):
+    proveedor = Proveedor.objects.create(ruc="1790012345001", razon_social="Paginado")
+    categoria = Categoria.objects.create(nombre="SALUD")
+    importacion = Importacion.objects.create()
+    facturas = []
+    for index in range(7):
+        factura = Factura.objects.create(
+            proveedor=proveedor, clave_acceso=f"CLAVE-PAGE-{index}"
+        )
+        facturas.append(factura)
+        AsignacionClasificacionFactura.objects.create(
+            factura=factura,
+            categoria_sugerida=None if index == 2 else categoria,
+            confianza=Confianza.HIGH,
+        )
+    # Posiciones 0..6 en orden, y la factura 4 repetida al final.
+    for position, factura in enumerate([*facturas, facturas[4]]):
+        ImportacionArchivo.objects.create(
+            importacion=importacion,
+            position=position,
+            filename=f"{position}.xml",
+            factura=factura,
+        )
+    raw_token = "page-token"
+    AgentToken.objects.create(
+        token_hash=hashlib.sha256(raw_token.encode("utf-8")).hexdigest(),
+        expires_at=timezone.now() + timedelta(hours=1),
+    )
+    url = f"/api/agent/importaciones/{importacion.id}/plan/acciones"
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {raw_token}"}
+
+    first = client.get(url, {"limit": 4}, **auth).json()
+    assert first["total_items"] == 6
+    assert [a["factura_id"] for a in first["acciones"]] == [
+        facturas[i].id for i in (0, 1, 3, 4)
+    ]
+
+    # Token (2), importacion (1) y una sola consulta de página; sin recontar.
+    with django_assert_num_queries(4):
+        second = client.get(url, {"limit": 4, "cursor": first["next_cursor"]}, **auth)
+    second = second.json()
+    assert second["total_items"] == 6
+    assert [a["factura_id"] for a in second["acciones"]] == [
+        facturas[5].id,
+        facturas[6].id,
+    ]
+    assert second["next_cursor"] is None
+
+    assert client.get(url, {"cursor": "no-es-un-cursor"}, **auth).status_code == 400
+    assert client.get(url, {"limit": "0"}, **auth).status_code == 400
+
+
+@pytest.mark.django_db
+def test_plan_json_next_cursor_continua_en_paginas():
+    proveedor = Proveedor.objects.create(ruc="1790012345001", razon_social="Corte")
+    categoria = Categoria.objects.create(nombre="SALUD")
+    importacion = Importacion.objects.create()
+    for index in range(5):
+        factura = Factura.objects.create(
+            proveedor=proveedor, clave_acceso=f"CLAVE-CORTE-{index}"
+        )
+        AsignacionClasificacionFactura.objects.create(
+            factura=factura, categoria_sugerida=categoria, confianza=Confianza.HIGH
+        )
+        ImportacionArchivo.objects.create(
+            importacion=importacion,
+            position=index,
+            filename=f"{index}.xml",
+            factura=factura,
+        )
+
+    plan = build_plan_payload(importacion, max_facturas=2)
+    rest = plan_page(importacion, limit=10, cursor=plan["next_cursor"])
+
+    claves = [a["clave_acceso"] for a in plan["acciones"] + rest["acciones"]]
+    assert claves == [f"CLAVE-CORTE-{index}" for index in range(5)]
+    assert build_plan_payload(importacion, max_facturas=5)["next_cursor"] is not None
+    assert build_plan_payload(importacion, max_facturas=6)["next_cursor"] is None
+
+
+@pytest.mark.django_db
+def test_events_batch_inserta_en_lote_e_ignora_reintentos(
+    client, settings, django_assert_num_queries
+):
+    settings.AGENT_EVENTS_BATCH_MAX = 600
+    importacion = Importacion.objects.create()
+    otra = Importacion.objects.create()
+    raw_token = "batch-token"
+    token = AgentToken.objects.create(
+        token_hash=hashlib.sha256(raw_token.encode("utf-8")).hexdigest(),
+        expires_at=timezone.now() + timedelta(hours=1),
+        allowed_importacion=importacion,
+    )
+    proveedor = Proveedor.objects.create(ruc="1790000000001")
+    facturas = Factura.objects.bulk_create(
+        Factura(proveedor=proveedor, clave_acceso=f"CLAVE-EV-{index}")
+        for index in range(501)
+    )
+    ImportacionArchivo.objects.bulk_create(
+        ImportacionArchivo(
+            importacion=importacion,
+            position=index,
+            filename=f"{index}.xml",
+            factura=factura,
+        )
+        for index, factura in enumerate(facturas[:500])
+    )
+    ajena = facturas[500]
+    events = [
+        {"step": "provider_start", "status": "ok", "idempotency_key": "start"},
+        *(
+            {
+                "step": "apply",
+                "status": "ok",
+                "factura_id": factura_id,
+                "ts": "2024-06-01T10:00:00+00:00",
+                "idempotency_key": f"apply-{factura_id}",
+            }
+            for factura_id in (factura.id for factura in facturas[:500])
+        ),
+        {"step": "provider_done", "status": "ok", "idempotency_key": "done"},
+    ]
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {raw_token}"}
+
+    def post(body):
+        return client.post(
+            "/api/agent/events/batch",
+            data=json.dumps(body),
+            content_type="application/json",
+            **auth,
+        )
+
+    # Token (2), importacion, facturas y claves existentes; los INSERT solo se
+    # parten por el límite de parámetros del motor (uno solo en PostgreSQL).
+    fields = [
+        field for field in AgentEvent._meta.concrete_fields if not field.primary_key
+    ]
+    inserts = -(-len(events) // connection.ops.bulk_batch_size(fields, events))
+    with django_assert_num_queries(5 + inserts):
+        response = post({"importacion_id": importacion.id, "events": events})
+    assert response.status_code == 201
+    assert response.json()["created"] == 502
+    assert AgentEvent.objects.filter(token=token).count() == 502
+
+    retry = post(
+        {
+            "importacion_id": importacion.id,
+            "events": events[-2:] + [{"step": "extra", "status": "ok"}] * 2,
+        }
+    )
+    assert retry.json() == {"ok": True, "created": 2, "duplicates": 2, "rejected": []}
+    assert AgentEvent.objects.filter(token=token).count() == 504
+
+    desconocidas = post(
+        {
+            "importacion_id": importacion.id,
+            "events": [
+                {"step": "apply", "status": "ok", "factura_id": ajena.id},
+                {"step": "apply", "status": "ok", "factura_id": facturas[0].id},
+            ],
+        }
+    )
+    assert desconocidas.status_code == 201
+    assert desconocidas.json()["created"] == 1
+    assert [item["index"] for item in desconocidas.json()["rejected"]] == [0]
+    assert not AgentEvent.objects.filter(factura_id=ajena.id).exists()
+
+    assert post({"importacion_id": otra.id, "events": events}).status_code == 403
+    invalid = post({"importacion_id": importacion.id, "events": [{"step": "x"}]})
+    assert invalid.status_code == 400
+    assert invalid.json()["detail"].startswith("Evento 0:")
+    settings.AGENT_EVENTS_BATCH_MAX = 10
+    assert post({"importacion_id": importacion.id, "events": events}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_event_individual_respeta_idempotency_key(client):
+    importacion = Importacion.objects.create()
+    raw_token = "single-token"
+    AgentToken.objects.create(
+        token_hash=hashlib.sha256(raw_token.encode("utf-8")).hexdigest(),
+        expires_at=timezone.now() + timedelta(hours=1),
+    )
+    body = json.dumps(
+        {
+            "importacion_id": importacion.id,
+            "step": "apply",
+            "status": "ok",
+            "idempotency_key": "k-1",
+        }
+    )
+
+    responses = [
+        client.post(
+            "/api/agent/events",
+            data=body,
+            content_type="application/json",
+            HTTP_AUTHORIZATION=f"Bearer {raw_token}",
+        )
+        for _ in range(2)
+    ]
+
+    assert [response.status_code for response in responses] == [201, 200]
+    assert responses[1].json()["duplicate"] is True
+    assert AgentEvent.objects.count() == 1
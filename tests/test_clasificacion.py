@@ -1,7 +1,28 @@
+import io
+
 import pytest
+from django.core.management import call_command
+from django.test import override_settings
 
-from ingesta.models import Categoria, Confianza, Factura, Proveedor, ReglaClasificacion
-from ingesta.services.classification import classify_factura
+from ingesta.models import (
+    AsignacionClasificacionFactura,
+    Categoria,
+    Confianza,
+    Factura,
+    Importacion,
+    ImportacionArchivo,
+    Proveedor,
+    ReglaClasificacion,
+)
+from ingesta.services.classification import (
+    KeywordAutomaton,
+    ProveedorMemo,
+    RuleSet,
+    classify_factura,
+    classify_importacion,
+)
+from ingesta.services.reclassify import reclassify, reclassify_queryset
+from ingesta.services.rule_cache import get_rule_set, reset_local_rule_set
 
 
 @pytest.mark.django_db
@@ -69,3 +90,308 @@ def test_precedencia_ruc_sobre_keyword():
 
     assert categoria_out == categoria_ruc
     assert confianza == Confianza.HIGH
+
+
+def test_keyword_automaton_respeta_rango_con_patrones_solapados():
+    automaton = KeywordAutomaton([("HERS", 0), ("SHE", 2), ("HE", 1), ("ABC", 3)])
+
+    assert automaton.best_match("USHERS") == 0
+    assert automaton.best_match("USHE") == 1
+    assert automaton.best_match("XABCX") == 3
+    assert automaton.best_match("NADA") is None
+
+
+@pytest.mark.django_db
+def test_rule_set_prioridad_y_sin_queries_por_factura(django_assert_num_queries):
+    farmacia = Categoria.objects.create(nombre="Salud")
+    retail = Categoria.objects.create(nombre="Retail")
+    ReglaClasificacion.objects.create(
+        prioridad=5,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="central",
+        categoria=retail,
+        confianza_base=Confianza.LOW,
+    )
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron=" farmacia ",
+        categoria=farmacia,
+        confianza_base=Confianza.MEDIUM,
+    )
+    ReglaClasificacion.objects.create(
+        prioridad=5,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="tienda",
+        categoria=farmacia,
+        confianza_base=Confianza.HIGH,
+    )
+    ReglaClasificacion.objects.create(
+        prioridad=0,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="inactiva",
+        categoria=retail,
+        activo=False,
+    )
+    proveedor = Proveedor.objects.create(
+        ruc="0999999999", razon_social="Tienda Central Farmacia Inactiva"
+    )
+    otro = Proveedor.objects.create(ruc="0888888888", razon_social="Tienda Central")
+    factura = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-004")
+    empate = Factura.objects.create(proveedor=otro, clave_acceso="CLAVE-005")
+
+    rule_set = RuleSet.load()
+    with django_assert_num_queries(0):
+        resultado = rule_set.classify(factura)
+        resultado_empate = rule_set.classify(empate)
+
+    assert resultado == (farmacia, Confianza.MEDIUM, ["Keyword 'farmacia' matched"])
+    assert resultado_empate == (retail, Confianza.LOW, ["Keyword 'central' matched"])
+    assert classify_factura(factura) == resultado
+
+
+@pytest.mark.django_db
+def test_rule_set_cache_se_invalida_con_cambios(django_assert_num_queries):
+    categoria = Categoria.objects.create(nombre="Salud")
+    proveedor = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Sol")
+    factura = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-006")
+
+    assert get_rule_set().classify(factura)[0] is None
+    # Only the version row is read while the compiled rules are current.
+    with django_assert_num_queries(1):
+        get_rule_set()
+
+    regla = ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="farmacia",
+        categoria=categoria,
+    )
+    assert get_rule_set().classify(factura)[0] == categoria
+
+    reset_local_rule_set()
+    with django_assert_num_queries(1):
+        assert get_rule_set().classify(factura)[0] == categoria
+
+    categoria.nombre = "Salud y farmacia"
+    categoria.save()
+    assert get_rule_set().classify(factura)[0].nombre == "Salud y farmacia"
+
+    regla.delete()
+    assert get_rule_set().classify(factura)[0] is None
+
+
+@pytest.mark.django_db
+def test_version_de_reglas_visible_para_workers_con_otra_cache():
+    categoria = Categoria.objects.create(nombre="Salud")
+    proveedor = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Sol")
+    factura = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-007")
+    assert get_rule_set().classify(factura)[0] is None
+
+    # The web process edits the rules with a cache the worker does not share.
+    web_cache = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "web",
+        }
+    }
+    with override_settings(CACHES=web_cache):
+        ReglaClasificacion.objects.create(
+            prioridad=1,
+            tipo=ReglaClasificacion.Tipo.KEYWORD,
+            patron="farmacia",
+            categoria=categoria,
+        )
+
+    assert get_rule_set().classify(factura)[0] == categoria
+
+
+@pytest.mark.django_db
+def test_reclassify_actualiza_por_lotes_y_respeta_manual(
+    django_assert_max_num_queries,
+):
+    salud = Categoria.objects.create(nombre="Salud")
+    otra = Categoria.objects.create(nombre="Otra")
+    proveedor = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Sol")
+    auto = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-R-1")
+    manual = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-R-2")
+    nueva = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-R-3")
+    AsignacionClasificacionFactura.objects.create(factura=auto, confianza=Confianza.LOW)
+    AsignacionClasificacionFactura.objects.create(
+        factura=manual,
+        categoria_sugerida=otra,
+        confianza=Confianza.HIGH,
+        metodo=AsignacionClasificacionFactura.Metodo.MANUAL,
+    )
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="farmacia",
+        categoria=salud,
+    )
+
+    rule_set = RuleSet.load()
+    # One plan snapshot invalidation per written batch.
+    with django_assert_max_num_queries(11):
+        stats = reclassify(
+            reclassify_queryset(solo_pendientes=True), batch_size=1, rule_set=rule_set
+        )
+
+    assert (stats.scanned, stats.updated, stats.created) == (2, 1, 1)
+    categorias = dict(
+        AsignacionClasificacionFactura.objects.values_list(
+            "factura_id", "categoria_sugerida_id"
+        )
+    )
+    assert categorias == {auto.id: salud.id, manual.id: otra.id, nueva.id: salud.id}
+
+    segunda = reclassify(reclassify_queryset(), rule_set=rule_set)
+    assert (segunda.scanned, segunda.updated, segunda.created) == (2, 0, 0)
+
+
+@pytest.mark.django_db
+def test_reclassify_command_filtra_por_proveedor():
+    salud = Categoria.objects.create(nombre="Salud")
+    uno = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Uno")
+    dos = Proveedor.objects.create(ruc="0888888888", razon_social="Farmacia Dos")
+    Factura.objects.create(proveedor=uno, clave_acceso="CLAVE-C-1")
+    Factura.objects.create(proveedor=dos, clave_acceso="CLAVE-C-2")
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="farmacia",
+        categoria=salud,
+    )
+    out = io.StringIO()
+
+    call_command("reclassify", "--proveedor", str(uno.id), stdout=out)
+
+    assert "Reclasificadas 1 facturas" in out.getvalue()
+    assert list(
+        AsignacionClasificacionFactura.objects.values_list(
+            "factura__clave_acceso", flat=True
+        )
+    ) == ["CLAVE-C-1"]
+
+
+@pytest.mark.django_db
+def test_classify_importacion_coincide_con_classify_factura(
+    django_assert_max_num_queries,
+):
+    gobierno = Categoria.objects.create(nombre="Gobierno")
+    servicios = Categoria.objects.create(nombre="Servicios")
+    salud = Categoria.objects.create(nombre="Salud")
+    for prioridad, categoria, confianza in (
+        (5, servicios, Confianza.MEDIUM),
+        (1, gobierno, Confianza.HIGH),
+    ):
+        ReglaClasificacion.objects.create(
+            prioridad=prioridad,
+            tipo=ReglaClasificacion.Tipo.RUC,
+            patron="1790012345001",
+            categoria=categoria,
+            confianza_base=confianza,
+        )
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="farmacia",
+        categoria=salud,
+    )
+    estado = Proveedor.objects.create(ruc="1790012345001", razon_social="Farmacia SRI")
+    farmacia = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Sol")
+    otro = Proveedor.objects.create(ruc="0888888888", razon_social="Ferreteria")
+    facturas = [
+        Factura.objects.create(proveedor=estado, clave_acceso="CLAVE-S-1"),
+        Factura.objects.create(proveedor=farmacia, clave_acceso="CLAVE-S-2"),
+        Factura.objects.create(proveedor=otro, clave_acceso="CLAVE-S-3"),
+    ]
+    manual = Factura.objects.create(proveedor=estado, clave_acceso="CLAVE-S-4")
+    AsignacionClasificacionFactura.objects.create(
+        factura=manual,
+        categoria_sugerida=salud,
+        metodo=AsignacionClasificacionFactura.Metodo.MANUAL,
+    )
+    importacion = Importacion.objects.create()
+    ImportacionArchivo.objects.bulk_create(
+        ImportacionArchivo(
+            importacion=importacion,
+            position=position,
+            filename=f"{factura.clave_acceso}.xml",
+            factura=factura,
+        )
+        for position, factura in enumerate([*facturas, manual, facturas[0]])
+    )
+
+    rule_set = RuleSet.load()
+    # 6 to classify, 3 to drop the stored plans of the changed facturas.
+    with django_assert_max_num_queries(9):
+        resultado = classify_importacion(importacion.id, rule_set=rule_set)
+
+    assert resultado == {"ruc": 1, "restantes": 2}
+    assert classify_importacion(importacion.id, rule_set=rule_set) == {
+        "ruc": 0,
+        "restantes": 0,
+    }
+    for factura in facturas:
+        asignacion = AsignacionClasificacionFactura.objects.get(factura=factura)
+        categoria, confianza, razones = classify_factura(factura, rule_set)
+        assert asignacion.categoria_sugerida == categoria
+        assert asignacion.confianza == confianza
+        assert asignacion.razones == razones
+        assert asignacion.metodo == AsignacionClasificacionFactura.Metodo.AUTO
+    manual.clasificacion.refresh_from_db()
+    assert manual.clasificacion.categoria_sugerida == salud
+
+
+@pytest.mark.django_db
+def test_proveedor_memo_reutiliza_resultado_y_detecta_claves(monkeypatch):
+    salud = Categoria.objects.create(nombre="Salud")
+    serie = Categoria.objects.create(nombre="Serie")
+    ReglaClasificacion.objects.create(
+        prioridad=5,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="farmacia",
+        categoria=salud,
+    )
+    proveedor = Proveedor.objects.create(ruc="0999999999", razon_social="Farmacia Sol")
+    numerica = Factura.objects.create(proveedor=proveedor, clave_acceso="0101202401")
+    texto = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-M-1")
+
+    rule_set = get_rule_set()
+    memo = ProveedorMemo(rule_set)
+    assert memo.classify(numerica) == rule_set.classify(numerica)
+    assert memo.classify(texto) == rule_set.classify(texto)
+    memo.save()
+
+    calls = []
+    original = RuleSet.classify_proveedor
+    monkeypatch.setattr(
+        RuleSet,
+        "classify_proveedor",
+        lambda self, prov: calls.append(prov.id) or original(self, prov),
+    )
+    otro_memo = ProveedorMemo(rule_set)
+    otro_memo.prime([numerica])
+    assert otro_memo.classify(numerica)[0] == salud
+    assert calls == []
+
+    proveedor.razon_social = "Sol SA"
+    proveedor.save()
+    numerica.refresh_from_db()
+    assert ProveedorMemo(rule_set).classify(numerica)[0] is None
+    assert calls == [proveedor.id]
+
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="2024",
+        categoria=serie,
+    )
+    nuevas = get_rule_set()
+    assert nuevas.version != rule_set.version
+    assert ProveedorMemo(nuevas).classify(numerica) == (
+        serie,
+        Confianza.MEDIUM,
+        ["Keyword '2024' matched"],
+    )
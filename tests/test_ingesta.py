@@ -1,27 +1,56 @@
+import gzip
+import importlib
 import io
 import json
 import re
+import threading
+import time
 import zipfile
-from datetime import timedelta
+from datetime import date, timedelta
+from decimal import Decimal
 
 import pytest
+from django.apps import apps as django_apps
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db import IntegrityError, transaction
+from django.test import Client
 from django.utils import timezone
 
+from agente.auth import hash_token
 from agente.models import AgentEvent, AgentToken
+from config.celery import app as celery_app
+from ingesta import tasks
 from ingesta.models import (
     ArchivoFactura,
     AsignacionClasificacionFactura,
     Categoria,
     Confianza,
+    ExportJob,
     Factura,
     Importacion,
+    ImportacionArchivo,
+    PlanSnapshot,
     Proveedor,
     ReglaClasificacion,
 )
-from ingesta.services.parser_xml import parse_xml_bytes
-from ingesta.tasks import process_zip_import
+from ingesta.services import bulk, parse_pool, s3_client
+from ingesta.services.bulk import FacturaBatchWriter
+from ingesta.services.classification import classify_importacion
+from ingesta.services.export_jobs import request_export, run_export
+from ingesta.services.parse_pool import ParsePool
+from ingesta.services.parser_xml import parse_xml_bytes, parse_xml_stream
+from ingesta.services.plan import get_plan_snapshot
+from ingesta.services.progress import ProgressReporter
+from ingesta.services.s3_client import S3RangeFile, XmlUploader
+from ingesta.services.storage import (
+    LocalStorage,
+    MemoryStorage,
+    Storage,
+    download_bytes,
+    reset_storage,
+)
+from ingesta.services.zip_entries import describe_entry, list_xml_entries, read_entry
+from ingesta.tasks import export_facturas, process_zip_import, requeue_stale_imports
 
 
 def _build_zip_bytes() -> bytes:
@@ -141,8 +170,123 @@ def test_parser_moneda_dolar_normaliza_usd():
     assert parsed.moneda == "USD"
 
 
-def _build_zip_with_factura(ruc: str, clave: str, razon_social: str) -> bytes:
-    xml = f"""
+def test_parser_respeta_precedencia_de_campos():
+    xml = """
+    <ns:factura xmlns:ns="http://sri.gob.ec/factura">
+      <ns:infoTributaria>
+        <ns:razonSocial>  </ns:razonSocial>
+        <ns:rucEmisor>1790012345001</ns:rucEmisor>
+        <ns:ruc>0999999999001</ns:ruc>
+        <ns:razonSocialEmisor>Emisor Namespaced</ns:razonSocialEmisor>
+        <ns:claveAcceso>CLAVE-NS-001</ns:claveAcceso>
+      </ns:infoTributaria>
+      <ns:infoFactura>
+        <ns:fechaEmision>2024-04-04</ns:fechaEmision>
+        <ns:totalConImpuestos>
+          <ns:totalImpuesto>
+            <ns:valor>1.20</ns:valor>
+          </ns:totalImpuesto>
+        </ns:totalConImpuestos>
+        <ns:iva>0.60</ns:iva>
+      </ns:infoFactura>
+    </ns:factura>
+    """.strip().encode("utf-8")
+
+    parsed, warnings = parse_xml_bytes(xml)
+
+    assert parsed.ruc == "1790012345001"
+    assert parsed.razon_social == "Emisor Namespaced"
+    assert parsed.clave_acceso == "CLAVE-NS-001"
+    assert str(parsed.fecha_emision) == "2024-04-04"
+    assert str(parsed.iva) == "0.60"
+    assert parsed.moneda == "USD"
+    assert "No se encontró razón social" not in warnings
+
+
+def test_parser_stream_equivale_a_arbol_con_muchos_detalles():
+    detalles = "".join(
+        f"<detalle><descripcion>Item {i}</descripcion>"
+        f"<impuestos><impuesto><valor>0.12</valor></impuesto></impuestos></detalle>"
+        for i in range(2000)
+    )
+    comprobante = f"""<?xml version="1.0" encoding="UTF-8"?>
+    <factura>
+      <infoTributaria>
+        <ruc>1790012345001</ruc>
+        <razonSocial>Supermercado Demo</razonSocial>
+        <claveAcceso>CLAVE-STREAM-001</claveAcceso>
+      </infoTributaria>
+      <infoFactura>
+        <fechaEmision>05/05/2024</fechaEmision>
+        <totalSinImpuestos>240.00</totalSinImpuestos>
+        <totalConImpuestos>
+          <totalImpuesto><valor>28.80</valor></totalImpuesto>
+        </totalConImpuestos>
+        <importeTotal>268.80</importeTotal>
+      </infoFactura>
+      <detalles>{detalles}</detalles>
+    </factura>"""
+    xml = (
+        f"<autorizacion><estado>AUTORIZADO</estado>"
+        f"<comprobante><![CDATA[{comprobante}]]></comprobante></autorizacion>"
+    ).encode()
+
+    streamed = parse_xml_stream(xml)
+
+    assert streamed == parse_xml_bytes(xml)
+    assert parse_xml_bytes(xml, stream_min_bytes=1) == streamed
+    parsed, warnings = streamed
+    assert parsed.clave_acceso == "CLAVE-STREAM-001"
+    assert str(parsed.iva) == "28.80"
+    assert warnings == []
+
+
+def test_parser_stream_conserva_advertencias_de_autorizacion():
+    xml = b"<autorizacion><comprobante>  </comprobante><ruc>1</ruc></autorizacion>"
+
+    assert parse_xml_stream(xml) == parse_xml_bytes(xml)
+    assert "Comprobante vacío" in parse_xml_stream(xml)[1]
+
+
+def test_parser_ruta_directa_por_version_y_fallback_generico():
+    xml = """
+    <factura id="comprobante" version="1.1.0">
+      <infoTributaria>
+        <razonSocial>Proveedor Versionado</razonSocial>
+        <ruc>1790012345001</ruc>
+        <claveAcceso>CLAVE-V110</claveAcceso>
+      </infoTributaria>
+      <infoFactura>
+        <fechaEmision>06/06/2024</fechaEmision>
+        <razonSocialComprador>Comprador</razonSocialComprador>
+        <totalSinImpuestos>10.00</totalSinImpuestos>
+        <totalConImpuestos>
+          <totalImpuesto><codigo>2</codigo><valor>1.20</valor></totalImpuesto>
+        </totalConImpuestos>
+        <importeTotal>11.20</importeTotal>
+        <moneda>DOLAR</moneda>
+        <pagos><pago><total>11.20</total></pago></pagos>
+      </infoFactura>
+    </factura>
+    """.strip()
+
+    parsed, warnings = parse_xml_bytes(xml.encode("utf-8"))
+    generic, generic_warnings = parse_xml_bytes(
+        xml.replace('version="1.1.0"', 'version="9.9.9"').encode("utf-8")
+    )
+    incomplete, _warnings = parse_xml_bytes(
+        xml.replace("<ruc>1790012345001</ruc>", "").encode("utf-8")
+    )
+
+    assert parsed.layout == "factura@1.1.0"
+    assert generic.layout == "generic"
+    assert (parsed, warnings) == (generic, generic_warnings)
+    assert incomplete.layout == "generic"
+    assert incomplete.ruc is None
+
+
+def _factura_xml(ruc: str, clave: str, razon_social: str, total: str = "11.20") -> bytes:
+    return f"""
     <factura>
       <infoTributaria>
         <ruc>{ruc}</ruc>
@@ -152,16 +296,64 @@ def _build_zip_with_factura(ruc: str, clave: str, razon_social: str) -> bytes:
       <infoFactura>
         <fechaEmision>01/01/2024</fechaEmision>
         <totalSinImpuestos>10.00</totalSinImpuestos>
-        <importeTotal>11.20</importeTotal>
+        <importeTotal>{total}</importeTotal>
       </infoFactura>
     </factura>
     """.strip().encode("utf-8")
+
+
+def _build_zip(files: dict[str, bytes]) -> bytes:
     buffer = io.BytesIO()
     with zipfile.ZipFile(buffer, "w") as zf:
-        zf.writestr("factura.xml", xml)
+        for name, content in files.items():
+            zf.writestr(name, content)
     return buffer.getvalue()
 
 
+def _importacion_con_facturas(*factura_ids: int) -> Importacion:
+    importacion = Importacion.objects.create()
+    ImportacionArchivo.objects.bulk_create(
+        ImportacionArchivo(
+            importacion=importacion,
+            position=position,
+            filename=f"{factura_id}.xml",
+            factura_id=factura_id,
+        )
+        for position, factura_id in enumerate(factura_ids)
+    )
+    return importacion
+
+
+def _file_logs(importacion: Importacion) -> list[dict]:
+    return list(importacion.archivos.order_by("position").values())
+
+
+def _build_zip_with_factura(ruc: str, clave: str, razon_social: str) -> bytes:
+    return _build_zip({"factura.xml": _factura_xml(ruc, clave, razon_social)})
+
+
+def test_parse_pool_paralelo_conserva_orden_y_errores():
+    blobs = [
+        _factura_xml("1790000000001", "CLAVE-POOL-1", "Uno"),
+        b"<factura>",
+        _factura_xml("1790000000002", "CLAVE-POOL-2", "Dos"),
+    ]
+
+    with ParsePool(workers=2, total=len(blobs), min_files=1) as pool:
+        assert pool.parallel
+        results = pool.parse(blobs)
+
+    assert [parsed.clave_acceso if parsed else None for parsed, _, _ in results] == [
+        "CLAVE-POOL-1",
+        None,
+        "CLAVE-POOL-2",
+    ]
+    assert results[1][2].startswith("XML inválido")
+    with ParsePool(workers=2, total=len(blobs), min_files=10) as pool:
+        assert not pool.parallel
+        assert pool.parse(blobs) == results
+
+
 @pytest.mark.django_db
 def test_constraints_unique():
     Proveedor.objects.create(ruc="999")
@@ -204,7 +396,7 @@ def test_importacion_crea_asignacion_clasificacion(monkeypatch):
     importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
 
     monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
-    monkeypatch.setattr("ingesta.tasks.download_bytes", lambda _key: zip_bytes)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
     monkeypatch.setattr("ingesta.tasks.upload_xml", lambda *_args, **_kwargs: None)
 
     process_zip_import(importacion.id)
@@ -213,6 +405,706 @@ def test_importacion_crea_asignacion_clasificacion(monkeypatch):
     asignacion = AsignacionClasificacionFactura.objects.select_related("categoria_sugerida").first()
     assert asignacion is not None
     assert asignacion.categoria_sugerida == categoria
+    snapshot = PlanSnapshot.objects.get(importacion=importacion)
+    plan = json.loads(bytes(snapshot.body))
+    assert plan["acciones"][0]["categoria_nombre"] == "Farmacia"
+
+
+@pytest.mark.django_db
+def test_importacion_por_lotes_mantiene_contadores_y_logs(
+    monkeypatch, settings, django_assert_max_num_queries
+):
+    settings.IMPORT_BATCH_SIZE = 2
+    proveedor = Proveedor.objects.create(ruc="1790000000001", razon_social=None)
+    Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-LOTE-1")
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "CLAVE-LOTE-1", "Proveedor Uno"),
+            "b.xml": _factura_xml("1790000000002", "CLAVE-LOTE-2", "Proveedor Dos"),
+            "roto.xml": b"<factura>",
+            "c.xml": _factura_xml("1790000000002", "CLAVE-LOTE-3", "Proveedor Dos"),
+            "d.xml": _factura_xml(
+                "1790000000002", "CLAVE-LOTE-3", "Proveedor Dos", "20.00"
+            ),
+        }
+    )
+    importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    uploads: list[str] = []
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda _xml, key: uploads.append(key))
+
+    # 56 for the import itself, 7 to store its plan snapshot. Batches with
+    # both new and known facturas insert the new ones on their own, so the
+    # created counts come from the database.
+    with django_assert_max_num_queries(63):
+        process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert importacion.status == Importacion.Status.DONE
+    assert importacion.total_archivos == 5
+    assert importacion.total_facturas == 2
+    assert importacion.total_proveedores == 1
+    assert importacion.error_count == 1
+    assert importacion.progress_stage == "done"
+    assert importacion.progress_processed == 5
+    assert importacion.progress_errors == 1
+    files = _file_logs(importacion)
+    assert [entry["filename"] for entry in files] == [
+        "a.xml",
+        "b.xml",
+        "roto.xml",
+        "c.xml",
+        "d.xml",
+    ]
+    assert files[2]["errors"][0].startswith("XML inválido")
+    assert files[3]["factura_id"] == files[4]["factura_id"]
+    assert Factura.objects.get(clave_acceso="CLAVE-LOTE-3").total == Decimal("20.00")
+    assert Proveedor.objects.get(ruc="1790000000001").razon_social == "Proveedor Uno"
+    assert ArchivoFactura.objects.count() == 3
+    assert AsignacionClasificacionFactura.objects.count() == 3
+    assert "1790000000002/CLAVE-LOTE-2.xml" in uploads
+
+
+def test_read_entry_lee_por_offset_sin_zipfile():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a.xml", _factura_xml("1790000000001", "CLAVE-ZIP-1", "Uno"))
+        zf.writestr("b.xml", _factura_xml("1790000000002", "CLAVE-ZIP-2", "Dos"))
+    with zipfile.ZipFile(buffer) as zf:
+        entries = [describe_entry(info) for info in list_xml_entries(zf)]
+        expected = [zf.read(entry["filename"]) for entry in entries]
+
+    assert [read_entry(buffer, entry) for entry in entries] == expected
+
+
+@pytest.mark.parametrize("compression", [zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2])
+def test_read_entry_rechaza_tamano_falseado_sin_descomprimir_todo(compression):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=compression) as zf:
+        zf.writestr("bomba.xml", b"\0" * 5_000_000)
+    with zipfile.ZipFile(buffer) as zf:
+        entry = describe_entry(list_xml_entries(zf)[0])
+
+    with pytest.raises(zipfile.BadZipFile, match="Tamaño descomprimido"):
+        read_entry(buffer, {**entry, "file_size": 100})
+    with pytest.raises(zipfile.BadZipFile, match="Tamaño descomprimido"):
+        read_entry(buffer, {**entry, "file_size": 6_000_000})
+
+
+@pytest.mark.django_db
+def test_importacion_por_shards_fusiona_resultados(monkeypatch, settings):
+    settings.IMPORT_SHARD_SIZE = 2
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "CLAVE-SHARD-1", "Uno"),
+            "b.xml": b"<factura>",
+            "c.xml": _factura_xml("1790000000002", "CLAVE-SHARD-2", "Dos"),
+            "d.xml": _factura_xml("1790000000002", "CLAVE-SHARD-3", "Dos"),
+            "e.xml": _factura_xml("1790000000003", "CLAVE-SHARD-4", "Tres"),
+        }
+    )
+    importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda *_args, **_kwargs: None)
+
+    process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert importacion.status == Importacion.Status.DONE
+    assert importacion.total_archivos == 5
+    assert importacion.total_facturas == 4
+    assert importacion.total_proveedores == 3
+    assert importacion.error_count == 1
+    assert [entry["filename"] for entry in _file_logs(importacion)] == [
+        "a.xml",
+        "b.xml",
+        "c.xml",
+        "d.xml",
+        "e.xml",
+    ]
+
+
+@pytest.mark.django_db
+def test_importacion_por_shards_deduplica_entre_shards(monkeypatch, settings):
+    settings.IMPORT_SHARD_SIZE = 2
+    monkeypatch.setattr(celery_app.conf, "task_always_eager", True)
+    repetida = _factura_xml("1790000000001", "CLAVE-SHARD-DUP-1", "Uno")
+    zip_bytes = _build_zip(
+        {
+            "a.xml": repetida,
+            "b.xml": _factura_xml("1790000000002", "CLAVE-SHARD-DUP-2", "Dos"),
+            "c.xml": _factura_xml("1790000000003", "CLAVE-SHARD-DUP-3", "Tres"),
+            "copia/a.xml": repetida,
+        }
+    )
+    importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    uploads: list[str] = []
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda _xml, key: uploads.append(key))
+
+    process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert importacion.status == Importacion.Status.DONE
+    assert importacion.total_archivos == 4
+    assert importacion.total_facturas == 3
+    assert uploads.count("1790000000001/CLAVE-SHARD-DUP-1.xml") == 1
+    files = _file_logs(importacion)
+    assert [entry["filename"] for entry in files] == [
+        "a.xml",
+        "b.xml",
+        "c.xml",
+        "copia/a.xml",
+    ]
+    assert files[3]["duplicate_of"] == "a.xml"
+    assert not files[3].get("unchanged")
+    assert files[3]["factura_id"] == files[0]["factura_id"]
+
+
+@pytest.mark.django_db
+def test_escritores_concurrentes_cuentan_solo_filas_creadas(monkeypatch):
+    xml = _factura_xml("1790000000001", "CLAVE-CONC-1", "Uno")
+    original_insert = bulk._insert_new
+    primero = FacturaBatchWriter(upload=lambda *_args: None)
+    segundo = FacturaBatchWriter(upload=lambda *_args: None)
+
+    def insert_tras_otro_shard(objs, unique_field):
+        # The other shard commits between this writer's read and its insert.
+        if not primero.total_proveedores:
+            monkeypatch.setattr(bulk, "_insert_new", original_insert)
+            primero.add(parse_xml_bytes(xml)[0], xml, {})
+            primero.flush()
+        return original_insert(objs, unique_field)
+
+    monkeypatch.setattr(bulk, "_insert_new", insert_tras_otro_shard)
+    log_entry: dict = {}
+    segundo.add(parse_xml_bytes(xml)[0], xml, log_entry)
+    segundo.flush()
+
+    assert (primero.total_proveedores, primero.total_facturas) == (1, 1)
+    assert (segundo.total_proveedores, segundo.total_facturas) == (0, 0)
+    assert Proveedor.objects.count() == 1
+    assert log_entry["factura_id"] == Factura.objects.get().id
+
+
+@pytest.mark.django_db
+def test_reimportacion_identica_omite_parseo_y_subida(monkeypatch):
+    repetida = _factura_xml("1790000000001", "CLAVE-DUP-1", "Uno")
+    zip_bytes = _build_zip(
+        {
+            "a.xml": repetida,
+            "copia/a.xml": repetida,
+            "b.xml": _factura_xml("1790000000002", "CLAVE-DUP-2", "Dos"),
+        }
+    )
+    uploads: list[str] = []
+    parsed_count = {"n": 0}
+    original_parse = parse_pool.parse_safe
+
+    def counting_parse(xml_bytes, **kwargs):
+        parsed_count["n"] += 1
+        return original_parse(xml_bytes, **kwargs)
+
+    monkeypatch.setattr("ingesta.services.parse_pool.parse_safe", counting_parse)
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda _xml, key: uploads.append(key))
+
+    primera = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    process_zip_import(primera.id)
+    primera.refresh_from_db()
+
+    files = _file_logs(primera)
+    assert parsed_count["n"] == 2
+    assert len(uploads) == 2
+    assert files[1]["duplicate_of"] == "a.xml"
+    assert files[1]["factura_id"] == files[0]["factura_id"]
+    assert primera.total_facturas == 2
+
+    segunda = Importacion.objects.create(s3_key_zip="imports/2/source.zip")
+    process_zip_import(segunda.id)
+    segunda.refresh_from_db()
+
+    assert parsed_count["n"] == 2
+    assert len(uploads) == 2
+    assert segunda.status == Importacion.Status.DONE
+    assert segunda.total_archivos == 3
+    assert segunda.total_facturas == 0
+    assert all(entry["unchanged"] for entry in _file_logs(segunda))
+    assert [entry["factura_id"] for entry in _file_logs(segunda)] == [
+        entry["factura_id"] for entry in files
+    ]
+
+
+@pytest.mark.django_db
+def test_reimportacion_identica_conserva_asignaciones_y_plan(monkeypatch):
+    salud = Categoria.objects.create(nombre="Salud")
+    ferreteria = Categoria.objects.create(nombre="Ferretería")
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.RUC,
+        patron="1790000000001",
+        categoria=salud,
+    )
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "CLAVE-REIMP-1", "Farmacia Uno"),
+            "b.xml": _factura_xml("1790000000002", "CLAVE-REIMP-2", "Ferreteria Dos"),
+        }
+    )
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda *_args, **_kwargs: None)
+
+    def asignaciones():
+        return list(
+            AsignacionClasificacionFactura.objects.order_by("factura_id").values(
+                "factura_id",
+                "categoria_sugerida_id",
+                "confianza",
+                "razones",
+                "metodo",
+                "updated_at",
+            )
+        )
+
+    primera = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    process_zip_import(primera.id)
+    antes = asignaciones()
+    plan_version = get_plan_snapshot(primera).version
+    # Rules that would reclassify both facturas if they were evaluated again.
+    ReglaClasificacion.objects.create(
+        prioridad=0,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="uno",
+        categoria=ferreteria,
+    )
+    ReglaClasificacion.objects.create(
+        prioridad=0,
+        tipo=ReglaClasificacion.Tipo.KEYWORD,
+        patron="ferreteria",
+        categoria=ferreteria,
+    )
+
+    segunda = Importacion.objects.create(s3_key_zip="imports/2/source.zip")
+    process_zip_import(segunda.id)
+
+    segunda.refresh_from_db()
+    assert segunda.status == Importacion.Status.DONE
+    assert all(entry["unchanged"] for entry in _file_logs(segunda))
+    assert asignaciones() == antes
+    assert get_plan_snapshot(primera).version == plan_version
+
+
+@pytest.mark.django_db
+def test_reimportacion_tras_fallo_clasifica_facturas_sin_asignacion(
+    monkeypatch, settings
+):
+    settings.IMPORT_BATCH_SIZE = 1
+    farmacia = Categoria.objects.create(nombre="Farmacia")
+    for ruc in ("1790000000001", "1790000000002"):
+        ReglaClasificacion.objects.create(
+            prioridad=1,
+            tipo=ReglaClasificacion.Tipo.RUC,
+            patron=ruc,
+            categoria=farmacia,
+        )
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "C1", "Uno"),
+            "b.xml": _factura_xml("1790000000002", "C2", "Dos"),
+        }
+    )
+    uploads: list[str] = []
+
+    def flaky_upload(_xml, key):
+        uploads.append(key)
+        if len(uploads) == 2:
+            raise RuntimeError("S3 no disponible")
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", flaky_upload)
+
+    primera = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    process_zip_import(primera.id)
+    primera.refresh_from_db()
+    assert primera.status == Importacion.Status.FAILED
+    assert Factura.objects.filter(clave_acceso="C1").exists()
+    assert not AsignacionClasificacionFactura.objects.exists()
+
+    segunda = Importacion.objects.create(s3_key_zip="imports/2/source.zip")
+    process_zip_import(segunda.id)
+    segunda.refresh_from_db()
+
+    assert segunda.status == Importacion.Status.DONE
+    assert _file_logs(segunda)[0]["unchanged"]
+    assert sorted(
+        AsignacionClasificacionFactura.objects.values_list(
+            "factura__clave_acceso", "categoria_sugerida__nombre"
+        )
+    ) == [("C1", "Farmacia"), ("C2", "Farmacia")]
+    plan = json.loads(bytes(get_plan_snapshot(segunda).body))
+    assert sorted(accion["clave_acceso"] for accion in plan["acciones"]) == [
+        "C1",
+        "C2",
+    ]
+
+
+@pytest.mark.django_db
+def test_importacion_solo_descarta_planes_con_asignaciones_cambiadas(monkeypatch):
+    salud = Categoria.objects.create(nombre="Salud")
+    archivos: dict[str, bytes] = {}
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr(
+        "ingesta.tasks.open_stream", lambda key: io.BytesIO(archivos[key])
+    )
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda *_args, **_kwargs: None)
+
+    def importar(numero: int, total: str) -> Importacion:
+        key = f"imports/{numero}/source.zip"
+        archivos[key] = _build_zip(
+            {"a.xml": _factura_xml("1790000000001", "CLAVE-PLAN-1", "Uno", total)}
+        )
+        importacion = Importacion.objects.create(s3_key_zip=key)
+        process_zip_import(importacion.id)
+        return importacion
+
+    primera = importar(1, "11.20")
+    snapshot = PlanSnapshot.objects.get(importacion=primera)
+
+    # New XML for the same factura, same classification: the plan stays.
+    importar(2, "12.00")
+    assert PlanSnapshot.objects.get(importacion=primera).updated_at == (
+        snapshot.updated_at
+    )
+
+    ReglaClasificacion.objects.create(
+        prioridad=1,
+        tipo=ReglaClasificacion.Tipo.RUC,
+        patron="1790000000001",
+        categoria=salud,
+    )
+    tercera = importar(3, "13.00")
+    assert not PlanSnapshot.objects.filter(importacion=primera).exists()
+
+    snapshot = PlanSnapshot.objects.get(importacion=tercera)
+    importar(4, "14.00")
+    assert PlanSnapshot.objects.get(importacion=tercera).updated_at == (
+        snapshot.updated_at
+    )
+
+
+@pytest.mark.django_db
+def test_importacion_fallida_descarta_su_plan(monkeypatch):
+    importacion = Importacion.objects.create(
+        s3_key_zip="imports/1/source.zip", status=Importacion.Status.RUNNING
+    )
+    get_plan_snapshot(importacion)
+
+    def falla(_key):
+        raise OSError("sin conexión")
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", falla)
+
+    process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert importacion.status == Importacion.Status.FAILED
+    assert not PlanSnapshot.objects.filter(importacion=importacion).exists()
+
+
+@pytest.mark.django_db
+def test_importacion_reanuda_desde_checkpoint(monkeypatch, settings):
+    settings.IMPORT_BATCH_SIZE = 1
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "CLAVE-CP-1", "Uno"),
+            "b.xml": _factura_xml("1790000000002", "CLAVE-CP-2", "Dos"),
+            "c.xml": _factura_xml("1790000000003", "CLAVE-CP-3", "Tres"),
+        }
+    )
+    uploads: list[str] = []
+
+    def flaky_upload(_xml, key):
+        if key.endswith("CLAVE-CP-3.xml") and len(uploads) < 3:
+            uploads.append("fallo")
+            raise RuntimeError("S3 no disponible")
+        uploads.append(key)
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", flaky_upload)
+
+    importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    process_zip_import(importacion.id)
+    importacion.refresh_from_db()
+
+    assert importacion.status == Importacion.Status.FAILED
+    assert importacion.checkpoint_json["next_index"] == 2
+    assert importacion.checkpoint_json["total_facturas"] == 2
+    assert not Factura.objects.filter(clave_acceso="CLAVE-CP-3").exists()
+
+    process_zip_import(importacion.id)
+    importacion.refresh_from_db()
+
+    assert importacion.status == Importacion.Status.DONE
+    assert importacion.checkpoint_json is None
+    assert importacion.total_facturas == 3
+    assert importacion.total_proveedores == 3
+    assert importacion.progress_processed == 3
+    assert [entry["filename"] for entry in _file_logs(importacion)] == [
+        "a.xml",
+        "b.xml",
+        "c.xml",
+    ]
+    assert uploads.count("1790000000001/CLAVE-CP-1.xml") == 1
+    assert uploads[-1] == "1790000000003/CLAVE-CP-3.xml"
+
+
+@pytest.mark.django_db
+def test_shard_reentregado_reanuda_desde_su_checkpoint(monkeypatch, settings):
+    settings.IMPORT_BATCH_SIZE = 1
+    zip_bytes = _build_zip(
+        {
+            "a.xml": _factura_xml("1790000000001", "CLAVE-RED-1", "Uno"),
+            "b.xml": _factura_xml("1790000000002", "CLAVE-RED-2", "Dos"),
+            "c.xml": _factura_xml("1790000000003", "CLAVE-RED-3", "Tres"),
+        }
+    )
+    with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+        entries = [
+            {**describe_entry(info), "position": position + 10}
+            for position, info in enumerate(list_xml_entries(zf))
+        ]
+    importacion = Importacion.objects.create(
+        s3_key_zip="imports/1/source.zip",
+        status=Importacion.Status.RUNNING,
+        checkpoint_json={"attempts": 1, "shard_size": 3, "shards": {}},
+    )
+    uploads: list[str] = []
+    killed: list[str] = []
+
+    class WorkerLost(BaseException):
+        pass
+
+    def read_until_killed(stream, entry):
+        if entry["filename"] == "c.xml" and not killed:
+            killed.append(entry["filename"])
+            raise WorkerLost()
+        return read_entry(stream, entry)
+
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda _xml, key: uploads.append(key))
+    monkeypatch.setattr("ingesta.tasks.read_entry", read_until_killed)
+
+    with pytest.raises(WorkerLost):
+        tasks.process_zip_shard(importacion.id, entries)
+    importacion.refresh_from_db()
+    assert importacion.checkpoint_json["shards"]["10"]["next_index"] == 2
+    assert importacion.archivos.count() == 2
+
+    result = tasks.process_zip_shard(importacion.id, entries)
+
+    assert tasks.process_zip_shard.acks_late
+    assert result["total_facturas"] == 3
+    assert result["total_proveedores"] == 3
+    assert [entry["position"] for entry in _file_logs(importacion)] == [10, 11, 12]
+    assert uploads == [
+        "1790000000001/CLAVE-RED-1.xml",
+        "1790000000002/CLAVE-RED-2.xml",
+        "1790000000003/CLAVE-RED-3.xml",
+    ]
+
+
+@pytest.mark.django_db
+def test_importacion_falla_tras_agotar_intentos(monkeypatch, settings):
+    settings.IMPORT_MAX_ATTEMPTS = 2
+    importacion = Importacion.objects.create(
+        s3_key_zip="imports/1/source.zip",
+        status=Importacion.Status.RUNNING,
+        checkpoint_json={"attempts": 2, "next_index": 1},
+    )
+
+    def no_deberia_abrirse(_key):
+        raise AssertionError("no se reintenta")
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", no_deberia_abrirse)
+
+    process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert importacion.status == Importacion.Status.FAILED
+    assert importacion.error_summary == "Importación abandonada tras 2 intentos"
+    assert requeue_stale_imports() == []
+
+
+@pytest.mark.django_db
+def test_requeue_stale_imports_reencola_importaciones_detenidas(monkeypatch, settings):
+    settings.IMPORT_STALE_AFTER = 60
+    stale = Importacion.objects.create(
+        s3_key_zip="imports/1/source.zip",
+        status=Importacion.Status.RUNNING,
+        progress_updated_at=timezone.now() - timedelta(minutes=5),
+    )
+    Importacion.objects.create(
+        s3_key_zip="imports/2/source.zip",
+        status=Importacion.Status.RUNNING,
+        progress_updated_at=timezone.now(),
+    )
+    queued: list[int] = []
+    monkeypatch.setattr(
+        "ingesta.tasks.process_zip_import.delay", lambda importacion_id: queued.append(importacion_id)
+    )
+
+    assert requeue_stale_imports() == [stale.id]
+    assert queued == [stale.id]
+    assert requeue_stale_imports() == []
+
+
+@pytest.mark.django_db
+def test_clasificacion_larga_mantiene_el_latido(monkeypatch, settings):
+    settings.IMPORT_STALE_AFTER = 60
+    settings.RECLASSIFY_BATCH_SIZE = 1
+    proveedor = Proveedor.objects.create(ruc="0999999999", razon_social="Ferreteria")
+    importacion = Importacion.objects.create(
+        s3_key_zip="imports/1/source.zip",
+        status=Importacion.Status.RUNNING,
+        progress_stage="classifying",
+        progress_updated_at=timezone.now() - timedelta(minutes=5),
+    )
+    ImportacionArchivo.objects.bulk_create(
+        ImportacionArchivo(
+            importacion=importacion,
+            position=position,
+            filename=f"{position}.xml",
+            factura=Factura.objects.create(
+                proveedor=proveedor, clave_acceso=f"CLAVE-LATIDO-{position}"
+            ),
+        )
+        for position in range(2)
+    )
+    queued: list[int] = []
+    monkeypatch.setattr(
+        "ingesta.tasks.process_zip_import.delay", lambda importacion_id: queued.append(importacion_id)
+    )
+
+    progress = ProgressReporter(importacion.id, interval=0)
+    classify_importacion(importacion.id, heartbeat=progress.heartbeat)
+
+    assert requeue_stale_imports() == []
+    assert queued == []
+
+
+@pytest.mark.django_db
+def test_importacion_publica_etapas_de_clasificacion_y_plan(monkeypatch):
+    zip_bytes = _build_zip_with_factura(
+        ruc="1790012345001",
+        clave="CLAVE-ETAPA-1",
+        razon_social="Farmacia Central",
+    )
+    importacion = Importacion.objects.create(s3_key_zip="imports/1/source.zip")
+    etapas: list[str] = []
+
+    def stage_at(step):
+        def record(*args, **kwargs):
+            etapas.append(
+                Importacion.objects.values_list("progress_stage", flat=True).get(
+                    id=importacion.id
+                )
+            )
+            return step(*args, **kwargs)
+
+        return record
+
+    monkeypatch.setattr("ingesta.tasks.ensure_bucket", lambda: None)
+    monkeypatch.setattr("ingesta.tasks.open_stream", lambda _key: io.BytesIO(zip_bytes))
+    monkeypatch.setattr("ingesta.tasks.upload_xml", lambda *_args, **_kwargs: None)
+    monkeypatch.setattr(
+        "ingesta.tasks.classify_importacion", stage_at(tasks.classify_importacion)
+    )
+    monkeypatch.setattr(
+        "ingesta.tasks.refresh_plan_snapshot", stage_at(tasks.refresh_plan_snapshot)
+    )
+
+    process_zip_import(importacion.id)
+
+    importacion.refresh_from_db()
+    assert etapas == ["classifying", "plan"]
+    assert importacion.progress_stage == "done"
+
+
+@pytest.mark.django_db
+def test_importacion_progress_json(client, django_assert_num_queries):
+    importacion = Importacion.objects.create(status=Importacion.Status.RUNNING)
+    progress = ProgressReporter(importacion.id, interval=3600)
+    progress.start("processing", total=10)
+    progress.advance(4, errors=1)
+
+    response = client.get(f"/ingesta/importaciones/{importacion.id}/progress.json")
+    assert response.json()["processed"] == 0
+
+    progress.flush()
+    with django_assert_num_queries(1):
+        response = client.get(f"/ingesta/importaciones/{importacion.id}/progress.json")
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "RUNNING"
+    assert data["stage"] == "processing"
+    assert data["stage_label"] == "Procesando XML"
+    assert data["total"] == 10
+    assert data["processed"] == 4
+    assert data["errors"] == 1
+
+
+@pytest.mark.django_db
+def test_migracion_log_json_a_importacion_archivo():
+    migration = importlib.import_module("ingesta.migrations.0006_importacionarchivo")
+    proveedor = Proveedor.objects.create(ruc="1790000000001")
+    factura = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-MIG-1")
+    antigua = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-MIG-2")
+    ArchivoFactura.objects.create(factura=antigua, s3_key_xml="1790000000001/old.xml")
+    importacion = Importacion.objects.create(
+        log_json={
+            "files": [
+                {
+                    "filename": "a.xml",
+                    "warnings": ["w"],
+                    "errors": [],
+                    "factura_id": factura.id,
+                },
+                {"filename": "roto.xml", "warnings": [], "errors": ["XML inválido"]},
+                {"filename": "old.xml", "s3_key": "1790000000001/old.xml"},
+            ],
+            "fatal": "boom",
+        }
+    )
+
+    migration.forwards(django_apps, None)
+
+    importacion.refresh_from_db()
+    assert importacion.log_json == {"fatal": "boom"}
+    files = _file_logs(importacion)
+    assert [entry["filename"] for entry in files] == ["a.xml", "roto.xml", "old.xml"]
+    assert [entry["factura_id"] for entry in files] == [factura.id, None, antigua.id]
+    assert files[0]["warnings"] == ["w"]
+    assert files[1]["errors"] == ["XML inválido"]
+
+    migration.backwards(django_apps, None)
+
+    importacion.refresh_from_db()
+    assert importacion.log_json["files"][0]["factura_id"] == factura.id
+    assert importacion.log_json["fatal"] == "boom"
 
 
 @pytest.mark.django_db
@@ -225,7 +1117,7 @@ def test_importacion_detail_muestra_sugerencias_con_factura_id(client):
         categoria_sugerida=categoria,
         confianza=Confianza.HIGH,
     )
-    importacion = Importacion.objects.create(log_json={"files": [{"factura_id": factura.id}]})
+    importacion = _importacion_con_facturas(factura.id)
 
     response = client.get(f"/ingesta/importaciones/{importacion.id}/")
 
@@ -238,7 +1130,10 @@ def test_importacion_detail_muestra_sugerencias_con_factura_id(client):
 
 @pytest.mark.django_db
 def test_importacion_detail_muestra_fallback_sin_factura_id(client):
-    importacion = Importacion.objects.create(log_json={"files": [{"filename": "factura.xml"}]})
+    importacion = Importacion.objects.create()
+    ImportacionArchivo.objects.create(
+        importacion=importacion, position=0, filename="factura.xml"
+    )
 
     response = client.get(f"/ingesta/importaciones/{importacion.id}/")
 
@@ -273,14 +1168,8 @@ def test_importacion_detail_resumen_por_categoria(client):
         categoria_sugerida=None,
         confianza=Confianza.LOW,
     )
-    importacion = Importacion.objects.create(
-        log_json={
-            "files": [
-                {"factura_id": factura_uno.id},
-                {"factura_id": factura_dos.id},
-                {"factura_id": factura_tres.id},
-            ]
-        }
+    importacion = _importacion_con_facturas(
+        factura_uno.id, factura_dos.id, factura_tres.id
     )
 
     response = client.get(f"/ingesta/importaciones/{importacion.id}/")
@@ -335,20 +1224,14 @@ def test_importacion_export_csv(client):
         categoria_sugerida=None,
         confianza=Confianza.LOW,
     )
-    importacion = Importacion.objects.create(
-        log_json={
-            "files": [
-                {"factura_id": factura_uno.id},
-                {"factura_id": factura_dos.id},
-            ]
-        }
-    )
+    importacion = _importacion_con_facturas(factura_uno.id, factura_dos.id)
 
     response = client.get(f"/ingesta/importaciones/{importacion.id}/export.csv")
 
     assert response.status_code == 200
+    assert response.streaming
     assert "text/csv" in response["Content-Type"]
-    content = response.content.decode("utf-8")
+    content = b"".join(response.streaming_content).decode("utf-8")
     assert "ruc,razon_social,clave_acceso,categoria_sugerida,confianza" in content
     assert "SALUD" in content
     assert "Sin categoría" in content
@@ -356,6 +1239,209 @@ def test_importacion_export_csv(client):
     assert "CLAVE-CSV-2" in content
 
 
+@pytest.mark.django_db
+def test_importacion_export_csv_sin_limite_y_gzip(client, settings):
+    settings.EXPORT_CSV_CHUNK_SIZE = 7
+    proveedor = Proveedor.objects.create(ruc="777", razon_social="Proveedor CSV")
+    facturas = [
+        Factura.objects.create(proveedor=proveedor, clave_acceso=f"CLAVE-GZ-{i:03d}")
+        for i in range(60)
+    ]
+    importacion = _importacion_con_facturas(
+        *[factura.id for factura in facturas], facturas[0].id
+    )
+    url = f"/ingesta/importaciones/{importacion.id}/export.csv"
+
+    plain = client.get(url)
+    lines = b"".join(plain.streaming_content).decode("utf-8").splitlines()
+    assert len(lines) == 61
+    assert lines[1] == "777,Proveedor CSV,CLAVE-GZ-000,Sin categoría,-"
+    assert lines[-1].startswith("777,Proveedor CSV,CLAVE-GZ-059,")
+
+    compressed = client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+    assert compressed["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed["Vary"]
+    body = gzip.decompress(b"".join(compressed.streaming_content))
+    assert body.decode("utf-8").splitlines() == lines
+
+
+@pytest.fixture
+def memory_storage(settings):
+    settings.STORAGE_BACKEND = "memory"
+    reset_storage()
+    yield
+    reset_storage()
+
+
+@pytest.mark.django_db
+def test_exportacion_asincrona_reutiliza_y_descarga(
+    monkeypatch, settings, memory_storage
+):
+    settings.EXPORT_BATCH_SIZE = 2
+    client = Client(enforce_csrf_checks=True)
+    raw_token = "export-token"
+    AgentToken.objects.create(
+        token_hash=hash_token(raw_token),
+        expires_at=timezone.now() + timedelta(hours=1),
+    )
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {raw_token}"}
+    enqueued: list[int] = []
+    monkeypatch.setattr(
+        "ingesta.views.export_facturas.delay", lambda job_id: enqueued.append(job_id)
+    )
+    proveedor = Proveedor.objects.create(ruc="1790012345001", razon_social="Anual")
+    categoria = Categoria.objects.create(nombre="SALUD")
+    facturas = [
+        Factura.objects.create(
+            proveedor=proveedor,
+            clave_acceso=f"CLAVE-EXP-{index}",
+            fecha_emision=date(2024, index + 1, 15),
+            total=Decimal("11.50"),
+            iva=Decimal("1.50"),
+        )
+        for index in range(5)
+    ]
+    Factura.objects.create(
+        proveedor=proveedor, clave_acceso="CLAVE-EXP-2023", fecha_emision=date(2023, 6, 1)
+    )
+    asignacion = AsignacionClasificacionFactura.objects.create(
+        factura=facturas[0], categoria_sugerida=categoria, confianza=Confianza.HIGH
+    )
+    body = {"formato": "jsonl", "fecha_desde": "2024-01-01", "fecha_hasta": "2024-12-31"}
+
+    created = client.post(
+        "/ingesta/exportaciones/", data=body, content_type="application/json", **auth
+    )
+    assert created.status_code == 202
+    job_id = created.json()["id"]
+    assert enqueued == [job_id]
+    export_facturas(job_id)
+
+    status = client.get(created.json()["status_url"], **auth).json()
+    assert status["status"] == ExportJob.Status.DONE
+    assert (status["processed"], status["total"]) == (5, 5)
+    download = client.get(status["download_url"], **auth)
+    rows = [
+        json.loads(line)
+        for line in gzip.decompress(b"".join(download.streaming_content)).splitlines()
+    ]
+    assert [row["clave_acceso"] for row in rows] == [f"CLAVE-EXP-{i}" for i in range(5)]
+    assert rows[0]["categoria"] == "SALUD"
+    assert rows[0]["total"] == "11.50"
+    assert rows[1]["categoria"] is None
+
+    reused = client.post(
+        "/ingesta/exportaciones/", data=body, content_type="application/json", **auth
+    )
+    assert reused.status_code == 200
+    assert reused.json()["id"] == job_id
+    assert enqueued == [job_id]
+
+    asignacion.confianza = Confianza.LOW
+    asignacion.save()
+    changed = client.post(
+        "/ingesta/exportaciones/", data=body, content_type="application/json", **auth
+    )
+    assert changed.status_code == 202
+    assert changed.json()["id"] != job_id
+
+    invalid = client.post(
+        "/ingesta/exportaciones/",
+        data={"fecha_desde": "2024-13-01"},
+        content_type="application/json",
+        **auth,
+    )
+    assert invalid.status_code == 400
+
+
+@pytest.mark.django_db
+def test_exportacion_exige_token_y_respeta_su_importacion(monkeypatch):
+    monkeypatch.setattr("ingesta.views.export_facturas.delay", lambda job_id: None)
+    client = Client(enforce_csrf_checks=True)
+    propia = Importacion.objects.create()
+    ajena = Importacion.objects.create()
+    raw_token = "export-limitado"
+    AgentToken.objects.create(
+        token_hash=hash_token(raw_token),
+        expires_at=timezone.now() + timedelta(hours=1),
+        allowed_importacion=propia,
+    )
+    auth = {"HTTP_AUTHORIZATION": f"Bearer {raw_token}"}
+
+    def crear(body: dict, **extra):
+        return client.post(
+            "/ingesta/exportaciones/", data=body, content_type="application/json", **extra
+        )
+
+    assert crear({}).status_code == 401
+    assert crear({}, **auth).status_code == 403
+    assert crear({"importacion_ids": [ajena.id]}, **auth).status_code == 403
+    created = crear({"importacion_ids": [propia.id]}, **auth)
+    assert created.status_code == 202
+    assert client.get(created.json()["status_url"]).status_code == 401
+    assert client.get(created.json()["status_url"], **auth).status_code == 200
+
+    ajeno, _reused = request_export("csv", {"importacion_ids": [ajena.id]})
+    assert client.get(f"/ingesta/exportaciones/{ajeno.id}.json", **auth).status_code == 403
+
+
+@pytest.mark.django_db
+def test_exportacion_csv_por_importaciones(memory_storage):
+    proveedor = Proveedor.objects.create(ruc="1790012345001", razon_social=None)
+    incluida = Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-IMP-1")
+    Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-IMP-2")
+    importacion = _importacion_con_facturas(incluida.id)
+
+    job, reused = request_export("csv", {"importacion_ids": [importacion.id]})
+    run_export(job.id)
+    job.refresh_from_db()
+
+    assert not reused
+    assert job.status == ExportJob.Status.DONE
+    lines = gzip.decompress(download_bytes(job.s3_key)).decode("utf-8").splitlines()
+    assert lines[0].startswith("factura_id,clave_acceso,fecha_emision,proveedor_ruc")
+    assert len(lines) == 2
+    assert ",CLAVE-IMP-1,,1790012345001,," in lines[1]
+
+
+@pytest.mark.django_db
+def test_exportacion_no_reutiliza_tras_importacion_fallida(memory_storage):
+    proveedor = Proveedor.objects.create(ruc="1790012345001", razon_social=None)
+    Factura.objects.create(proveedor=proveedor, clave_acceso="CLAVE-FAIL-1")
+    job, _reused = request_export("csv", {})
+    run_export(job.id)
+
+    # A failed import still committed its first batches.
+    Factura.objects.filter(clave_acceso="CLAVE-FAIL-1").update(total=Decimal("9.99"))
+    Importacion.objects.create(
+        status=Importacion.Status.FAILED, finished_at=timezone.now()
+    )
+
+    nuevo, reused = request_export("csv", {})
+    assert not reused
+    assert nuevo.id != job.id
+
+
+@pytest.mark.django_db
+def test_exportacion_no_reutiliza_trabajo_detenido(settings):
+    settings.EXPORT_STALE_AFTER = 60
+    activo, _reused = request_export("csv", {})
+    assert request_export("csv", {}) == (activo, True)
+
+    ExportJob.objects.filter(id=activo.id).update(
+        status=ExportJob.Status.RUNNING,
+        started_at=timezone.now() - timedelta(minutes=5),
+        progress_updated_at=timezone.now() - timedelta(minutes=5),
+    )
+    nuevo, reused = request_export("csv", {})
+
+    assert not reused
+    assert nuevo.id != activo.id
+    activo.refresh_from_db()
+    assert activo.status == ExportJob.Status.FAILED
+    assert request_export("csv", {}) == (nuevo, True)
+
+
 @pytest.mark.django_db
 def test_importacion_export_plan_json(client):
     proveedor_ruc = "1790012345001"
@@ -373,14 +1459,7 @@ def test_importacion_export_plan_json(client):
         categoria_sugerida=None,
         confianza=Confianza.LOW,
     )
-    importacion = Importacion.objects.create(
-        log_json={
-            "files": [
-                {"factura_id": factura_uno.id},
-                {"factura_id": factura_dos.id},
-            ]
-        }
-    )
+    importacion = _importacion_con_facturas(factura_uno.id, factura_dos.id)
 
     response = client.get(f"/ingesta/importaciones/{importacion.id}/plan.json")
 
@@ -419,3 +1498,130 @@ def test_revisar_incluye_low_o_sin_categoria(client):
     content = response.content.decode("utf-8")
     assert "CLAVE-LOW-1" in content
     assert "CLAVE-NONE-1" in content
+
+
+class _RangeClient:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.ranges: list[str] = []
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self.data)}
+
+    def get_object(self, Bucket, Key, Range):
+        self.ranges.append(Range)
+        start, end = Range.removeprefix("bytes=").split("-")
+        return {"Body": io.BytesIO(self.data[int(start) : int(end) + 1])}
+
+
+def test_s3_range_file_lee_zip_por_rangos():
+    zip_bytes = _build_zip_with_factura(
+        ruc="1790012345001",
+        clave="CLAVE-RANGE-001",
+        razon_social="Proveedor Rango",
+    )
+    client = _RangeClient(zip_bytes)
+    stream = io.BufferedReader(S3RangeFile("imports/1/source.zip", client), 64)
+
+    with zipfile.ZipFile(stream) as zf:
+        parsed, _warnings = parse_xml_bytes(zf.read("factura.xml"))
+
+    assert parsed.clave_acceso == "CLAVE-RANGE-001"
+    assert client.ranges
+    assert f"bytes=0-{len(zip_bytes) - 1}" not in client.ranges
+
+
+def test_ensure_bucket_se_cachea_por_proceso(monkeypatch):
+    calls: list[str] = []
+
+    class _Client:
+        def head_bucket(self, Bucket):
+            calls.append(Bucket)
+
+    s3_client.reset_client()
+    monkeypatch.setattr("ingesta.services.s3_client.get_client", lambda: _Client())
+
+    s3_client.ensure_bucket()
+    s3_client.ensure_bucket()
+
+    assert len(calls) == 1
+    s3_client.reset_client()
+
+
+@pytest.mark.parametrize("backend", ["memory", "local"])
+def test_storage_put_get_rangos_y_listado(backend, tmp_path):
+    storage = MemoryStorage() if backend == "memory" else LocalStorage(tmp_path)
+    storage.ensure_ready()
+
+    storage.put("imports/1/a.xml", b"<factura/>", "application/xml")
+    storage.put_fileobj(io.BytesIO(b"0123456789"), "imports/1/b.bin")
+    storage.put("imports/2/c.xml", b"otro")
+
+    assert storage.get("imports/1/a.xml") == b"<factura/>"
+    assert storage.get_range("imports/1/b.bin", 2, 5) == b"234"
+    assert storage.get_range("imports/1/b.bin", 5, 5) == b""
+    assert storage.size("imports/1/b.bin") == 10
+    assert storage.exists("imports/1/a.xml")
+    assert not storage.exists("imports/1/falta.xml")
+    assert list(storage.list("imports/1/")) == ["imports/1/a.xml", "imports/1/b.bin"]
+    with storage.open("imports/1/b.bin") as reader:
+        reader.seek(-3, io.SEEK_END)
+        assert reader.read() == b"789"
+
+
+def test_storage_incompleto_falla_al_instanciar():
+    class SoloLectura(Storage):
+        def get(self, key: str) -> bytes:
+            return b""
+
+    with pytest.raises(TypeError, match="put"):
+        SoloLectura()
+
+
+def test_local_storage_lee_zip_via_mmap_y_rechaza_rutas_externas(tmp_path):
+    zip_bytes = _build_zip_with_factura(
+        ruc="1790012345001",
+        clave="CLAVE-LOCAL-001",
+        razon_social="Proveedor Local",
+    )
+    storage = LocalStorage(tmp_path / "storage")
+    storage.ensure_ready()
+    storage.put_fileobj(io.BytesIO(zip_bytes), "imports/1/source.zip")
+
+    with storage.open("imports/1/source.zip") as stream:
+        with zipfile.ZipFile(io.BufferedReader(stream)) as zf:
+            parsed, _warnings = parse_xml_bytes(zf.read("factura.xml"))
+
+    assert parsed.clave_acceso == "CLAVE-LOCAL-001"
+    assert not list((tmp_path / "storage" / "imports" / "1").glob(".tmp-*"))
+    with pytest.raises(ValueError):
+        storage.put("../fuera.xml", b"x")
+
+
+def test_xml_uploader_limita_bytes_en_vuelo_y_propaga_errores():
+    lock = threading.Lock()
+    state = {"inflight": 0, "max": 0}
+    uploaded: list[str] = []
+
+    def fake_upload(xml_bytes, key):
+        with lock:
+            state["inflight"] += len(xml_bytes)
+            state["max"] = max(state["max"], state["inflight"])
+        time.sleep(0.01)
+        with lock:
+            state["inflight"] -= len(xml_bytes)
+            uploaded.append(key)
+        if key == "falla.xml":
+            raise RuntimeError("S3 caído")
+        return key
+
+    with XmlUploader(upload=fake_upload, workers=4, max_inflight_bytes=20) as uploader:
+        for index in range(8):
+            uploader.submit(b"x" * 10, f"{index}.xml")
+        uploader.wait()
+        assert len(uploaded) == 8
+        assert state["max"] <= 20
+
+        uploader.submit(b"x", "falla.xml")
+        with pytest.raises(RuntimeError):
+            uploader.wait()